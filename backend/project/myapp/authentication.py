@@ -1,5 +1,7 @@
+from urllib.parse import parse_qs
+
 from rest_framework_simplejwt.authentication import JWTAuthentication
-from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 from .models import Driver, Conductor
 
 
@@ -26,3 +28,23 @@ class DriverJWTAuthentication(JWTAuthentication):
 
         except (Driver.DoesNotExist, Conductor.DoesNotExist):
             raise InvalidToken("User not found")
+
+
+def authenticate_scope(scope):
+    """
+    (user, role) for the access token of a WebSocket or SSE connection, or None.
+    Browsers cannot set headers on WebSockets, so ?token= is accepted as well
+    as an Authorization: Bearer header. Synchronous: it reads the database.
+    """
+    raw = parse_qs(scope.get('query_string', b'').decode()).get('token', [None])[0]
+    if not raw:
+        header = dict(scope.get('headers') or []).get(b'authorization', b'').decode()
+        scheme, _, raw = header.partition(' ')
+        if scheme.lower() != 'bearer':
+            return None
+    authentication = DriverJWTAuthentication()
+    try:
+        token = authentication.get_validated_token(raw)
+        return authentication.get_user(token), token.get('role', 'driver')
+    except (InvalidToken, TokenError):
+        return None
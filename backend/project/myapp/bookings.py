@@ -0,0 +1,198 @@
+"""
+Booking state changes.
+
+Accepting or rejecting is one conditional UPDATE ... WHERE status = 'pending',
+so when several drivers (or several taps) race for the same request exactly
+one of them changes it, without row locks. A rider holds at most one accepted
+booking: the partial unique index booking_one_accepted_per_user enforces that
+in the database, so requests the rider sent to several drivers cannot be
+accepted twice either.
+
+The booked vehicle comes from the denormalized Driver.vehicle_type /
+vehicle_id, read together with the booking, so acceptance costs three
+queries whatever the vehicle type.
+
+Every change is published after commit to the driver's channel group
+(BookingConsumer), so the driver app is told about new requests instead of
+polling for them. It is also published to the rider's group and to the
+booking's own group, which the rider-side SSE stream (booking_events) follows.
+
+Requests nobody answers expire: expire_pending_bookings (run by the
+expire_bookings command) moves bookings pending for longer than
+BOOKING_PENDING_TTL to 'expired', oldest first, BOOKING_EXPIRY_BATCH_SIZE rows
+per UPDATE and transaction, so the pending lists and partial index stay small.
+Rows a driver is deciding at the same moment are skipped (SKIP LOCKED where
+the database has it), and the conditional UPDATE in decide_booking means an
+expired booking can no longer be accepted.
+"""
+
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.fields import DateTimeField
+
+from .cache import invalidate
+from .models import Bike, BookingRequest, Bus, Car
+
+VEHICLE_MODELS = {'bus': Bus, 'car': Car, 'bike': Bike}
+
+
+def pending_ttl():
+    return getattr(settings, 'BOOKING_PENDING_TTL', 600)
+
+
+def expiry_batch_size():
+    return getattr(settings, 'BOOKING_EXPIRY_BATCH_SIZE', 500)
+
+
+def expiry_interval():
+    return getattr(settings, 'BOOKING_EXPIRY_INTERVAL', 30)
+
+# A booking as the list endpoints return it (BookingRequest.objects.values())
+BOOKING_FIELDS = ('id', 'user_id', 'drivers_id', 'from_address', 'to_address', 'status', 'created_at')
+
+
+def driver_group(driver_id):
+    return f"bookings.driver.{driver_id}"
+
+
+def rider_group(user_id):
+    return f"bookings.rider.{user_id}"
+
+
+def booking_group(booking_id):
+    return f"bookings.booking.{booking_id}"
+
+
+def booking_row(booking):
+    """BOOKING_FIELDS of a BookingRequest instance, as values() would return them."""
+    return {field: getattr(booking, field) for field in BOOKING_FIELDS}
+
+
+def booking_payload(row):
+    """A BOOKING_FIELDS row, with created_at rendered as the API renders it."""
+    payload = {field: row[field] for field in BOOKING_FIELDS}
+    payload['created_at'] = DateTimeField().to_representation(payload['created_at'])
+    return payload
+
+
+def booking_groups(booking):
+    return [driver_group(booking['drivers_id']), rider_group(booking['user_id']), booking_group(booking['id'])]
+
+
+async def group_send_bookings(event, bookings):
+    layer = get_channel_layer()
+    for booking in bookings:
+        message = {"type": "booking_event", "event": event, "booking": booking}
+        for group in booking_groups(booking):
+            await layer.group_send(group, message)
+
+
+def send_booking_events(event, bookings):
+    try:
+        # One event loop round trip for the whole batch
+        async_to_sync(group_send_bookings)(event, bookings)
+    except Exception as e:
+        # The change is committed either way; the app still sees it on its next fetch
+        print(f"❌ Booking events failed for bookings {', '.join(str(b['id']) for b in bookings)}: {str(e)}")
+
+
+def publish_booking_events(event, rows):
+    """Send `event` ("created", "accepted", "rejected", "expired") about bookings once the transaction commits."""
+    bookings = [booking_payload(row) for row in rows]
+    transaction.on_commit(lambda: send_booking_events(event, bookings))
+
+
+def publish_booking_event(event, row):
+    publish_booking_events(event, [row])
+
+
+class BookingAlreadyDecided(Exception):
+    pass
+
+
+class RiderHasActiveBooking(Exception):
+    pass
+
+
+def decide_booking(booking_id, status, vehicle_type=None):
+    """
+    Move a pending booking to `status` ('accepted' or 'rejected'). On
+    acceptance, mark the driver's assigned vehicle as booked, provided it is a
+    `vehicle_type` when one is given. Returns the type of the vehicle marked,
+    or None. Raises BookingRequest.DoesNotExist, BookingAlreadyDecided or
+    RiderHasActiveBooking.
+    """
+    try:
+        with transaction.atomic():
+            if not BookingRequest.objects.filter(pk=booking_id, status='pending').update(status=status):
+                current = BookingRequest.objects.filter(pk=booking_id).values_list('status', flat=True).first()
+                if current is None:
+                    raise BookingRequest.DoesNotExist
+                raise BookingAlreadyDecided(f"Booking already {current}")
+            invalidate(BookingRequest)
+            row = BookingRequest.objects.filter(pk=booking_id).values(
+                *BOOKING_FIELDS, 'drivers__vehicle_type', 'drivers__vehicle_id',
+            ).get()
+            publish_booking_event(status, row)
+            if status != 'accepted':
+                return None
+
+            driver_id, assigned_type, vehicle_id = (
+                row['drivers_id'], row['drivers__vehicle_type'], row['drivers__vehicle_id'],
+            )
+            model = VEHICLE_MODELS.get(assigned_type)
+            if model is None or (vehicle_type and vehicle_type != assigned_type):
+                return None
+            # Also matched on driver, in case the denormalized vehicle_id is stale
+            if not model.objects.filter(pk=vehicle_id, driver_id=driver_id).update(
+                is_booked=True, updated_at=timezone.now(),
+            ):
+                return None
+            invalidate(model)
+            return assigned_type
+    except IntegrityError:
+        raise RiderHasActiveBooking('This user already has an active ride with another driver.')
+
+
+def expire_pending_bookings(ttl=None, batch_size=None):
+    """
+    Expire bookings pending for more than `ttl` seconds, `batch_size` rows per
+    UPDATE, and publish an "expired" event for each. Returns (bookings
+    expired, batches run).
+    """
+    cutoff = timezone.now() - timedelta(seconds=pending_ttl() if ttl is None else ttl)
+    batch_size = batch_size or expiry_batch_size()
+    expired = batches = 0
+    while True:
+        with transaction.atomic():
+            # Oldest first off booking_status_created_idx
+            rows = list(
+                BookingRequest.objects.select_for_update(skip_locked=True)
+                .filter(status='pending', created_at__lt=cutoff)
+                .order_by('created_at')
+                .values(*BOOKING_FIELDS)[:batch_size]
+            )
+            if not rows:
+                break
+            ids = [row['id'] for row in rows]
+            changed = rows
+            if BookingRequest.objects.filter(pk__in=ids, status='pending').update(status='expired') != len(rows):
+                # Without row locks a driver may have decided some in between
+                expired_ids = set(
+                    BookingRequest.objects.filter(pk__in=ids, status='expired').values_list('id', flat=True)
+                )
+                changed = [row for row in rows if row['id'] in expired_ids]
+            for row in changed:
+                row['status'] = 'expired'
+            invalidate(BookingRequest)
+            publish_booking_events('expired', changed)
+        expired += len(changed)
+        batches += 1
+        if len(rows) < batch_size:
+            break
+    return expired, batches
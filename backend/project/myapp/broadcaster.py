@@ -0,0 +1,188 @@
+"""
+Tick-based coalescing of live location broadcasts.
+
+Consumers hand every inbound ping to the process-wide LocationBroadcaster
+instead of calling group_send themselves. Pings are buffered per vehicle
+(latest wins) and flushed as one batch_location_update frame per tick, so
+the outbound message rate no longer grows with the number of drivers.
+
+Each tick sends one frame to the fleet-wide group, plus one per grid cell
+that saw movement (see geo.py) and one per topic with changes (see
+topics.py), so each frame only reaches the sockets interested in it.
+
+Frames are serialised here, once per wire format, and consumers forward the
+pre-encoded payload: the cost of a broadcast no longer grows with the number
+of sockets that receive it.
+"""
+
+import asyncio
+import time
+from collections import defaultdict
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .dispatch import get_dispatch_index
+from .geo import entry_cell_group
+from .location_history import LocationHistoryWriter
+from .location_store import get_location_store, location_key
+from .persistence import RuntimeDataWriter
+from .topics import resolve_route_ids, topic_groups
+from .wire_formats import encode_all
+
+GROUP_NAME = "location_updates"
+
+
+class LocationBroadcaster:
+    # Stale vehicles are swept at most this often (seconds)
+    eviction_interval = 5
+
+    def __init__(self, tick=None):
+        self.tick = tick if tick is not None else getattr(settings, 'LOCATION_BROADCAST_TICK', 0.5)
+        self.channel_layer = get_channel_layer()
+        self.store = get_location_store()
+        # Off for load tests, whose fake drivers must not overwrite real positions
+        self.persist = getattr(settings, 'LOCATION_PERSIST', True)
+        # Latest positions reach the *RuntimeData tables every few seconds
+        self.writer = RuntimeDataWriter()
+        # Every ping, coalesced or not, is appended to LocationPing in batches
+        self.history = LocationHistoryWriter()
+        # Nearest-driver lookups in this worker see our pings without a resync
+        self.dispatch = get_dispatch_index()
+        self.pending = {}  # (vehicle_type, id) -> latest entry this tick
+        self.next_eviction = 0.0
+        self.task = None
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run())
+        if self.persist:
+            self.writer.start()
+            self.history.start()
+
+    def push(self, entry):
+        """Queue a validated ping for the history and the next tick (latest per vehicle wins)."""
+        if self.persist:
+            self.history.record(entry)
+        self.pending[location_key(entry)] = entry
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                await self.flush()
+            except Exception as e:
+                # A failed tick must not kill the loop for every later tick
+                print(f"❌ Location broadcast failed: {str(e)}")
+
+    async def flush(self):
+        """Write the buffered pings to the store and send one coalesced frame per group."""
+        await self.evict_stale_vehicles()
+        if not self.pending:
+            return
+        entries, self.pending = list(self.pending.values()), {}
+
+        try:
+            changed = await self.store.upsert_many(entries)
+        except Exception:
+            # Retried next tick, unless the vehicle has pinged again meanwhile
+            for entry in entries:
+                self.pending.setdefault(location_key(entry), entry)
+            raise
+        if not changed:
+            return  # Nothing changed, nothing to fan out
+        if self.persist:
+            self.writer.push(entry for entry, _ in changed)
+        self.dispatch.update(entry for entry, _ in changed)
+
+        routes = await resolve_route_ids([location_key(entry) for entry, _ in changed])
+        updates = defaultdict(list)
+        left = defaultdict(list)
+        for entry, previous in changed:
+            updates[GROUP_NAME].append(entry)
+            for topic in topic_groups(entry, routes[location_key(entry)]):
+                updates[topic].append(entry)
+            group = entry_cell_group(entry)
+            if group:
+                updates[group].append(entry)
+            old_group = entry_cell_group(previous) if previous else None
+            if old_group and old_group != group:
+                # Viewers of the old cell must drop the vehicle
+                left[old_group].append(vehicle_ref(entry))
+
+        # Channel layers deliver in send order, so a vehicle moving between two
+        # cells a client watches is removed before it is re-added
+        await self.send_frames("vehicle_left", left)
+        await self.send_frames("batch_location_update", updates)
+
+    async def evict_stale_vehicles(self, force=False):
+        """Drop vehicles that stopped pinging and tell clients they went offline."""
+        now = time.monotonic()
+        if not force and now < self.next_eviction:
+            return
+        self.next_eviction = now + self.eviction_interval
+
+        evicted = await self.store.evict()
+        if not evicted:
+            return
+        self.dispatch.remove(evicted)
+        routes = await resolve_route_ids([location_key(entry) for entry in evicted])
+        offline = defaultdict(list)
+        for entry in evicted:
+            offline[GROUP_NAME].append(vehicle_ref(entry))
+            for topic in topic_groups(entry, routes[location_key(entry)]):
+                offline[topic].append(vehicle_ref(entry))
+            group = entry_cell_group(entry)
+            if group:
+                offline[group].append(vehicle_ref(entry))
+        await self.send_frames("vehicle_offline", offline)
+
+    async def send_frames(self, message_type, frames):
+        """group_send one frame per group, each stamped with that group's next seq."""
+        if not frames:
+            return
+        try:
+            # Numbering and sending as one step across workers: a frame numbered
+            # after another worker's is also sent after it, so clients see no false gaps
+            async with self.store.sequence_lock():
+                seqs = await self.store.next_sequences(list(frames))
+                for group, data in frames.items():
+                    await self.channel_layer.group_send(
+                        group,
+                        {
+                            "type": message_type,
+                            # Encoded once here, forwarded as is by every consumer
+                            "encoded": encode_all({
+                                "type": message_type,
+                                "group": group,
+                                "seq": seqs[group],
+                                "data": data
+                            })
+                        }
+                    )
+        except Exception as e:
+            # The store already holds these changes, so resending them next tick
+            # would find nothing new. Skip a sequence number instead: clients see
+            # the gap and resync to a snapshot that includes them
+            print(f"❌ Sending {message_type} frames failed, skipping a seq: {str(e)}")
+            await self.store.next_sequences(list(frames))
+
+
+def vehicle_ref(entry):
+    return {"id": entry["id"], "vehicle_type": entry["vehicle_type"]}
+
+
+_broadcasters = {}
+
+
+def get_broadcaster():
+    """Return the running broadcaster for the current event loop, starting it if needed."""
+    loop = asyncio.get_running_loop()
+    broadcaster = _broadcasters.get(loop)
+    if broadcaster is None:
+        # Drop broadcasters of loops that have gone away (e.g. between tests)
+        for stale in [l for l in _broadcasters if l.is_closed()]:
+            del _broadcasters[stale]
+        broadcaster = _broadcasters[loop] = LocationBroadcaster()
+    broadcaster.start()
+    return broadcaster
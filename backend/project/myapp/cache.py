@@ -0,0 +1,182 @@
+"""
+Response cache for read-mostly fleet and route endpoints.
+
+Cached responses are keyed by path, query string and the current version of
+every model the view reads. Saving or deleting one of those models bumps its
+version (post_save / post_delete below), as does deleting a row they point
+to with on_delete=SET_NULL, so stale entries are never read again and simply
+expire. Versions are the time of the last change in nanoseconds, which
+conditional.py also uses for Last-Modified. Hits and misses are counted per
+view in the cache itself, so every worker contributes to the numbers served
+by cache_stats.
+
+The cache fails open: if the backend is unreachable the view just runs.
+"""
+
+import functools
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import SET_DEFAULT, SET_NULL
+from django.db.models.signals import post_delete, post_save
+from rest_framework.response import Response
+
+from .models import (
+    Bike, BikeRoute, BikeRuntimeData, BookingRequest, Bus, BusCheckpoint, BusRoute, BusRuntimeData, Car, CarRoute,
+    CarRuntimeData, Driver,
+)
+
+CACHED_MODELS = [Bus, Car, Bike, BusRoute, CarRoute, BikeRoute, BusCheckpoint]
+# Also versioned for ETags, but too write-heavy to cache responses for
+# (RuntimeData is written with bulk_update, see invalidate() in persistence.py)
+VERSIONED_MODELS = CACHED_MODELS + [Driver, BookingRequest, BusRuntimeData, CarRuntimeData, BikeRuntimeData]
+RESPONSE_TIMEOUT = 300  # seconds; invalidation is by version, this only bounds memory
+STATS_TIMEOUT = None  # Keep counters until the cache is flushed
+
+# Views registered with cached_response, for cache_stats
+cached_views = []
+
+
+def version_key(model):
+    return f"version:{model._meta.label_lower}"
+
+
+def new_version(key):
+    # Taken from the clock, so a version key evicted from the cache can never
+    # come back with a value that older responses were cached under
+    cache.add(key, time.time_ns(), None)
+    return cache.get(key)
+
+
+def model_versions(models):
+    """Current version of each model, in order (one cache round trip)."""
+    keys = [version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    return [versions.get(key) or new_version(key) for key in keys]
+
+
+def bump_version(key):
+    try:
+        cache.set(key, time.time_ns(), None)
+    except Exception as e:
+        print(f"❌ Cache version bump failed for {key}: {str(e)}")
+
+
+def model_changed(sender, **kwargs):
+    # After commit: bumping earlier would let a concurrent reader cache the
+    # pre-commit rows under the new version
+    key = version_key(sender)
+    transaction.on_commit(lambda: bump_version(key))
+
+
+def invalidate(*models):
+    """Bump versions after writes that send no post_save, e.g. QuerySet.update()."""
+    for model in models:
+        model_changed(model)
+
+
+def set_null_dependents(versioned):
+    """
+    {model: [versioned models]} for foreign keys with on_delete=SET_NULL /
+    SET_DEFAULT. Deleting the target rewrites the referring rows with a
+    QuerySet.update(), which sends no post_save (e.g. deleting a Driver
+    clears Bus.driver).
+    """
+    dependents = {}
+    for model in versioned:
+        for field in model._meta.get_fields():
+            if field.concrete and field.is_relation and field.remote_field.on_delete in (SET_NULL, SET_DEFAULT):
+                dependents.setdefault(field.remote_field.model, []).append(model)
+    return dependents
+
+
+SET_NULL_DEPENDENTS = set_null_dependents(VERSIONED_MODELS)
+
+
+def referenced_deleted(sender, **kwargs):
+    for model in SET_NULL_DEPENDENTS[sender]:
+        model_changed(model)
+
+
+for _model in VERSIONED_MODELS:
+    post_save.connect(model_changed, sender=_model, dispatch_uid=f"cache-{_model.__name__}-save")
+    post_delete.connect(model_changed, sender=_model, dispatch_uid=f"cache-{_model.__name__}-delete")
+for _model in SET_NULL_DEPENDENTS:
+    post_delete.connect(referenced_deleted, sender=_model, dispatch_uid=f"cache-{_model.__name__}-dependents")
+
+
+def count(view_name, outcome):
+    key = f"stats:{view_name}:{outcome}"
+    try:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, 1, STATS_TIMEOUT)
+    except Exception:
+        pass
+
+
+def response_key(request, view_name, models):
+    version = '.'.join(str(version) for version in model_versions(models))
+    query = hashlib.md5(request.META.get('QUERY_STRING', '').encode()).hexdigest()
+    return f"response:{view_name}:{request.path}:{query}:{version}"
+
+
+def cached_response(*models, timeout=RESPONSE_TIMEOUT):
+    """
+    Cache a GET function view's 200 responses until one of `models` changes.
+    Apply below @api_view so the view still returns a DRF Response.
+    """
+    def decorator(view):
+        view_name = view.__name__
+        cached_views.append(view_name)
+
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET':
+                return view(request, *args, **kwargs)
+            try:
+                key = response_key(request, view_name, models)
+                cached = cache.get(key)
+            except Exception:
+                return view(request, *args, **kwargs)
+
+            if cached is not None:
+                count(view_name, 'hits')
+                data, headers = cached
+                response = Response(data, status=200)
+                for header, value in headers.items():
+                    response[header] = value
+                return response
+
+            count(view_name, 'misses')
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200:
+                headers = {header: response[header] for header in ('Link',) if response.has_header(header)}
+                try:
+                    cache.set(key, (response.data, headers), timeout)
+                except Exception:
+                    pass
+            return response
+
+        return wrapper
+    return decorator
+
+
+def hit_rates():
+    """{view: {"hits", "misses", "hit_rate"}} for every cached view."""
+    keys = [f"stats:{name}:{outcome}" for name in cached_views for outcome in ('hits', 'misses')]
+    counters = cache.get_many(keys)
+    stats = {}
+    for name in cached_views:
+        hits = counters.get(f"stats:{name}:hits", 0)
+        misses = counters.get(f"stats:{name}:misses", 0)
+        total = hits + misses
+        stats[name] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / total, 3) if total else None,
+        }
+    return stats
@@ -0,0 +1,91 @@
+"""
+Conditional GET (ETag / Last-Modified, 304 Not Modified) for read endpoints.
+
+A view's ETag is derived from the request path and the versions cache.py keeps
+for every model the view reads, which change on each save or delete. Polling
+clients that send If-None-Match or If-Modified-Since get an empty 304 without
+touching the database. If the cache is unreachable the ETag falls back to one
+aggregate query (row count, highest pk and newest updated_at / last_updated
+per model, as a single UNION ALL).
+"""
+
+import datetime
+import hashlib
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import CharField, Count, DateTimeField, Max, Value
+from django.views.decorators.http import condition
+
+from .cache import model_versions
+
+TIMESTAMP_FIELDS = ('updated_at', 'last_updated')
+
+
+def timestamp_field(model):
+    for name in TIMESTAMP_FIELDS:
+        try:
+            model._meta.get_field(name)
+            return name
+        except FieldDoesNotExist:
+            pass
+    return None
+
+
+def table_stats(models):
+    """{model label: (rows, max pk, newest timestamp or None)} in one query."""
+    parts = []
+    for model in models:
+        field = timestamp_field(model)
+        parts.append(
+            model.objects.order_by()
+            .annotate(label=Value(model._meta.label_lower, output_field=CharField()))
+            .values('label')
+            .annotate(
+                rows=Count('pk'),
+                max_pk=Max('pk'),
+                changed=Max(field) if field else Value(None, output_field=DateTimeField()),
+            )
+            .values_list('label', 'rows', 'max_pk', 'changed')
+        )
+    stats = parts[0].union(*parts[1:], all=True) if len(parts) > 1 else parts[0]
+    return {label: (rows, max_pk, changed) for label, rows, max_pk, changed in stats}
+
+
+def fingerprint(request, models):
+    """(etag, last_modified) for this request, computed once per request."""
+    cached = getattr(request, '_conditional_fingerprint', None)
+    if cached:
+        return cached
+
+    try:
+        versions = model_versions(models)
+    except Exception:
+        versions = [None] * len(models)
+
+    last_modified = None
+    if None not in versions:
+        # Versions are nanosecond timestamps of the last save/delete, so they
+        # cover deletions too and no query is needed
+        state = [str(version) for version in versions]
+        last_modified = datetime.datetime.fromtimestamp(max(versions) / 1e9, tz=datetime.timezone.utc)
+    else:
+        # Cache unavailable: fall back to the table stats (ETag only, since a
+        # deletion leaves no newer timestamp behind)
+        stats = table_stats(models)
+        state = [':'.join(str(value) for value in stats[model._meta.label_lower]) for model in models]
+
+    raw = '|'.join([request.get_full_path()] + state)
+    result = (hashlib.md5(raw.encode()).hexdigest(), last_modified)
+    request._conditional_fingerprint = result
+    return result
+
+
+def conditional_get(*models):
+    """
+    Add ETag / Last-Modified to a GET view and answer 304 when the client's
+    copy is current. Apply below @api_view (and above @cached_response).
+    """
+    return condition(
+        etag_func=lambda request, *args, **kwargs: fingerprint(request, models)[0],
+        last_modified_func=lambda request, *args, **kwargs: fingerprint(request, models)[1],
+    )
@@ -15,3 +15,19 @@ def get_role_choices():
     """Returns list of role values for use in ChoiceField."""
     return [choice[0] for choice in ROLE_CHOICES]
 
+
+# Vehicle categories a driver can be assigned to (see Driver.vehicle_type)
+VEHICLE_TYPE_CHOICES = [
+    ("bus", "Bus"),
+    ("car", "Car"),
+    ("bike", "Bike"),
+]
+
+VEHICLE_TYPES = [choice[0] for choice in VEHICLE_TYPE_CHOICES]
+
+# Compact small-int codes for vehicle types (msgpack frames, LocationPing rows)
+VEHICLE_TYPE_CODES = {vehicle_type: code for code, vehicle_type in enumerate(VEHICLE_TYPES)}
+
+# Driver ids as pings carry them; LocationPing.driver_id is a PositiveIntegerField,
+# a 32-bit integer on PostgreSQL
+MAX_DRIVER_ID = 2**31 - 1
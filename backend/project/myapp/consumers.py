@@ -1,62 +1,266 @@
 import json
+import math
+from django.conf import settings
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from .authentication import authenticate_scope
+from .bookings import BOOKING_FIELDS, booking_payload, driver_group
+from .broadcaster import GROUP_NAME, get_broadcaster
+from .constants import MAX_DRIVER_ID, VEHICLE_TYPES
+from .geo import MAX_LATITUDE, cell_group, cells_in_bbox, count_cells_in_bbox, parse_bbox
+from .location_store import get_location_store, location_key
+from .models import BookingRequest
+from .topics import MAX_TOPICS, drivers_on_route, fleet_group, parse_topic
+from .wire_formats import negotiate
 
 class BikeLocationConsumer(AsyncWebsocketConsumer):
-    groups = ["location_updates"]
-    
-    # Class-level storage for recent updates
-    recent_updates = []  # Now using a list to store all updates
-    
+    # Groups are managed per socket in set_groups(): subscribers swap the
+    # fleet-wide group for the cell and topic groups they asked for
+
     async def connect(self):
-        await self.accept()
-        await self.channel_layer.group_add("location_updates", self.channel_name)
-        await self.send(json.dumps({
-            "type": "connection_established",
-            "message": "You are now connected!",
-            "data": self.recent_updates  # Send existing data immediately
-        }))
+        # Shared across workers, so every process sees the whole fleet
+        self.store = get_location_store()
+        # Outbound frames are coalesced per tick by the process-wide broadcaster
+        self.broadcaster = get_broadcaster()
+        self.subscribed_groups = set()
+        self.viewport = None  # (bbox, vehicle_types) once the client subscribes
+        self.topics = []
+        # JSON unless the client offered a compact subprotocol, e.g. "rydon.msgpack.v1"
+        self.wire_format = negotiate(self.scope.get("subprotocols") or [])
+        await self.accept(subprotocol=self.wire_format.subprotocol)
+        await self.set_groups({GROUP_NAME})
+        await self.send_snapshot("connection_established", "You are now connected!")
+
+    async def set_groups(self, groups):
+        """Join and leave channel groups so this socket listens to exactly `groups`."""
+        for group in self.subscribed_groups - groups:
+            await self.channel_layer.group_discard(group, self.channel_name)
+        for group in groups - self.subscribed_groups:
+            await self.channel_layer.group_add(group, self.channel_name)
+        self.subscribed_groups = groups
+
+    async def send_snapshot(self, message_type, message):
+        """Send the current picture for this socket; later frames only carry deltas."""
+        # Read the sequences first: a delta racing the snapshot is re-applied, never lost
+        seqs = await self.store.current_sequences(sorted(self.subscribed_groups))
+        await self.send_message({
+            "type": message_type,
+            "message": message,
+            "seq": seqs.get(GROUP_NAME, 0),
+            "seqs": seqs,  # Per-group sequence numbers to check later frames against
+            "data": await self.current_entries()  # Send existing data immediately
+        })
+
+    async def current_entries(self):
+        """Live entries matching this socket's subscription."""
+        if GROUP_NAME in self.subscribed_groups:
+            return await self.store.snapshot()
+
+        entries = {}
+        if self.viewport:
+            bbox, vehicle_types = self.viewport
+            for entry in await self.store.within_bbox(*bbox):
+                if entry["vehicle_type"] in vehicle_types:
+                    entries[location_key(entry)] = entry
+
+        fleet_types = set()
+        keys = []
+        for topic in self.topics:
+            match = parse_topic(topic)
+            if match["fleet"]:
+                fleet_types.add(match["fleet"])
+            elif match["vehicle_type"]:
+                keys.append((match["vehicle_type"], int(match["vehicle_id"])))
+            else:
+                route_type = match["route_type"]
+                driver_ids = await drivers_on_route(route_type, int(match["route_id"]))
+                keys.extend((route_type, driver_id) for driver_id in driver_ids)
+        if fleet_types:
+            for entry in await self.store.snapshot():
+                if entry["vehicle_type"] in fleet_types:
+                    entries[location_key(entry)] = entry
+        for entry in await self.store.get_many(keys):
+            entries[location_key(entry)] = entry
+        return list(entries.values())
+
+    async def handle_subscribe(self, data):
+        """
+        Choose what this socket receives, any combination of:
+            "bbox": [south, west, north, east]   vehicles inside a viewport
+            "topics": ["vehicles.bus", "route.bus.3", "vehicle.car.7"]
+            "vehicle_types": ["car"]   limits the bbox; on its own, follows vehicles.<type>
 
-    async def receive(self, text_data):
+        With none of them the socket goes back to receiving the whole fleet.
+        """
+        vehicle_types = data.get("vehicle_types") or data.get("vehicle_type")
+        if isinstance(vehicle_types, str):
+            vehicle_types = [vehicle_types]
+        if vehicle_types and not isinstance(vehicle_types, list):
+            await self.send_error("vehicle_types must be a list of vehicle types")
+            return
+        unknown = set(map(str, vehicle_types or [])) - set(VEHICLE_TYPES)
+        if unknown:
+            await self.send_error(f"Unknown vehicle types: {', '.join(sorted(unknown))}")
+            return
+
+        topics = data.get("topics") or []
+        if not isinstance(topics, list) or len(topics) > MAX_TOPICS:
+            await self.send_error(f"topics must be a list of at most {MAX_TOPICS} topic names")
+            return
+        invalid = [str(topic) for topic in topics if not parse_topic(topic)]
+        if invalid:
+            await self.send_error(f"Unknown topics: {', '.join(invalid)}")
+            return
+
+        viewport = None
+        groups = set(topics)
+        if data.get("bbox") is not None:
+            try:
+                bbox = parse_bbox(data["bbox"])
+            except (TypeError, ValueError) as e:
+                await self.send_error(str(e))
+                return
+            if count_cells_in_bbox(*bbox) > getattr(settings, "LOCATION_GRID_MAX_CELLS", 400):
+                await self.send_error("Viewport too large, zoom in to subscribe")
+                return
+            viewport = (bbox, set(vehicle_types or VEHICLE_TYPES))
+            groups |= {
+                cell_group(vehicle_type, cell)
+                for vehicle_type in viewport[1]
+                for cell in cells_in_bbox(*bbox)
+            }
+        elif vehicle_types:
+            topics = topics + [fleet_group(vehicle_type) for vehicle_type in vehicle_types]
+            groups |= set(topics)
+
+        self.viewport = viewport
+        self.topics = topics
+        await self.set_groups(groups or {GROUP_NAME})
+        await self.send_snapshot("snapshot", "Subscribed" if groups else "Subscribed to the whole fleet")
+
+    async def send_message(self, message):
+        """Send a frame in the wire format negotiated at connect."""
+        await self.send(**self.wire_format.encode(message))
+
+    async def receive(self, text_data=None, bytes_data=None):
         try:
-            data = json.loads(text_data)
-            print("📩 Received data:", data)
-            
+            data = self.wire_format.decode(text_data, bytes_data)
+            if not isinstance(data, dict):
+                await self.send_error("Expected an object or a location row")
+                return
+
+            # Client noticed a gap in the sequence numbers and wants a fresh snapshot
+            if data.get("type") == "resync":
+                await self.send_snapshot("snapshot", "Resynchronised")
+                return
+
+            if data.get("type") == "subscribe":
+                await self.handle_subscribe(data)
+                return
+
             # Validate incoming data
             if all(key in data for key in ['id', 'vehicle_type', 'latitude', 'longitude']):
-                # Update existing entry if id exists, otherwise append
-                existing_index = next(
-                    (i for i, item in enumerate(self.recent_updates) 
-                     if item['id'] == data['id']), 
-                    None
-                )
-                
-                if existing_index is not None:
-                    self.recent_updates[existing_index] = data
-                else:
-                    self.recent_updates.append(data)
-                
-                # Always broadcast the complete array
-                await self.channel_layer.group_send(
-                    "location_updates",
-                    {
-                        "type": "batch_location_update",
-                        "data": self.recent_updates
-                    }
-                )
-                
+                try:
+                    # Driver ids arrive as strings from the mobile app's storage
+                    data['id'] = int(data['id'])
+                    data['latitude'] = float(data['latitude'])
+                    data['longitude'] = float(data['longitude'])
+                except (TypeError, ValueError):
+                    await self.send_error("id must be an integer, latitude and longitude numbers")
+                    return
+                if not 1 <= data['id'] <= MAX_DRIVER_ID:
+                    await self.send_error("id out of range")
+                    return
+                if data['vehicle_type'] not in VEHICLE_TYPES:
+                    await self.send_error(f"Unknown vehicle type: {data['vehicle_type']}")
+                    return
+                latitude, longitude = data['latitude'], data['longitude']
+                # NaN would slip past a `> bound` check and break the grid and JSON frames
+                if not (math.isfinite(latitude) and math.isfinite(longitude)
+                        and abs(latitude) <= MAX_LATITUDE and abs(longitude) <= 180):
+                    await self.send_error("latitude or longitude out of range")
+                    return
+
+                # Recorded in the history now, stored and broadcast on the next
+                # tick together with every other ping
+                self.broadcaster.push(data)
+
         except json.JSONDecodeError as e:
             print(f"❌ JSON decode error: {str(e)}")
-            await self.send(json.dumps({
+            await self.send_message({
                 "error": "Invalid JSON format",
                 "details": str(e)
-            }))
+            })
+        except ValueError as e:
+            # Binary frames that are not valid msgpack location rows
+            await self.send_error(str(e))
+
+    async def send_error(self, message):
+        await self.send_message({
+            "type": "error",
+            "message": message
+        })
+
+    async def send_encoded(self, event):
+        """Forward a frame the broadcaster already encoded for our wire format."""
+        await self.send(**{self.wire_format.send_kwarg: event["encoded"][self.wire_format.name]})
 
     async def batch_location_update(self, event):
-        """Handler for sending combined location updates"""
-        await self.send(json.dumps({
-            "type": "batch_location_update",
-            "data": event["data"]  # This is already an array
+        """Handler for sending location deltas (only the vehicles that changed)"""
+        await self.send_encoded(event)
+
+    async def vehicle_offline(self, event):
+        """Handler for vehicles evicted from the live table"""
+        await self.send_encoded(event)
+
+    async def vehicle_left(self, event):
+        """Handler for vehicles that moved out of a subscribed cell"""
+        await self.send_encoded(event)
+
+    async def disconnect(self, close_code):
+        await self.set_groups(set())
+
+
+class BookingConsumer(AsyncWebsocketConsumer):
+    """
+    Live booking requests for one driver: ws/bookings/?token=<access token>.
+
+    Sends the driver's pending bookings on connect, then a "booking" frame for
+    every booking created for or decided by the driver, published after
+    commit by myapp/bookings.py.
+    """
+    MAX_PENDING = 100
+
+    async def connect(self):
+        self.group = None
+        auth = await database_sync_to_async(authenticate_scope)(self.scope)
+        if auth is None or auth[1] != 'driver':
+            await self.close()
+            return
+        driver = auth[0]
+        self.group = driver_group(driver.id)
+        # Join before reading the pending list, so no booking falls in between;
+        # one created meanwhile may arrive twice, clients key bookings by id
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        await self.accept()
+        await self.send(text_data=json.dumps({
+            "type": "pending_bookings",
+            "data": await self.pending_bookings(driver.id),
+        }))
+
+    @database_sync_to_async
+    def pending_bookings(self, driver_id):
+        rows = BookingRequest.objects.filter(drivers_id=driver_id, status='pending').order_by(
+            '-created_at', '-id').values(*BOOKING_FIELDS)[:self.MAX_PENDING]
+        return [booking_payload(row) for row in rows]
+
+    async def booking_event(self, event):
+        await self.send(text_data=json.dumps({
+            "type": "booking",
+            "event": event["event"],
+            "booking": event["booking"],
         }))
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard("location_updates", self.channel_name)
\ No newline at end of file
+        if self.group:
+            await self.channel_layer.group_discard(self.group, self.channel_name)
@@ -0,0 +1,228 @@
+"""
+Nearest-available-driver dispatch.
+
+Every worker keeps a DispatchIndex: one GridIndex (see geo.py) of live drivers
+per vehicle type, with DISPATCH_CELL_DEG cells (~550 m). The broadcaster feeds it each tick with the pings it
+stored, so it is updated incrementally rather than rebuilt. Other workers'
+drivers come in when the index is re-synced from the shared location store,
+at most every DISPATCH_RESYNC_INTERVAL seconds, and only on lookup.
+
+A k-nearest lookup walks square rings of grid cells outwards from the pickup
+point. It stops as soon as the next ring cannot hold anything nearer than the
+k-th vehicle found, or lies beyond the radius. Only the vehicles in the
+visited cells are measured. The candidates are then checked against
+is_booked with one query per vehicle type.
+"""
+
+import heapq
+import math
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .bookings import VEHICLE_MODELS
+from .constants import VEHICLE_TYPES
+from .geo import MAX_LATITUDE, GridIndex, cell_of, distance_km
+from .location_store import get_location_store, location_key
+
+MAX_RADIUS_KM = 50
+MAX_RESULTS = 50
+
+
+def default_radius():
+    return getattr(settings, 'DISPATCH_RADIUS_KM', 5)
+
+
+def cell_size():
+    return getattr(settings, 'DISPATCH_CELL_DEG', 0.005)
+
+
+def resync_interval():
+    return getattr(settings, 'DISPATCH_RESYNC_INTERVAL', 2.0)
+
+
+def ring_cells(row, col, ring):
+    """Cells at Chebyshev distance `ring` from (row, col)."""
+    if ring == 0:
+        return [(row, col)]
+    cells = [(row - ring, c) for c in range(col - ring, col + ring + 1)]
+    cells += [(row + ring, c) for c in range(col - ring, col + ring + 1)]
+    cells += [(r, col - ring) for r in range(row - ring + 1, row + ring)]
+    cells += [(r, col + ring) for r in range(row - ring + 1, row + ring)]
+    return cells
+
+
+def ring_min_distance_km(lat, size, ring):
+    """Lower bound on the distance from a point in the centre cell to anything in `ring`."""
+    if ring <= 1:
+        return 0.0
+    # Longitude cells are narrowest at the ring's poleward edge
+    widest_lat = min(abs(lat) + (ring + 1) * size, MAX_LATITUDE)
+    cell_km = size * min(110.574, 111.32 * math.cos(math.radians(widest_lat)))
+    return (ring - 1) * cell_km * 0.99
+
+
+class DispatchIndex:
+    """Live driver positions per vehicle type, safe to share between threads."""
+
+    def __init__(self, size=None):
+        # Finer than the viewport grid: a lookup measures only a handful of cells' vehicles
+        self.size = size or cell_size()
+        self.lock = threading.Lock()
+        self.grids = {vehicle_type: GridIndex(self.size) for vehicle_type in VEHICLE_TYPES}
+        self.positions = {}  # (vehicle_type, driver id) -> (lat, lng)
+        self.synced_at = None
+
+    def update(self, entries):
+        with self.lock:
+            for entry in entries:
+                self._update(entry)
+
+    def _update(self, entry):
+        grid = self.grids.get(entry['vehicle_type'])
+        if grid is None:
+            return
+        self.positions[location_key(entry)] = (entry['latitude'], entry['longitude'])
+        grid.update(entry['id'], entry['latitude'], entry['longitude'])
+
+    def remove(self, entries):
+        with self.lock:
+            for entry in entries:
+                self._remove(location_key(entry))
+
+    def _remove(self, key):
+        if self.positions.pop(key, None) is not None:
+            self.grids[key[0]].remove(key[1])
+
+    def sync(self, entries):
+        """Make the index match a full snapshot of the location store."""
+        live = {location_key(entry) for entry in entries}
+        with self.lock:
+            for key in [key for key in self.positions if key not in live]:
+                self._remove(key)
+            for entry in entries:
+                self._update(entry)
+            self.synced_at = time.monotonic()
+
+    def refresh(self):
+        """Re-sync from the shared store if the last sync is older than DISPATCH_RESYNC_INTERVAL. Sync code only."""
+        if self.synced_at is not None and time.monotonic() - self.synced_at < resync_interval():
+            return
+        self.sync(async_to_sync(get_location_store().snapshot)())
+
+    def nearest(self, vehicle_type, lat, lng, radius_km, limit):
+        """Up to `limit` (distance_km, driver id, lat, lng) within radius_km, nearest first."""
+        with self.lock:
+            grid = self.grids.get(vehicle_type)
+            if grid is None or not grid.positions:
+                return []
+            found = []  # max-heap of the nearest so far, as (-distance, ...)
+
+            def measure(driver_ids):
+                for driver_id in driver_ids:
+                    position = self.positions[(vehicle_type, driver_id)]
+                    distance = distance_km(lat, lng, *position)
+                    if distance > radius_km:
+                        continue
+                    item = (-distance, driver_id, *position)
+                    if len(found) < limit:
+                        heapq.heappush(found, item)
+                    elif distance < -found[0][0]:
+                        heapq.heapreplace(found, item)
+
+            row, col = cell_of(lat, lng, grid.size)
+            seen = 0
+            ring = 0
+            while seen < len(grid.positions):
+                bound = ring_min_distance_km(lat, grid.size, ring)
+                if bound > radius_km or (len(found) >= limit and bound > -found[0][0]):
+                    break
+                if 8 * ring > len(grid.cells):
+                    # Rings now have more cells than the grid has occupied ones:
+                    # measure everything not visited yet instead
+                    for (cell_row, cell_col), driver_ids in grid.cells.items():
+                        if max(abs(cell_row - row), abs(cell_col - col)) >= ring:
+                            measure(driver_ids)
+                    break
+                for cell in ring_cells(row, col, ring):
+                    driver_ids = grid.cells.get(cell)
+                    if driver_ids:
+                        seen += len(driver_ids)
+                        measure(driver_ids)
+                ring += 1
+        return sorted((-negative, driver_id, *position) for negative, driver_id, *position in found)
+
+
+def available_vehicles(candidates):
+    """{(vehicle_type, driver id): vehicle id} for the candidates whose vehicle is not booked."""
+    by_type = {}
+    for _, vehicle_type, driver_id, _, _ in candidates:
+        by_type.setdefault(vehicle_type, []).append(driver_id)
+    available = {}
+    for vehicle_type, driver_ids in by_type.items():
+        rows = VEHICLE_MODELS[vehicle_type].objects.filter(
+            driver_id__in=driver_ids, is_booked=False,
+        ).values_list('driver_id', 'id')
+        available.update(((vehicle_type, driver_id), vehicle_id) for driver_id, vehicle_id in rows)
+    return available
+
+
+def nearest_available(lat, lng, vehicle_types=None, k=5, radius_km=None):
+    """
+    Up to k unbooked vehicles nearest to (lat, lng) within radius_km, nearest
+    first, as dicts of driver_id, vehicle_type, vehicle_id, latitude,
+    longitude and distance_km.
+    """
+    vehicle_types = vehicle_types or VEHICLE_TYPES
+    radius_km = radius_km or default_radius()
+    index = get_dispatch_index()
+    index.refresh()
+
+    # Over-fetch so booked vehicles near the top don't leave us short
+    limit = max(k * 4, 20)
+    while True:
+        candidates = heapq.nsmallest(limit, (
+            (distance, vehicle_type, driver_id, vehicle_lat, vehicle_lng)
+            for vehicle_type in vehicle_types
+            for distance, driver_id, vehicle_lat, vehicle_lng in index.nearest(
+                vehicle_type, lat, lng, radius_km, limit)
+        ))
+        available = available_vehicles(candidates)
+        results = [
+            {
+                'driver_id': driver_id,
+                'vehicle_type': vehicle_type,
+                'vehicle_id': available[(vehicle_type, driver_id)],
+                'latitude': vehicle_lat,
+                'longitude': vehicle_lng,
+                'distance_km': round(distance, 3),
+            }
+            for distance, vehicle_type, driver_id, vehicle_lat, vehicle_lng in candidates
+            if (vehicle_type, driver_id) in available
+        ]
+        if len(results) >= k or len(candidates) < limit:
+            return results[:k]
+        limit *= 4
+
+
+_index = None
+
+
+def get_dispatch_index():
+    """Return the process-wide dispatch index."""
+    global _index
+    if _index is None:
+        _index = DispatchIndex()
+    return _index
+
+
+@receiver(setting_changed)
+def reset_dispatch_index(setting, **kwargs):
+    # The index mirrors the location store, so it goes when the store does
+    global _index
+    if setting in ('LOCATION_STORE', 'DISPATCH_CELL_DEG'):
+        _index = None
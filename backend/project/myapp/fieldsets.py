@@ -0,0 +1,64 @@
+"""
+Sparse fieldsets (?fields=id,name) and a values() fast path for list endpoints.
+
+List endpoints read their rows with QuerySet.values() instead of building a
+model instance and running a ModelSerializer per row; that is the fast path,
+the serializer is never instantiated per row. Its only role is to name the
+columns (and document them in the schema): all of its fields, or the subset
+the client asked for with ?fields=. The vehicle lists pass their full
+serializers, the driver and conductor lists DriverListSerializer /
+ConductorListSerializer, which leave out the password.
+
+This is only equivalent for serializers whose fields are all plain model
+fields, which holds for those: foreign keys come out of values() as the
+related pk, exactly as PrimaryKeyRelatedField renders them, and dates and
+datetimes are formatted the same way by the JSON renderer.
+"""
+
+import functools
+
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter
+
+from .pagination import paginate_keyset
+
+FIELDS_PARAMETER = OpenApiParameter(
+    'fields', OpenApiTypes.STR,
+    description='Comma-separated fields to return, e.g. `id,name`. Defaults to every field.',
+)
+
+
+class InvalidFields(ValueError):
+    pass
+
+
+@functools.lru_cache(maxsize=None)
+def serializer_fields(serializer_class):
+    return tuple(serializer_class().fields)
+
+
+def requested_fields(request, serializer_class):
+    """The ?fields= subset in the serializer's own order, or all of its fields."""
+    available = serializer_fields(serializer_class)
+    raw = request.GET.get('fields')
+    if not raw:
+        return available
+    names = {name.strip() for name in raw.split(',') if name.strip()}
+    unknown = sorted(names - set(available))
+    if unknown:
+        raise InvalidFields(f"Unknown fields: {', '.join(unknown)}")
+    return tuple(name for name in available if name in names)
+
+
+def paginate_fields(request, queryset, serializer_class, ordering=('id',)):
+    """
+    paginate_keyset over queryset.values() of the requested fields. Raises
+    InvalidFields for unknown fields and InvalidCursor for tampered cursors.
+    """
+    names = requested_fields(request, serializer_class)
+    # The sort key is needed for the next cursor even if the client didn't ask for it
+    keys = [name.lstrip('-') for name in ordering]
+    page = paginate_keyset(request, queryset.values(*dict.fromkeys(names + tuple(keys))), ordering)
+    if not set(keys) <= set(names):
+        page.rows = [{name: row[name] for name in names} for row in page.rows]
+    return page
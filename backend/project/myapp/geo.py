@@ -0,0 +1,122 @@
+"""
+Grid-cell helpers for viewport subscriptions.
+
+The map is cut into square cells of LOCATION_GRID_CELL_DEG degrees. Each
+(vehicle type, cell) pair has its own channel group, so a client watching a
+viewport only joins the groups of the cells it covers and only receives the
+vehicles inside them.
+"""
+
+import math
+from collections import defaultdict
+
+from django.conf import settings
+
+from .constants import VEHICLE_TYPES
+
+# Redis GEO (and Web Mercator maps) cannot index positions beyond this latitude
+MAX_LATITUDE = 85.05112878
+EARTH_RADIUS_KM = 6371.0088
+
+
+def cell_size():
+    return getattr(settings, 'LOCATION_GRID_CELL_DEG', 0.05)
+
+
+def cell_of(lat, lng, size=None):
+    size = size or cell_size()
+    return (math.floor(lat / size), math.floor(lng / size))
+
+
+def cells_in_bbox(south, west, north, east, size=None):
+    """Every cell overlapping the bounding box."""
+    size = size or cell_size()
+    (min_row, min_col), (max_row, max_col) = cell_of(south, west, size), cell_of(north, east, size)
+    return [
+        (row, col)
+        for row in range(min_row, max_row + 1)
+        for col in range(min_col, max_col + 1)
+    ]
+
+
+def count_cells_in_bbox(south, west, north, east, size=None):
+    size = size or cell_size()
+    (min_row, min_col), (max_row, max_col) = cell_of(south, west, size), cell_of(north, east, size)
+    return (max_row - min_row + 1) * (max_col - min_col + 1)
+
+
+def in_bbox(entry, south, west, north, east):
+    return south <= entry['latitude'] <= north and west <= entry['longitude'] <= east
+
+
+def distance_km(lat1, lng1, lat2, lng2):
+    """Great-circle (haversine) distance in km."""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def cell_group(vehicle_type, cell):
+    """Channel group for one vehicle type in one cell, e.g. "cell.car.571.1546"."""
+    return 'cell.%s.%d.%d' % (vehicle_type, cell[0], cell[1])
+
+
+def entry_cell_group(entry):
+    """Cell group an entry is published to, or None for unknown vehicle types."""
+    if entry['vehicle_type'] not in VEHICLE_TYPES:
+        return None
+    return cell_group(entry['vehicle_type'], cell_of(entry['latitude'], entry['longitude']))
+
+
+def parse_bbox(value):
+    """Validate a [south, west, north, east] list. Raises ValueError."""
+    if not isinstance(value, (list, tuple)) or len(value) != 4:
+        raise ValueError("bbox must be [south, west, north, east]")
+    south, west, north, east = (float(v) for v in value)
+    if not (-MAX_LATITUDE <= south <= north <= MAX_LATITUDE):
+        raise ValueError("bbox latitudes must satisfy south <= north within +/-%s" % MAX_LATITUDE)
+    if not (-180 <= west <= east <= 180):
+        raise ValueError("bbox longitudes must satisfy west <= east within +/-180")
+    return south, west, north, east
+
+
+class GridIndex:
+    """In-memory cell -> keys index, updated incrementally as vehicles move."""
+
+    def __init__(self, size=None):
+        self.size = size or cell_size()
+        self.cells = defaultdict(set)
+        self.positions = {}  # key -> cell
+
+    def update(self, key, lat, lng):
+        cell = cell_of(lat, lng, self.size)
+        old = self.positions.get(key)
+        if old == cell:
+            return
+        if old is not None:
+            self.remove(key)
+        self.cells[cell].add(key)
+        self.positions[key] = cell
+
+    def remove(self, key):
+        cell = self.positions.pop(key, None)
+        if cell is None:
+            return
+        keys = self.cells[cell]
+        keys.discard(key)
+        if not keys:
+            del self.cells[cell]
+
+    def keys_in_bbox(self, south, west, north, east):
+        """Candidate keys in the cells covering the box; callers filter exactly."""
+        if count_cells_in_bbox(south, west, north, east, self.size) > len(self.cells):
+            # Large box over a sparse fleet: walk the occupied cells instead
+            (min_row, min_col), (max_row, max_col) = (
+                cell_of(south, west, self.size), cell_of(north, east, self.size)
+            )
+            for (row, col), keys in self.cells.items():
+                if min_row <= row <= max_row and min_col <= col <= max_col:
+                    yield from keys
+            return
+        for cell in cells_in_bbox(south, west, north, east, self.size):
+            yield from self.cells.get(cell, ())
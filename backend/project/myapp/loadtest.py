@@ -0,0 +1,205 @@
+"""
+Load-test harness for BikeLocationConsumer.
+
+Simulates publishing drivers and subscribing dashboards and measures
+ping-to-delivery latency, delivered frames per second and process RSS.
+Runs either in process (WebsocketCommunicator, whatever CHANNEL_LAYERS /
+LOCATION_STORE are configured) or against a running daphne over the network
+(needs aiohttp). See the loadtest_locations management command, which runs
+the in-process mode with LOCATION_PERSIST off: the simulated drivers reuse
+ids 1..N and must not overwrite real drivers' runtime data or history.
+"""
+
+import asyncio
+import json
+import os
+import random
+import resource
+import time
+from dataclasses import dataclass, field
+
+from channels.testing import WebsocketCommunicator
+
+from .consumers import BikeLocationConsumer
+from .topics import vehicle_group
+
+CENTER = (12.97, 77.59)
+
+
+class InProcessSocket:
+    def __init__(self):
+        self.communicator = WebsocketCommunicator(BikeLocationConsumer.as_asgi(), "/ws/bike/")
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect()
+        if not connected:
+            raise ConnectionError("Consumer refused the connection")
+
+    async def send(self, message):
+        await self.communicator.send_json_to(message)
+
+    async def receive(self):
+        return await self.communicator.receive_json_from(timeout=60)
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+
+class NetworkSocket:
+    def __init__(self, session, url):
+        self.session = session
+        self.url = url
+        self.ws = None
+
+    async def connect(self):
+        self.ws = await self.session.ws_connect(self.url)
+
+    async def send(self, message):
+        await self.ws.send_str(json.dumps(message))
+
+    async def receive(self):
+        message = await self.ws.receive()
+        if message.data is None or not isinstance(message.data, str):
+            raise ConnectionError(f"Socket closed ({message.type})")
+        return json.loads(message.data)
+
+    async def close(self):
+        await self.ws.close()
+
+
+def rss_kb(pid=None):
+    """Current resident set size of a process, in KB."""
+    try:
+        with open(f"/proc/{pid or os.getpid()}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # No procfs: fall back to our own peak RSS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+@dataclass
+class LoadTestStats:
+    pings_sent: int = 0
+    frames_received: int = 0
+    latencies: list = field(default_factory=list)  # seconds, one per delivered entry
+    samples: list = field(default_factory=list)  # (elapsed s, frames/s, RSS KB) per interval
+    errors: int = 0
+
+    def summary(self, duration):
+        latencies = sorted(self.latencies)
+        ms = lambda value: round(value * 1000, 1) if value is not None else None
+        return {
+            "pings_sent": self.pings_sent,
+            "pings_per_s": round(self.pings_sent / duration, 1),
+            "frames_received": self.frames_received,
+            "frames_per_s": round(self.frames_received / duration, 1),
+            "deliveries": len(latencies),
+            "latency_ms": {f"p{p}": ms(percentile(latencies, p)) for p in (50, 90, 99)}
+                          | {"max": ms(latencies[-1] if latencies else None)},
+            "peak_rss_kb": max((rss for _, _, rss in self.samples), default=None),
+            "errors": self.errors,
+        }
+
+
+async def run_load_test(drivers=50, dashboards=10, duration=10.0, interval=1.0, url=None,
+                        server_pid=None, on_sample=None):
+    """Drive the consumer for `duration` seconds and return LoadTestStats."""
+    stats = LoadTestStats()
+    session = None
+    if url:
+        try:
+            import aiohttp
+        except ImportError:
+            raise RuntimeError("Standalone mode needs aiohttp (pip install aiohttp)")
+        session = aiohttp.ClientSession()
+
+    def new_socket():
+        return NetworkSocket(session, url) if url else InProcessSocket()
+
+    driver_sockets = [new_socket() for _ in range(drivers)]
+    dashboard_sockets = [new_socket() for _ in range(dashboards)]
+    tasks = []
+    try:
+        for socket in driver_sockets + dashboard_sockets:
+            await socket.connect()
+            await socket.receive()  # connection_established snapshot
+        for driver_id, socket in enumerate(driver_sockets, start=1):
+            # Drivers only follow themselves, so they are not flooded with the fleet
+            await socket.send({"type": "subscribe", "topics": [vehicle_group("car", driver_id)]})
+            await socket.receive()
+
+        deadline = time.monotonic() + duration
+
+        async def drive(driver_id, socket):
+            await asyncio.sleep(random.random() * interval)
+            lat, lng = CENTER[0] + random.uniform(-0.1, 0.1), CENTER[1] + random.uniform(-0.1, 0.1)
+            while time.monotonic() < deadline:
+                lat += random.uniform(-0.0005, 0.0005)
+                lng += random.uniform(-0.0005, 0.0005)
+                await socket.send({
+                    "id": driver_id,
+                    "vehicle_type": "car",
+                    "latitude": round(lat, 6),
+                    "longitude": round(lng, 6),
+                    "sent_at": time.time(),
+                })
+                stats.pings_sent += 1
+                await asyncio.sleep(interval)
+
+        async def drain(socket):
+            # Own-vehicle frames only; read them so buffers do not grow
+            while True:
+                await socket.receive()
+
+        async def watch(socket):
+            while True:
+                frame = await socket.receive()
+                received_at = time.time()
+                if frame.get("type") != "batch_location_update":
+                    continue
+                stats.frames_received += 1
+                stats.latencies.extend(
+                    received_at - entry["sent_at"] for entry in frame["data"] if "sent_at" in entry
+                )
+
+        async def sample():
+            started = time.monotonic()
+            last_frames = 0
+            while True:
+                await asyncio.sleep(1)
+                frames, last_frames = stats.frames_received - last_frames, stats.frames_received
+                point = (round(time.monotonic() - started), frames, rss_kb(server_pid))
+                stats.samples.append(point)
+                if on_sample:
+                    on_sample(*point)
+
+        tasks = [asyncio.create_task(drain(socket)) for socket in driver_sockets]
+        tasks += [asyncio.create_task(watch(socket)) for socket in dashboard_sockets]
+        tasks.append(asyncio.create_task(sample()))
+        await asyncio.gather(*(drive(i, s) for i, s in enumerate(driver_sockets, start=1)))
+        # Let the last tick reach the dashboards
+        await asyncio.sleep(1)
+        for task in tasks:
+            if task.done() and task.exception():
+                stats.errors += 1
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for socket in driver_sockets + dashboard_sockets:
+            try:
+                await socket.close()
+            except Exception:
+                pass
+        if session:
+            await session.close()
+    return stats
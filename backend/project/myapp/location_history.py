@@ -0,0 +1,105 @@
+"""
+Batched ingestion of the LocationPing history table.
+
+Every accepted ping (not just the ones surviving the broadcast tick) is queued
+in process and inserted with bulk_create once LOCATION_HISTORY_BATCH_SIZE rows
+are waiting or LOCATION_HISTORY_INTERVAL seconds have passed, whichever comes
+first. If the database falls behind, the queue is capped and the newest pings
+are dropped (and counted) rather than growing without bound. A batch the
+database rejects because of a bad row is retried row by row, so only that
+row is lost.
+"""
+
+import asyncio
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import DataError, IntegrityError
+from django.utils import timezone
+
+from .constants import MAX_DRIVER_ID, VEHICLE_TYPE_CODES
+from .models import LocationPing
+
+
+def insert_pings(rows):
+    LocationPing.objects.bulk_create([
+        LocationPing(
+            vehicle_type=vehicle_type,
+            driver_id=driver_id,
+            lat_e6=lat_e6,
+            lng_e6=lng_e6,
+            recorded_at=recorded_at,
+        )
+        for vehicle_type, driver_id, lat_e6, lng_e6, recorded_at in rows
+    ])
+
+
+def insert_pings_separately(rows):
+    """Insert rows one at a time, skipping those the database rejects; returns how many were skipped."""
+    skipped = 0
+    for row in rows:
+        try:
+            insert_pings([row])
+        except (DataError, IntegrityError):
+            skipped += 1
+    return skipped
+
+
+class LocationHistoryWriter:
+    def __init__(self, batch_size=None, interval=None, max_pending=None):
+        self.batch_size = batch_size or getattr(settings, 'LOCATION_HISTORY_BATCH_SIZE', 500)
+        self.interval = interval or getattr(settings, 'LOCATION_HISTORY_INTERVAL', 1.0)
+        self.max_pending = max_pending or getattr(settings, 'LOCATION_HISTORY_MAX_PENDING', 50000)
+        self.pending = []  # (vehicle type code, driver id, lat e6, lng e6, recorded_at)
+        self.batch_ready = asyncio.Event()
+        self.dropped = 0
+        self.task = None
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def record(self, entry):
+        """Queue a validated ping; recorded_at is the time it reached the server."""
+        code = VEHICLE_TYPE_CODES.get(entry['vehicle_type'])
+        if code is None or not 1 <= entry['id'] <= MAX_DRIVER_ID:
+            return
+        if len(self.pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self.pending.append((
+            code,
+            entry['id'],
+            round(entry['latitude'] * 1_000_000),
+            round(entry['longitude'] * 1_000_000),
+            timezone.now(),
+        ))
+        if len(self.pending) >= self.batch_size:
+            self.batch_ready.set()
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.batch_ready.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.batch_ready.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"❌ Location history insert failed: {str(e)}")
+
+    async def flush(self):
+        """Insert everything queued so far, batch_size rows per INSERT."""
+        if self.dropped:
+            print(f"⚠️ Location history queue full, dropped {self.dropped} pings")
+            self.dropped = 0
+        while self.pending:
+            batch = self.pending[:self.batch_size]
+            del self.pending[:self.batch_size]
+            try:
+                await database_sync_to_async(insert_pings)(batch)
+            except (DataError, IntegrityError):
+                # One bad row fails the whole INSERT: keep the rest of the batch
+                skipped = await database_sync_to_async(insert_pings_separately)(batch)
+                print(f"⚠️ Location history skipped {skipped} invalid pings")
@@ -0,0 +1,299 @@
+"""
+Shared store for live vehicle locations.
+
+Every consumer instance reads and writes the same store, so with several
+daphne workers each one still sees the whole fleet. The backend is picked
+from settings.LOCATION_STORE, the same way CHANNEL_LAYERS picks its layer:
+
+    LOCATION_STORE = {
+        "BACKEND": "myapp.location_store.RedisLocationStore",
+        "CONFIG": {"host": "127.0.0.1", "port": 6379, "ttl": 300, "max_entries": 10000},
+    }
+
+Entries are keyed by (vehicle_type, id), since driver ids are only unique
+within a vehicle type. Delta sequence numbers are counted per channel group,
+so a client subscribed to a few groups can still detect gaps in each. Workers
+number and send their frames under sequence_lock(), so a group's frames reach
+clients in sequence order even when several workers broadcast to it.
+"""
+
+import contextlib
+import json
+import math
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .geo import GridIndex, in_bbox
+
+
+def location_key(entry):
+    """Identity of a live vehicle: driver ids are only unique per vehicle type."""
+    return (entry['vehicle_type'], entry['id'])
+
+
+class BaseLocationStore:
+    """Interface shared by all location store backends."""
+
+    def __init__(self, ttl=300, max_entries=10000):
+        # Seconds an entry stays live after its last ping
+        self.ttl = ttl
+        # Hard cap on tracked vehicles; the longest-silent ones go first
+        self.max_entries = max_entries
+
+    async def upsert_many(self, entries):
+        """
+        Store the latest ping for each vehicle.
+
+        Returns (entry, previous) pairs for the entries that changed; previous
+        is None for vehicles that were not live before.
+        """
+        raise NotImplementedError
+
+    async def evict(self):
+        """Drop stale entries and trim to max_entries. Returns the removed entries."""
+        raise NotImplementedError
+
+    async def snapshot(self):
+        """Return every live entry as a list."""
+        raise NotImplementedError
+
+    async def within_bbox(self, south, west, north, east):
+        """Return the live entries inside the bounding box."""
+        raise NotImplementedError
+
+    async def get_many(self, keys):
+        """Return the live entries for the given (vehicle_type, id) keys."""
+        raise NotImplementedError
+
+    async def next_sequences(self, groups):
+        """Allocate the next delta sequence number of each group, as a dict."""
+        raise NotImplementedError
+
+    async def current_sequences(self, groups):
+        """Return the last sequence number handed out for each group, as a dict."""
+        raise NotImplementedError
+
+    def sequence_lock(self):
+        """
+        Async context manager to hold from next_sequences() until the frames
+        are sent. Otherwise another worker could number its frames after ours
+        but send them first.
+        """
+        raise NotImplementedError
+
+
+class InMemoryLocationStore(BaseLocationStore):
+    """Per-process store, for tests and single-worker development only."""
+
+    def __init__(self, ttl=300, max_entries=10000):
+        super().__init__(ttl, max_entries)
+        # (vehicle_type, id) -> (entry, last_seen), least recently pinged first
+        self.entries = OrderedDict()
+        self.grid = GridIndex()
+        self.sequences = {}
+
+    async def upsert_many(self, entries):
+        now = time.monotonic()
+        changed = []
+        for entry in entries:
+            key = location_key(entry)
+            current = self.entries.pop(key, None)
+            self.entries[key] = (entry, now)
+            self.grid.update(key, entry['latitude'], entry['longitude'])
+            if current is None:
+                changed.append((entry, None))
+            elif current[0] != entry:
+                changed.append((entry, current[0]))
+        return changed
+
+    async def evict(self):
+        # Oldest pings sit at the front, so this only touches what it removes
+        cutoff = time.monotonic() - self.ttl
+        evicted = []
+        while self.entries:
+            key, (entry, last_seen) = next(iter(self.entries.items()))
+            if last_seen > cutoff and len(self.entries) <= self.max_entries:
+                break
+            del self.entries[key]
+            self.grid.remove(key)
+            evicted.append(entry)
+        return evicted
+
+    async def snapshot(self):
+        return [entry for entry, _ in self.entries.values()]
+
+    async def within_bbox(self, south, west, north, east):
+        entries = (self.entries[key][0] for key in self.grid.keys_in_bbox(south, west, north, east))
+        return [entry for entry in entries if in_bbox(entry, south, west, north, east)]
+
+    async def get_many(self, keys):
+        return [self.entries[key][0] for key in keys if key in self.entries]
+
+    async def next_sequences(self, groups):
+        for group in groups:
+            self.sequences[group] = self.sequences.get(group, 0) + 1
+        return {group: self.sequences[group] for group in groups}
+
+    async def current_sequences(self, groups):
+        return {group: self.sequences.get(group, 0) for group in groups}
+
+    def sequence_lock(self):
+        # One process, and each event loop's broadcaster sends one tick at a time
+        return contextlib.nullcontext()
+
+
+class RedisLocationStore(BaseLocationStore):
+    """
+    Redis hash of "vehicle_type:id" -> JSON entry, shared by every worker.
+
+    Redis only expires whole keys, so per-entry TTL is tracked in a sorted
+    set of field -> last ping time, which also orders the size-cap trim.
+    Positions are mirrored into a Redis GEO set (a geohash index) for
+    bounding-box lookups.
+    """
+
+    SEQUENCE_LOCK_TIMEOUT = 2  # seconds
+    EVICT_ATTEMPTS = 5
+
+    def __init__(self, host='127.0.0.1', port=6379, db=0, ttl=300, max_entries=10000,
+                 prefix='live_locations'):
+        import redis.asyncio as redis
+
+        super().__init__(ttl, max_entries)
+        self.redis = redis.Redis(host=host, port=port, db=db)
+        self.entries_key = prefix
+        self.seen_key = f"{prefix}:seen"
+        self.geo_key = f"{prefix}:geo"
+        self.sequence_prefix = f"{prefix}:seq:"
+        self.sequence_lock_key = f"{prefix}:seq-lock"
+
+    @staticmethod
+    def _field(entry):
+        return '%s:%s' % location_key(entry)
+
+    async def upsert_many(self, entries):
+        # One round trip for the whole batch: HGET the old value, then overwrite it
+        now = time.time()
+        values = [json.dumps(entry, sort_keys=True) for entry in entries]
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for entry, value in zip(entries, values):
+                field = self._field(entry)
+                pipe.hget(self.entries_key, field)
+                pipe.hset(self.entries_key, field, value)
+                pipe.zadd(self.seen_key, {field: now})
+                pipe.geoadd(self.geo_key, (entry['longitude'], entry['latitude'], field))
+            results = await pipe.execute()
+        previous = results[::4]
+        return [
+            (entry, json.loads(old) if old is not None else None)
+            for entry, value, old in zip(entries, values, previous)
+            if old is None or old.decode() != value
+        ]
+
+    async def evict(self):
+        from redis.exceptions import WatchError
+
+        # WATCH the ping times: if another worker's upsert_many re-pings a vehicle
+        # between reading the stale fields and deleting them, the delete is aborted
+        # and the check redone, so a fresh position is never evicted
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for _ in range(self.EVICT_ATTEMPTS):
+                try:
+                    await pipe.watch(self.seen_key)
+                    cutoff = time.time() - self.ttl
+                    stale = await pipe.zrangebyscore(self.seen_key, '-inf', cutoff)
+                    overflow = await pipe.zcard(self.seen_key) - len(stale) - self.max_entries
+                    if overflow > 0:
+                        stale += await pipe.zrange(self.seen_key, len(stale), len(stale) + overflow - 1)
+                    if not stale:
+                        return []
+                    pipe.multi()
+                    pipe.hmget(self.entries_key, stale)
+                    pipe.hdel(self.entries_key, *stale)
+                    pipe.zrem(self.seen_key, *stale)
+                    pipe.zrem(self.geo_key, *stale)
+                    values, *_ = await pipe.execute()
+                    return [json.loads(value) for value in values if value is not None]
+                except WatchError:
+                    continue
+        # Pinged on every attempt: leave the sweep to the next eviction interval
+        return []
+
+    async def snapshot(self):
+        return [json.loads(value) for value in await self.redis.hvals(self.entries_key)]
+
+    async def within_bbox(self, south, west, north, east):
+        longitude, latitude, width, height = geosearch_box(south, west, north, east)
+        fields = await self.redis.geosearch(
+            self.geo_key, longitude=longitude, latitude=latitude, width=width, height=height, unit='km',
+        )
+        if not fields:
+            return []
+        values = await self.redis.hmget(self.entries_key, fields)
+        entries = (json.loads(value) for value in values if value is not None)
+        return [entry for entry in entries if in_bbox(entry, south, west, north, east)]
+
+    async def get_many(self, keys):
+        if not keys:
+            return []
+        values = await self.redis.hmget(self.entries_key, ['%s:%s' % key for key in keys])
+        return [json.loads(value) for value in values if value is not None]
+
+    async def next_sequences(self, groups):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for group in groups:
+                pipe.incr(self.sequence_prefix + group)
+            values = await pipe.execute()
+        return dict(zip(groups, values))
+
+    async def current_sequences(self, groups):
+        values = await self.redis.mget([self.sequence_prefix + group for group in groups])
+        return {group: int(value) if value else 0 for group, value in zip(groups, values)}
+
+    def sequence_lock(self):
+        # Held for one tick's group_sends. The timeout frees it if a worker dies
+        # while holding it. Waiters poll every few ms, not the default 100 ms.
+        return self.redis.lock(
+            self.sequence_lock_key, timeout=self.SEQUENCE_LOCK_TIMEOUT,
+            blocking_timeout=self.SEQUENCE_LOCK_TIMEOUT, sleep=0.005,
+        )
+
+
+def geosearch_box(south, west, north, east):
+    """
+    GEOSEARCH BYBOX arguments (centre longitude, latitude, width and height in
+    km) for a box covering the bounding box; callers filter the results exactly.
+
+    Redis measures a box in km from its centre, so the width is taken at the
+    latitude nearest the equator, where the bounding box is widest.
+    """
+    widest = 0 if south <= 0 <= north else min(abs(south), abs(north))
+    width = (east - west) * 111.32 * math.cos(math.radians(widest)) * 1.01
+    height = (north - south) * 110.574 * 1.01
+    return (west + east) / 2, (south + north) / 2, max(width, 0.001), max(height, 0.001)
+
+
+_store = None
+
+
+def get_location_store():
+    """Return the process-wide store configured in settings.LOCATION_STORE."""
+    global _store
+    if _store is None:
+        config = getattr(settings, 'LOCATION_STORE', {})
+        backend = import_string(config.get('BACKEND', 'myapp.location_store.InMemoryLocationStore'))
+        _store = backend(**config.get('CONFIG', {}))
+    return _store
+
+
+@receiver(setting_changed)
+def reset_location_store(setting, **kwargs):
+    # Let tests swap backends with override_settings(LOCATION_STORE=...)
+    global _store
+    if setting == 'LOCATION_STORE':
+        _store = None
@@ -0,0 +1,78 @@
+import asyncio
+import random
+import time
+
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from myapp.broadcaster import GROUP_NAME, LocationBroadcaster
+from myapp.consumers import BikeLocationConsumer
+from myapp.wire_formats import FORMATS, encode_all
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure CPU per location broadcast against the number of subscribed sockets, "
+        "using the in-memory channel layer and location store."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscribers', type=int, nargs='+', default=[10, 100, 1000])
+        parser.add_argument('--vehicles', type=int, default=50, help="Vehicles per frame")
+        parser.add_argument('--rounds', type=int, default=20)
+        parser.add_argument('--subprotocol', choices=[f.subprotocol for f in FORMATS],
+                            help="Wire format the sockets negotiate (JSON by default)")
+
+    def handle(self, *args, **options):
+        with override_settings(
+            CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+            LOCATION_STORE={"BACKEND": "myapp.location_store.InMemoryLocationStore"},
+        ):
+            asyncio.run(self.run(options))
+
+    async def run(self, options):
+        frame = [
+            {
+                "id": i,
+                "vehicle_type": random.choice(["bus", "car", "bike"]),
+                "latitude": 12.9 + random.random() / 10,
+                "longitude": 77.5 + random.random() / 10,
+                "address": f"Stop {i}",
+            }
+            for i in range(options['vehicles'])
+        ]
+        rounds = options['rounds']
+
+        # Cost of serialising one frame, which used to be paid once per socket
+        start = time.process_time()
+        for seq in range(rounds):
+            encode_all({"type": "batch_location_update", "group": GROUP_NAME, "seq": seq, "data": frame})
+        encode_ms = (time.process_time() - start) / rounds * 1000
+
+        self.stdout.write(f"{options['vehicles']} vehicles per frame, {rounds} rounds, "
+                          f"encode once: {encode_ms:.3f} ms CPU")
+        self.stdout.write(f"{'sockets':>8} {'ms CPU/broadcast':>17} {'us/socket':>10} {'encode per socket (old)':>24}")
+
+        subprotocols = [options['subprotocol']] if options['subprotocol'] else None
+        for count in options['subscribers']:
+            sockets = []
+            for _ in range(count):
+                socket = WebsocketCommunicator(BikeLocationConsumer.as_asgi(), "/ws/bike/",
+                                               subprotocols=subprotocols)
+                await socket.connect()
+                await socket.receive_output()  # connection_established snapshot
+                sockets.append(socket)
+
+            broadcaster = LocationBroadcaster()
+            start = time.process_time()
+            for _ in range(rounds):
+                await broadcaster.send_frames("batch_location_update", {GROUP_NAME: frame})
+                for socket in sockets:
+                    await socket.receive_output(timeout=5)
+            per_broadcast = (time.process_time() - start) / rounds * 1000
+
+            self.stdout.write(f"{count:>8} {per_broadcast:>17.3f} {per_broadcast / count * 1000:>10.1f} "
+                              f"{encode_ms * count:>21.3f} ms")
+            for socket in sockets:
+                await socket.disconnect()
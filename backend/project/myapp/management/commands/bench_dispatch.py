@@ -0,0 +1,54 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from myapp.dispatch import DispatchIndex
+from myapp.geo import distance_km
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure k-nearest lookups on the in-memory dispatch index against a "
+        "linear scan, for a fleet scattered over a city-sized area."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vehicles', type=int, default=10000)
+        parser.add_argument('--queries', type=int, default=1000)
+        parser.add_argument('--k', type=int, default=5)
+        parser.add_argument('--radius-km', type=float, default=5)
+        parser.add_argument('--span-deg', type=float, default=0.5, help="Side of the area, ~55 km at 0.5")
+
+    def handle(self, *args, **options):
+        rng = random.Random(1)
+        span = options['span_deg']
+        entries = [
+            {'id': i, 'vehicle_type': 'car',
+             'latitude': 12.7 + rng.random() * span, 'longitude': 77.3 + rng.random() * span}
+            for i in range(options['vehicles'])
+        ]
+        points = [(12.7 + rng.random() * span, 77.3 + rng.random() * span) for _ in range(options['queries'])]
+        k, radius = options['k'], options['radius_km']
+
+        start = time.perf_counter()
+        index = DispatchIndex()
+        index.update(entries)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        for lat, lng in points:
+            index.nearest('car', lat, lng, radius, k)
+        index_us = (time.perf_counter() - start) / len(points) * 1e6
+
+        start = time.perf_counter()
+        for lat, lng in points[:100]:
+            sorted(
+                (distance_km(lat, lng, e['latitude'], e['longitude']), e['id']) for e in entries
+            )[:k]
+        scan_us = (time.perf_counter() - start) / min(len(points), 100) * 1e6
+
+        self.stdout.write(f"{len(entries)} vehicles over {span} deg, k={k}, radius {radius} km")
+        self.stdout.write(f"index build: {build_ms:.1f} ms")
+        self.stdout.write(f"grid index lookup: {index_us:>9.1f} us")
+        self.stdout.write(f"linear scan:       {scan_us:>9.1f} us")
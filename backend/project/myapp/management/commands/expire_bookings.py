@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from myapp.bookings import expire_pending_bookings, expiry_interval
+
+
+class Command(BaseCommand):
+    help = (
+        "Expire bookings left pending longer than BOOKING_PENDING_TTL. Sweeps every "
+        "BOOKING_EXPIRY_INTERVAL seconds until stopped, or once with --once (e.g. from cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Run a single sweep and exit")
+        parser.add_argument('--ttl', type=float, help="Seconds a booking may stay pending")
+        parser.add_argument('--batch-size', type=int, help="Bookings expired per UPDATE")
+        parser.add_argument('--interval', type=float, help="Seconds between sweeps")
+
+    def handle(self, *args, **options):
+        interval = options['interval'] or expiry_interval()
+        while True:
+            start = time.perf_counter()
+            try:
+                expired, batches = expire_pending_bookings(options['ttl'], options['batch_size'])
+            except Exception as e:
+                if options['once']:
+                    raise
+                print(f"❌ Booking expiry sweep failed: {str(e)}")
+            else:
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                # Idle sweeps are only reported at -v 2
+                if expired or options['once'] or options['verbosity'] > 1:
+                    self.stdout.write(
+                        f"{timezone.now():%Y-%m-%d %H:%M:%S} expired {expired} bookings "
+                        f"in {batches} batches, {elapsed_ms:.1f} ms"
+                    )
+            if options['once']:
+                return
+            # A long-running process: drop connections the database has timed out
+            close_old_connections()
+            time.sleep(interval)
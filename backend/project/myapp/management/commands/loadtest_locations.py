@@ -0,0 +1,75 @@
+import asyncio
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from myapp.loadtest import run_load_test
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the live location socket with simulated drivers and dashboards. "
+        "Runs in process on the in-memory channel layer by default, or against a "
+        "running daphne with --url ws://host:port/ws/bike/. Simulated drivers use "
+        "ids 1..N, so in process nothing is written to the database "
+        "(LOCATION_PERSIST=False); a --url server must run with LOCATION_PERSIST=False "
+        "or on a throwaway database, or it overwrites real drivers' positions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drivers', type=int, default=50, help="Publishing drivers")
+        parser.add_argument('--dashboards', type=int, default=10, help="Fleet-wide subscribers")
+        parser.add_argument('--duration', type=float, default=10.0, help="Seconds of pinging")
+        parser.add_argument('--interval', type=float, default=1.0, help="Seconds between pings per driver")
+        parser.add_argument('--url', help="Standalone mode: WebSocket URL of a running server")
+        parser.add_argument('--server-pid', type=int,
+                            help="Standalone mode: report this process' RSS instead of our own")
+        parser.add_argument('--use-configured-layers', action='store_true',
+                            help="In process: keep CHANNEL_LAYERS / LOCATION_STORE from settings (e.g. Redis)")
+        parser.add_argument('--json', action='store_true', help="Print the summary as JSON")
+
+    def handle(self, *args, **options):
+        def on_sample(elapsed, frames, rss):
+            if not options['json']:
+                self.stdout.write(f"t={elapsed:>3}s  frames/s={frames:>7}  rss={rss / 1024:.1f} MB")
+
+        kwargs = dict(
+            drivers=options['drivers'],
+            dashboards=options['dashboards'],
+            duration=options['duration'],
+            interval=options['interval'],
+            url=options['url'],
+            server_pid=options['server_pid'],
+            on_sample=on_sample,
+        )
+        try:
+            if options['url']:
+                stats = asyncio.run(run_load_test(**kwargs))
+            elif options['use_configured_layers']:
+                with override_settings(LOCATION_PERSIST=False):
+                    stats = asyncio.run(run_load_test(**kwargs))
+            else:
+                with override_settings(
+                    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+                    LOCATION_STORE={"BACKEND": "myapp.location_store.InMemoryLocationStore"},
+                    LOCATION_PERSIST=False,
+                ):
+                    stats = asyncio.run(run_load_test(**kwargs))
+        except (RuntimeError, ConnectionError, OSError) as e:
+            raise CommandError(str(e))
+
+        summary = stats.summary(options['duration'])
+        if options['json']:
+            self.stdout.write(json.dumps(summary, indent=2))
+            return
+        latency = summary['latency_ms']
+        self.stdout.write(self.style.SUCCESS(
+            f"{summary['pings_sent']} pings ({summary['pings_per_s']}/s), "
+            f"{summary['frames_received']} frames ({summary['frames_per_s']}/s), "
+            f"{summary['deliveries']} deliveries"
+        ))
+        self.stdout.write(
+            f"latency ms  p50={latency['p50']}  p90={latency['p90']}  p99={latency['p99']}  max={latency['max']}"
+        )
+        self.stdout.write(f"peak rss {summary['peak_rss_kb']} KB, {summary['errors']} socket errors")
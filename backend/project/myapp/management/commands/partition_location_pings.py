@@ -0,0 +1,157 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from myapp.models import LocationPing
+
+
+class Command(BaseCommand):
+    help = (
+        "Range-partition the LocationPing table by day on PostgreSQL and create the "
+        "partitions for the coming days. Safe to re-run; schedule it daily."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days-ahead', type=int, default=7,
+                            help="Create partitions up to this many days from today (UTC)")
+        parser.add_argument('--retain-days', type=int,
+                            help="Drop daily partitions older than this many days")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            self.stdout.write(f"LocationPing partitioning needs PostgreSQL, skipping on {connection.vendor}")
+            return
+
+        self.table = LocationPing._meta.db_table
+        today = datetime.datetime.now(datetime.timezone.utc).date()
+        last_day = today + datetime.timedelta(days=options['days_ahead'])
+        with transaction.atomic(), connection.cursor() as cursor:
+            if not self.is_partitioned(cursor):
+                self.convert(cursor, today, last_day)
+            created = self.create_partitions(cursor, today, last_day)
+            dropped = []
+            if options['retain_days'] is not None:
+                dropped = self.drop_partitions(cursor, today - datetime.timedelta(days=options['retain_days']))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{self.table}: {len(created)} partitions created, {len(dropped)} dropped"
+        ))
+
+    def qn(self, name):
+        return connection.ops.quote_name(name)
+
+    def partition_name(self, day):
+        return f"{self.table}_p{day:%Y%m%d}"
+
+    def is_partitioned(self, cursor):
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [self.table]
+        )
+        return cursor.fetchone() is not None
+
+    def convert(self, cursor, today, last_day):
+        """Swap the plain table created by migrate for a partitioned one, keeping its rows."""
+        old = f"{self.table}_unpartitioned"
+        self.stdout.write(f"Converting {self.table} to a partitioned table")
+        cursor.execute(f"ALTER TABLE {self.qn(self.table)} RENAME TO {self.qn(old)}")
+        cursor.execute(
+            f"CREATE TABLE {self.qn(self.table)} "
+            f"(LIKE {self.qn(old)} INCLUDING DEFAULTS INCLUDING IDENTITY) "
+            f"PARTITION BY RANGE (recorded_at)"
+        )
+        # Pings that fall outside every daily partition are kept, not rejected
+        cursor.execute(
+            f"CREATE TABLE {self.qn(self.table + '_default')} PARTITION OF {self.qn(self.table)} DEFAULT"
+        )
+
+        cursor.execute(f"SELECT MIN(recorded_at) FROM {self.qn(old)}")
+        oldest = cursor.fetchone()[0]
+        first_day = min(oldest.astimezone(datetime.timezone.utc).date(), today) if oldest else today
+        self.create_partitions(cursor, first_day, last_day)
+
+        cursor.execute(f"INSERT INTO {self.qn(self.table)} SELECT * FROM {self.qn(old)}")
+        cursor.execute(f"DROP TABLE {self.qn(old)}")
+
+        # Primary keys of partitioned tables must include the partition key
+        cursor.execute(
+            f"ALTER TABLE {self.qn(self.table)} ADD CONSTRAINT {self.qn(self.table + '_pkey')} "
+            f"PRIMARY KEY (id, recorded_at)"
+        )
+        with connection.schema_editor(atomic=False) as editor:
+            for index in LocationPing._meta.indexes:
+                editor.add_index(LocationPing, index)
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM {self.qn(self.table)}), 0) + 1, false)",
+            [self.table],
+        )
+
+    def create_partitions(self, cursor, first_day, last_day):
+        created = []
+        day = first_day
+        while day <= last_day:
+            name = self.partition_name(day)
+            cursor.execute("SELECT to_regclass(%s)", [name])
+            if cursor.fetchone()[0] is None:
+                # Bounds are generated from dates, safe to inline (DDL takes no parameters)
+                lower = f"'{day.isoformat()} 00:00:00+00'"
+                upper = f"'{(day + datetime.timedelta(days=1)).isoformat()} 00:00:00+00'"
+                moved = self.take_from_default(cursor, lower, upper)
+                cursor.execute(
+                    f"CREATE TABLE {self.qn(name)} PARTITION OF {self.qn(self.table)} "
+                    f"FOR VALUES FROM ({lower}) TO ({upper})"
+                )
+                if moved:
+                    cursor.execute(f"INSERT INTO {self.qn(self.table)} SELECT * FROM {self.qn(moved)}")
+                    cursor.execute(f"DROP TABLE {self.qn(moved)}")
+                created.append(name)
+            day += datetime.timedelta(days=1)
+        return created
+
+    def take_from_default(self, cursor, lower, upper):
+        """
+        Move the default partition's rows in [lower, upper) into a temporary table.
+
+        PostgreSQL refuses to create a partition while the default partition holds
+        rows that belong in it, which happens once pings arrive for a day that had
+        no partition yet (the command did not run in time). Returns the temporary
+        table to re-insert from once the partition exists, or None if there was
+        nothing to move.
+        """
+        default = self.table + '_default'
+        cursor.execute("SELECT to_regclass(%s)", [default])
+        if cursor.fetchone()[0] is None:
+            return None
+        moved = self.table + '_moving'
+        cursor.execute(f"CREATE TEMPORARY TABLE {self.qn(moved)} (LIKE {self.qn(default)}) ON COMMIT DROP")
+        cursor.execute(
+            f"WITH rows AS (DELETE FROM {self.qn(default)} "
+            f"WHERE recorded_at >= {lower} AND recorded_at < {upper} RETURNING *) "
+            f"INSERT INTO {self.qn(moved)} SELECT * FROM rows"
+        )
+        if cursor.rowcount == 0:
+            cursor.execute(f"DROP TABLE {self.qn(moved)}")
+            return None
+        self.stdout.write(f"Moving {cursor.rowcount} pings out of {default}")
+        return moved
+
+    def drop_partitions(self, cursor, before):
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(%s)",
+            [self.table],
+        )
+        dropped = []
+        prefix = f"{self.table}_p"
+        for (name,) in cursor.fetchall():
+            if not name.startswith(prefix):
+                continue  # The default partition
+            try:
+                day = datetime.datetime.strptime(name[len(prefix):], "%Y%m%d").date()
+            except ValueError:
+                continue
+            if day < before:
+                cursor.execute(f"DROP TABLE {self.qn(name)}")
+                dropped.append(name)
+        return dropped
@@ -5,7 +5,7 @@ from django.core.validators import MinValueValidator, MaxValueValidator
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 from django.contrib.auth.hashers import make_password, check_password
-from .constants import ROLE_CHOICES
+from .constants import ROLE_CHOICES, VEHICLE_TYPES
 
 class PhoneOTP(models.Model):
     phone = models.CharField(max_length=15)
@@ -248,6 +248,10 @@ class BusCheckpoint(AbstractCheckpoint):
     class Meta:
         verbose_name = "Bus Checkpoint"
         verbose_name_plural = "Bus Checkpoints"
+        indexes = [
+            # A route's checkpoints, already in list_bus_checkpoints order
+            models.Index(fields=['route', 'id'], name='buscheckpoint_route_idx'),
+        ]
 
 class Car(Vehicle):
    
@@ -447,7 +451,8 @@ class BookingRequest(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
         ('accepted', 'Accepted'),
-        ('rejected', 'Rejected')
+        ('rejected', 'Rejected'),
+        ('expired', 'Expired'),  # Left pending past BOOKING_PENDING_TTL, see myapp/bookings.py
     ]
 
     user = models.ForeignKey(PhoneOTP, on_delete=models.CASCADE)
@@ -463,6 +468,59 @@ class BookingRequest(models.Model):
     class Meta:
         ordering = ['-created_at']  # Newest first
         get_latest_by = 'created_at'
-        
-        
-        
\ No newline at end of file
+        indexes = [
+            # Keyset pagination of the bookings list, see myapp/pagination.py
+            models.Index(fields=['-created_at', '-id'], name='booking_created_id_idx'),
+            # A driver's bookings, optionally by status, newest first (get_bookings_by_driver)
+            models.Index(fields=['drivers', 'status', 'created_at'], name='booking_driver_status_idx'),
+            # A rider's active booking (update_booking_status)
+            models.Index(fields=['user', 'status'], name='booking_user_status_idx'),
+            # Pending requests are what the driver app polls for, and a small slice of the table
+            models.Index(fields=['drivers', 'created_at'], condition=models.Q(status='pending'),
+                         name='booking_pending_driver_idx'),
+            # The expiry sweep: the oldest pending requests, see expire_pending_bookings
+            models.Index(fields=['status', 'created_at'], name='booking_status_created_idx'),
+        ]
+        constraints = [
+            # One active ride per rider, see myapp/bookings.py
+            models.UniqueConstraint(fields=['user'], condition=models.Q(status='accepted'),
+                                    name='booking_one_accepted_per_user'),
+        ]
+
+
+class LocationPing(models.Model):
+    """
+    Append-only history of driver pings, written in batches by
+    myapp/location_history.py. Kept narrow for insert throughput: the
+    vehicle type is a small int and coordinates are integer micro-degrees.
+    On PostgreSQL the table is range-partitioned by day, see the
+    partition_location_pings management command.
+    """
+    VEHICLE_TYPE_CHOICES = list(enumerate(VEHICLE_TYPES))
+
+    id = models.BigAutoField(primary_key=True)
+    recorded_at = models.DateTimeField()
+    vehicle_type = models.PositiveSmallIntegerField(choices=VEHICLE_TYPE_CHOICES)
+    # The driver id sent in pings; no foreign key so history outlives deleted drivers
+    driver_id = models.PositiveIntegerField()
+    lat_e6 = models.IntegerField()
+    lng_e6 = models.IntegerField()
+
+    @property
+    def latitude(self):
+        return self.lat_e6 / 1_000_000
+
+    @property
+    def longitude(self):
+        return self.lng_e6 / 1_000_000
+
+    def __str__(self):
+        return f"{self.get_vehicle_type_display()} {self.driver_id} @ {self.recorded_at}"
+
+    class Meta:
+        verbose_name = "Location Ping"
+        verbose_name_plural = "Location Pings"
+        indexes = [
+            # Trip replay: one driver's pings over a time range
+            models.Index(fields=['driver_id', 'recorded_at'], name='locping_driver_time_idx'),
+        ]
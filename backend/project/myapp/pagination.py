@@ -0,0 +1,143 @@
+"""
+Keyset (cursor) pagination for the list endpoints.
+
+Pages are read with WHERE (created_at, id) < (last seen) ORDER BY ... LIMIT n
+instead of OFFSET, so every page costs one index range scan however deep the
+client reads. The cursor is an opaque, URL-safe token holding the sort key of
+the last row served.
+
+Response bodies keep their existing shape. The next page is advertised in a
+`Link: <...>; rel="next"` header on every endpoint, and also as `next_cursor`
+in endpoints whose body is already an object ({"drivers": [...]}).
+
+Pagination is opt-in: a request with neither `cursor` nor `page_size` still
+gets the whole list, as these endpoints returned before they were paginated.
+"""
+
+import base64
+import datetime
+import json
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Q
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter
+
+DEFAULT_PAGE_SIZE = getattr(settings, 'API_PAGE_SIZE', 100)
+MAX_PAGE_SIZE = getattr(settings, 'API_MAX_PAGE_SIZE', 500)
+
+KEYSET_PARAMETERS = [
+    OpenApiParameter(
+        'cursor', OpenApiTypes.STR,
+        description='Opaque cursor from the previous page (`next_cursor` or the `Link: rel="next"` header).',
+    ),
+    OpenApiParameter(
+        'page_size', OpenApiTypes.INT,
+        description=f'Rows per page, default {DEFAULT_PAGE_SIZE}, at most {MAX_PAGE_SIZE}. '
+                    f'Without cursor or page_size the whole list is returned, unpaginated.',
+    ),
+]
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _cursor_value(value):
+    # Full precision: DjangoJSONEncoder drops microseconds, which would skip rows
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Cannot put {type(value).__name__} in a cursor")
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, default=_cursor_value, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, count):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidCursor('Invalid cursor')
+    if not isinstance(values, list) or len(values) != count:
+        raise InvalidCursor('Invalid cursor')
+    return values
+
+
+def page_size(request):
+    try:
+        size = int(request.GET.get('page_size', DEFAULT_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+class KeysetPage:
+    def __init__(self, request, rows, next_cursor):
+        self.request = request
+        self.rows = rows
+        self.next_cursor = next_cursor
+
+    def next_link(self):
+        if not self.next_cursor:
+            return None
+        params = self.request.GET.copy()
+        params['cursor'] = self.next_cursor
+        return self.request.build_absolute_uri(f"{self.request.path}?{params.urlencode()}")
+
+    def apply_headers(self, response):
+        """Add the Link header for the next page, if any, and return the response."""
+        link = self.next_link()
+        if link:
+            response['Link'] = f'<{link}>; rel="next"'
+        return response
+
+
+def wants_page(request):
+    """Clients that send neither cursor nor page_size predate pagination and get every row."""
+    return 'cursor' in request.GET or 'page_size' in request.GET
+
+
+def paginate_keyset(request, queryset, ordering=('id',)):
+    """
+    Return one KeysetPage of `queryset` ordered by `ordering`, e.g.
+    ('-created_at', '-id'), or every row if the client did not ask for pages.
+    The last field must be unique and every field must sort in the same
+    direction. Raises InvalidCursor for tampered cursors.
+    """
+    descending = ordering[0].startswith('-')
+    names = [name.lstrip('-') for name in ordering]
+    model = queryset.model
+    queryset = queryset.order_by(*ordering)
+    if not wants_page(request):
+        return KeysetPage(request, list(queryset), None)
+
+    cursor = request.GET.get('cursor')
+    if cursor:
+        values = decode_cursor(cursor, len(names))
+        try:
+            values = [model._meta.get_field(name).to_python(value) for name, value in zip(names, values)]
+        except Exception:
+            raise InvalidCursor('Invalid cursor')
+        # Row comparison (a, b) < (x, y) spelled out as a OR of prefixes
+        lookup = 'lt' if descending else 'gt'
+        condition = Q()
+        for i, name in enumerate(names):
+            prefix = {names[j]: values[j] for j in range(i)}
+            condition |= Q(**prefix, **{f'{name}__{lookup}': values[i]})
+        queryset = queryset.filter(condition)
+
+    size = page_size(request)
+    rows = list(queryset[:size + 1])
+    next_cursor = None
+    if len(rows) > size:
+        rows = rows[:size]
+        last = rows[-1]
+        get = last.get if isinstance(last, dict) else lambda name: getattr(last, name)
+        next_cursor = encode_cursor([get(name) for name in names])
+    return KeysetPage(request, rows, next_cursor)
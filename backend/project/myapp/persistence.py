@@ -0,0 +1,113 @@
+"""
+Write-behind persistence of live positions.
+
+The broadcaster hands every changed ping to the process-wide RuntimeDataWriter,
+which keeps only the latest position per vehicle and, every
+LOCATION_PERSIST_INTERVAL seconds, writes them to BusRuntimeData,
+CarRuntimeData and BikeRuntimeData with one bulk_update (plus one bulk_create
+for vehicles without a row yet) per table, instead of one UPDATE per ping.
+"""
+
+import asyncio
+from decimal import Decimal
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import invalidate
+from .location_store import location_key
+from .models import BikeRuntimeData, BusRuntimeData, CarRuntimeData, Driver
+
+RUNTIME_MODELS = {'bus': BusRuntimeData, 'car': CarRuntimeData, 'bike': BikeRuntimeData}
+
+
+def _coordinate(model, value):
+    # CarRuntimeData stores coordinates as DecimalField(9, 6)
+    if model is CarRuntimeData:
+        return Decimal(str(round(value, 6)))
+    return value
+
+
+def write_runtime_data(entries):
+    """Store the latest position of each pinging driver's assigned vehicle."""
+    by_driver = {}
+    for entry in entries:
+        if entry['vehicle_type'] in RUNTIME_MODELS:
+            by_driver[location_key(entry)] = entry
+    if not by_driver:
+        return 0
+
+    # Pings carry the driver id; Driver.vehicle_type / vehicle_id name the vehicle
+    positions = {}  # (vehicle_type, vehicle id) -> entry
+    assigned = Driver.objects.filter(
+        id__in={driver_id for _, driver_id in by_driver}, vehicle_id__isnull=False
+    ).values_list('id', 'vehicle_type', 'vehicle_id')
+    for driver_id, vehicle_type, vehicle_id in assigned:
+        entry = by_driver.get((vehicle_type, driver_id))
+        if entry:
+            positions[(vehicle_type, vehicle_id)] = entry
+
+    now = timezone.now()
+    written = 0
+    with transaction.atomic():
+        for vehicle_type, model in RUNTIME_MODELS.items():
+            vehicle_ids = {vid for vtype, vid in positions if vtype == vehicle_type}
+            if not vehicle_ids:
+                continue
+            rows = list(model.objects.filter(vehicle_id__in=vehicle_ids))
+            for row in rows:
+                entry = positions[(vehicle_type, row.vehicle_id)]
+                row.current_lat = _coordinate(model, entry['latitude'])
+                row.current_lng = _coordinate(model, entry['longitude'])
+                # auto_now is not applied by bulk_update
+                row.last_updated = now
+            model.objects.bulk_update(rows, ['current_lat', 'current_lng', 'last_updated'])
+
+            new_rows = [
+                model(
+                    vehicle_id=vehicle_id,
+                    current_lat=_coordinate(model, positions[(vehicle_type, vehicle_id)]['latitude']),
+                    current_lng=_coordinate(model, positions[(vehicle_type, vehicle_id)]['longitude']),
+                    last_updated=now,
+                )
+                for vehicle_id in vehicle_ids - {row.vehicle_id for row in rows}
+            ]
+            # Another worker may have created the row in the meantime
+            model.objects.bulk_create(new_rows, ignore_conflicts=True)
+            # Bulk writes send no post_save: bump the version /api/fleet/'s ETag uses
+            invalidate(model)
+            written += len(rows) + len(new_rows)
+    return written
+
+
+class RuntimeDataWriter:
+    def __init__(self, interval=None):
+        self.interval = interval if interval is not None else getattr(settings, 'LOCATION_PERSIST_INTERVAL', 5)
+        self.pending = {}  # (vehicle_type, id) -> latest entry since the last write
+        self.task = None
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def push(self, entries):
+        """Buffer positions; only the latest per vehicle is written."""
+        for entry in entries:
+            self.pending[location_key(entry)] = entry
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                # Positions are re-sent every few seconds, a failed write is not retried
+                print(f"❌ Runtime data write failed: {str(e)}")
+
+    async def flush(self):
+        if not self.pending:
+            return 0
+        entries, self.pending = list(self.pending.values()), {}
+        return await database_sync_to_async(write_runtime_data)(entries)
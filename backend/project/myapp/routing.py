@@ -3,4 +3,5 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'^ws/bike/$', consumers.BikeLocationConsumer.as_asgi()),
+    re_path(r'^ws/bookings/$', consumers.BookingConsumer.as_asgi()),
 ]
\ No newline at end of file
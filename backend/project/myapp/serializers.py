@@ -38,11 +38,22 @@ class DriverSerializer(serializers.ModelSerializer):
     class Meta:
         model = Driver
         fields = '__all__'    
+
+# What the driver and conductor lists return (see fieldsets.py): everything but the password
+class DriverListSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Driver
+        exclude = ['password']
         
 class ConductorSerializer(serializers.ModelSerializer):
     class Meta:
         model = Conductor
         fields = '__all__'
+
+class ConductorListSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Conductor
+        exclude = ['password']
         
         
         
@@ -60,7 +71,7 @@ class BikeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Bike
         fields = '__all__'
-        
+
 class BusRouteSerializer(serializers.ModelSerializer):
     class Meta:
         model = BusRoute
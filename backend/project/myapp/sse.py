@@ -0,0 +1,60 @@
+"""
+Server-Sent Events fed by the channel layer, for async views on the ASGI app.
+
+A stream is one coroutine waiting on its own channel, which has joined the
+groups the client follows. Nothing polls. An idle connection costs a pending
+channel-layer receive (process-local with channels_redis) and a comment line
+every SSE_KEEPALIVE_INTERVAL seconds, which keeps proxies from timing it out.
+"""
+
+import asyncio
+import json
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+RETRY_MS = 3000  # Browser EventSource reconnect delay
+
+
+def keepalive_interval():
+    return getattr(settings, 'SSE_KEEPALIVE_INTERVAL', 15)
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+async def channel_events(groups, initial_events, to_event):
+    """
+    Yield SSE frames: the (event, data) pairs from `await initial_events()`,
+    then to_event(message) for every channel-layer message sent to `groups`.
+    The groups are joined before initial_events runs, so nothing sent in
+    between is lost (it may be seen twice).
+    """
+    layer = get_channel_layer()
+    channel = await layer.new_channel()
+    for group in groups:
+        await layer.group_add(group, channel)
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        for event, data in await initial_events():
+            yield format_event(event, data)
+        while True:
+            try:
+                message = await asyncio.wait_for(layer.receive(channel), keepalive_interval())
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield format_event(*to_event(message))
+    finally:
+        # Reached when the client disconnects and the ASGI handler cancels us
+        for group in groups:
+            await layer.group_discard(group, channel)
+
+
+def event_stream_response(events):
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx: pass each event straight through
+    return response
@@ -1,3 +1,1285 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import io
+import json
+import random
+import threading
+import time
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import AsyncClient, Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+import msgpack
+from redis.asyncio.client import Pipeline
+from redis.exceptions import LockError
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import fakeredis
+except ImportError:  # Test-only dependency, see requirements.txt
+    fakeredis = None
+
+from . import pagination, topics, wire_formats
+from .bookings import driver_group, expire_pending_bookings
+from .broadcaster import GROUP_NAME, LocationBroadcaster, get_broadcaster
+from .consumers import BikeLocationConsumer, BookingConsumer
+from .dispatch import DispatchIndex
+from .geo import GridIndex, cell_of, distance_km
+from .loadtest import run_load_test
+from .location_history import LocationHistoryWriter
+from .location_store import (
+    InMemoryLocationStore, RedisLocationStore, geosearch_box, get_location_store, reset_location_store,
+)
+from .models import (
+    Bike, BikeRoute, BikeRuntimeData, BookingRequest, Bus, BusCheckpoint, BusRoute, BusRuntimeData, Car, CarRoute,
+    CarRuntimeData, Driver, LocationPing, PhoneOTP,
+)
+from .pagination import encode_cursor
+from .persistence import RuntimeDataWriter, write_runtime_data
+from .serializers import BusSerializer, DriverListSerializer, generate_tokens_for_user
+from .wire_formats import pack_row, unpack_row
+
+# The project settings point CACHES at Redis
+LOCAL_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+VEHICLE_DEFAULTS = {
+    Bus: {'fuel_type': 'diesel', 'bus_type': 'city', 'seating_capacity': 40},
+    Car: {'fuel_type': 'petrol', 'car_type': 'sedan'},
+    Bike: {'fuel_type': 'petrol', 'bike_type': 'scooter'},
+}
+
+
+def create_driver(n=1, **fields):
+    """A Driver with every required field set; n keeps the unique ones apart."""
+    return Driver.objects.create(**{
+        'name': f'Driver {n}', 'email': f'driver{n}@example.com', 'password': 'x', 'contact_number': str(n),
+        'license_number': f'L{n}', 'joining_date': datetime.date(2024, 1, 1), **fields,
+    })
+
+
+def create_vehicle(model, n=1, **fields):
+    """A Bus, Car or Bike, license plate e.g. BUS1."""
+    vehicle_type = model.__name__.lower()
+    return model.objects.create(**{
+        'license_plate': f'{vehicle_type.upper()}{n}', 'registration_number': f'R{n}',
+        'vehicle_type': vehicle_type, 'model_year': 2020, **VEHICLE_DEFAULTS[model], **fields,
+    })
+
+
+def assign_vehicle(driver, vehicle):
+    """Set the driver's denormalized vehicle_type / vehicle_id, as update_driver_vehicle_info does."""
+    Driver.objects.filter(pk=driver.pk).update(vehicle_type=vehicle.vehicle_type, vehicle_id=vehicle.id)
+
+
+def create_rider(n=0):
+    return PhoneOTP.objects.create(phone=str(9000000000 + n), otp='x')
+
+
+def create_booking(user, driver, **fields):
+    return BookingRequest.objects.create(user=user, drivers=driver, from_address='A', to_address='B', **fields)
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    LOCATION_STORE={"BACKEND": "myapp.location_store.InMemoryLocationStore"},
+    LOCATION_BROADCAST_TICK=0.05,
+)
+class LocationLoadTests(TransactionTestCase):
+    """Small run of the load-test harness (manage.py loadtest_locations for real numbers)."""
+
+    def test_pings_reach_every_dashboard(self):
+        stats = async_to_sync(run_load_test)(drivers=5, dashboards=3, duration=1, interval=0.2)
+        summary = stats.summary(1)
+
+        self.assertEqual(summary['errors'], 0)
+        self.assertGreater(summary['pings_sent'], 0)
+        self.assertGreater(summary['frames_received'], 0)
+        # Every dashboard sees every driver at least once
+        self.assertGreaterEqual(summary['deliveries'], 5 * 3)
+        self.assertLess(summary['latency_ms']['p99'], 1000)
+
+    @override_settings(LOCATION_PERSIST_INTERVAL=0.1, LOCATION_HISTORY_INTERVAL=0.1)
+    def test_command_leaves_real_drivers_alone(self):
+        driver = create_driver()
+        assign_vehicle(driver, create_vehicle(Car))
+        call_command('loadtest_locations', drivers=2, dashboards=1, duration=1, interval=0.2,
+                     json=True, stdout=io.StringIO())
+        self.assertFalse(CarRuntimeData.objects.exists())
+        self.assertFalse(LocationPing.objects.exists())
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    LOCATION_STORE={"BACKEND": "myapp.location_store.InMemoryLocationStore"},
+)
+class LocationHistoryTests(TransactionTestCase):
+    def ping(self, driver_id):
+        return {'id': driver_id, 'vehicle_type': 'car', 'latitude': 12.9, 'longitude': 77.6}
+
+    def test_out_of_range_ids_are_not_queued(self):
+        writer = LocationHistoryWriter()
+        for driver_id in (1, 0, -1, 2**31):
+            writer.record(self.ping(driver_id))
+        self.assertEqual([row[1] for row in writer.pending], [1])
+
+    def test_bad_row_does_not_lose_its_batch(self):
+        writer = LocationHistoryWriter(batch_size=50)
+        for driver_id in range(1, 50):
+            writer.record(self.ping(driver_id))
+        writer.pending.insert(10, (1, -1, 0, 0, timezone.now()))  # Got past validation somehow
+        async_to_sync(writer.flush)()
+        self.assertEqual(LocationPing.objects.count(), 49)
+        self.assertEqual(writer.pending, [])
+
+    async def test_consumer_rejects_out_of_range_ids(self):
+        communicator = WebsocketCommunicator(BikeLocationConsumer.as_asgi(), '/ws/locations/')
+        await communicator.connect()
+        await communicator.receive_json_from()
+        await communicator.send_json_to(self.ping(-1))
+        self.assertEqual(await communicator.receive_json_from(),
+                         {'type': 'error', 'message': 'id out of range'})
+        await communicator.disconnect()
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    LOCATION_STORE={"BACKEND": "myapp.location_store.InMemoryLocationStore"},
+)
+class WireFormatTests(TransactionTestCase):
+    def test_rows_round_trip(self):
+        entry = {'id': 7, 'vehicle_type': 'bike', 'latitude': 12.971599, 'longitude': 77.594566, 'address': 'MG Rd'}
+        self.assertEqual(unpack_row(pack_row(entry)), entry)
+        self.assertEqual(unpack_row([1, '7', 12971599, 77594566])['id'], 7)
+
+    def test_malformed_rows(self):
+        for row in ([0, 1, 'x', 'y'], [0, None, 1, 2], [[0], 1, 2, 3], [9, 1, 2, 3], [0, 1, 2],
+                    [1, 6, 12_900_000, 77_600_000, b'\x00bin'], [1, 6, 12_900_000, 77_600_000, {'a': 1}]):
+            with self.subTest(row=row), self.assertRaises(ValueError):
+                unpack_row(row)
+
+    async def test_malformed_binary_ping_gets_an_error_frame(self):
+        communicator = WebsocketCommunicator(BikeLocationConsumer.as_asgi(), '/ws/locations/',
+                                             subprotocols=['rydon.msgpack.v1'])
+        await communicator.connect()
+        await communicator.receive_from()
+        for row in ([0, 1, 'x', 'y'], [1, 6, 12_900_000, 77_600_000, b'\x00bin']):
+            await communicator.send_to(bytes_data=msgpack.packb(row))
+            frame = msgpack.unpackb(await communicator.receive_from())
+            self.assertEqual(frame['t'], 'error')
+        # Still connected
+        await communicator.send_to(bytes_data=msgpack.packb([0, -1, 12_900_000, 77_600_000]))
+        self.assertEqual(msgpack.unpackb(await communicator.receive_from())['m'], 'id out of range')
+        await communicator.disconnect()
+
+
+    @override_settings(LOCATION_BROADCAST_TICK=60, LOCATION_PERSIST=False)  # Flushed by hand below
+    async def test_frames_are_encoded_once_per_format(self):
+        reset_location_store('LOCATION_STORE')
+        sockets = {}
+        for wire_format, subprotocols in (('json', []), ('msgpack', ['rydon.msgpack.v1'])):
+            sockets[wire_format] = []
+            for _ in range(2):
+                communicator = WebsocketCommunicator(BikeLocationConsumer.as_asgi(), '/ws/locations/',
+                                                     subprotocols=subprotocols)
+                await communicator.connect()
+                await communicator.receive_from()
+                sockets[wire_format].append(communicator)
+        broadcaster = get_broadcaster()
+        broadcaster.push({'id': 7, 'vehicle_type': 'bike', 'latitude': 12.9, 'longitude': 77.6})
+
+        layer = broadcaster.channel_layer
+        with (
+            mock.patch.object(wire_formats.json, 'dumps', wraps=json.dumps) as dumps,
+            mock.patch.object(wire_formats.msgpack, 'packb', wraps=msgpack.packb) as packb,
+            mock.patch.object(layer, 'group_send', wraps=layer.group_send) as group_send,
+        ):
+            await broadcaster.flush()
+            received = {
+                wire_format: [await communicator.receive_from() for communicator in communicators]
+                for wire_format, communicators in sockets.items()
+            }
+        # One encoding per group frame (fleet, topics, cell) and format, however many sockets listen
+        self.assertEqual(dumps.call_count, group_send.call_count)
+        self.assertEqual(packb.call_count, group_send.call_count)
+        # Every socket got the payload encoded for the fleet-wide frame, as is
+        [encoded] = [event['encoded'] for group, event in (c.args for c in group_send.call_args_list)
+                     if group == GROUP_NAME]
+        self.assertEqual(received, {'json': [encoded['json']] * 2, 'msgpack': [encoded['msgpack']] * 2})
+        for communicators in sockets.values():
+            for communicator in communicators:
+                await communicator.disconnect()
+
+
+class LocationStoreTests(SimpleTestCase):
+    def ping(self, driver_id, vehicle_type='car', lat=12.9, lng=77.5):
+        return {'id': driver_id, 'vehicle_type': vehicle_type, 'latitude': lat, 'longitude': lng}
+
+    def test_upsert_reports_changes_per_vehicle_type(self):
+        store = InMemoryLocationStore()
+        changed = async_to_sync(store.upsert_many)([self.ping(1), self.ping(1, 'bus')])
+        self.assertEqual(changed, [(self.ping(1), None), (self.ping(1, 'bus'), None)])
+        changed = async_to_sync(store.upsert_many)([self.ping(1), self.ping(1, 'bus', lat=13.0)])
+        self.assertEqual(changed, [(self.ping(1, 'bus', lat=13.0), self.ping(1, 'bus'))])
+
+    def test_silent_vehicles_expire(self):
+        store = InMemoryLocationStore(ttl=0.05)
+        async_to_sync(store.upsert_many)([self.ping(1), self.ping(2)])
+        time.sleep(0.1)
+        async_to_sync(store.upsert_many)([self.ping(2, lat=12.91)])
+        self.assertEqual(async_to_sync(store.evict)(), [self.ping(1)])
+        self.assertEqual(async_to_sync(store.snapshot)(), [self.ping(2, lat=12.91)])
+        self.assertEqual(async_to_sync(store.within_bbox)(12.8, 77.4, 13.0, 77.6), [self.ping(2, lat=12.91)])
+
+    def test_table_is_trimmed_to_the_most_recently_pinged(self):
+        store = InMemoryLocationStore(max_entries=2)
+        for driver_id in (1, 2, 3):
+            async_to_sync(store.upsert_many)([self.ping(driver_id)])
+        async_to_sync(store.upsert_many)([self.ping(1, lat=12.91)])  # 2 is now the longest silent
+        self.assertEqual(async_to_sync(store.evict)(), [self.ping(2)])
+        self.assertEqual(len(async_to_sync(store.snapshot)()), 2)
+        self.assertEqual(async_to_sync(store.evict)(), [])
+
+
+class RedisLocationStoreTests(SimpleTestCase):
+    def ping(self, driver_id, vehicle_type='car', lat=12.9, lng=77.5):
+        return {'id': driver_id, 'vehicle_type': vehicle_type, 'latitude': lat, 'longitude': lng}
+
+    def store(self, **kwargs):
+        if fakeredis is None:
+            self.skipTest("needs fakeredis")
+        store = RedisLocationStore(**kwargs)
+        store.redis = fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer())
+        return store
+
+    async def test_upsert_reports_what_changed(self):
+        store = self.store()
+        changed = await store.upsert_many([self.ping(1), self.ping(1, 'bus')])
+        self.assertEqual(changed, [(self.ping(1), None), (self.ping(1, 'bus'), None)])
+        changed = await store.upsert_many([self.ping(1), self.ping(1, 'bus', lat=13.0)])
+        self.assertEqual(changed, [(self.ping(1, 'bus', lat=13.0), self.ping(1, 'bus'))])
+        self.assertEqual(await store.get_many([('bus', 1), ('bike', 1)]), [self.ping(1, 'bus', lat=13.0)])
+
+    async def test_silent_vehicles_expire(self):
+        store = self.store(ttl=0.05)
+        await store.upsert_many([self.ping(1), self.ping(2)])
+        await asyncio.sleep(0.1)
+        await store.upsert_many([self.ping(2, lat=12.91)])
+        self.assertEqual(await store.evict(), [self.ping(1)])
+        self.assertEqual(await store.snapshot(), [self.ping(2, lat=12.91)])
+        self.assertEqual(await store.redis.zrange(store.geo_key, 0, -1), [b'car:2'])
+
+    async def test_table_is_trimmed_to_the_most_recently_pinged(self):
+        store = self.store(max_entries=2)
+        for driver_id in (1, 2, 3):
+            await store.upsert_many([self.ping(driver_id)])
+        await store.upsert_many([self.ping(1, lat=12.91)])  # 2 is now the longest silent
+        self.assertEqual(await store.evict(), [self.ping(2)])
+        self.assertEqual(len(await store.snapshot()), 2)
+        self.assertEqual(await store.evict(), [])
+
+    async def test_vehicle_pinged_during_eviction_is_kept(self):
+        store = self.store(ttl=0.05)
+        await store.upsert_many([self.ping(1)])
+        await asyncio.sleep(0.1)
+        zcard = Pipeline.zcard
+
+        def ping_first(pipe, key):
+            # Another worker's upsert lands between reading the stale fields and deleting them
+            async def run():
+                if pipe.watching:
+                    await store.upsert_many([self.ping(1, lat=12.91)])
+                return await zcard(pipe, key)
+            return run()
+
+        with mock.patch.object(Pipeline, 'zcard', ping_first):
+            self.assertEqual(await store.evict(), [])
+        self.assertEqual(await store.snapshot(), [self.ping(1, lat=12.91)])
+
+    def test_geosearch_box_covers_the_bounding_box(self):
+        for bbox in ([12.9, 77.5, 12.95, 77.55], [-1, 30, 1, 31], [-60, -70, -55, -60], [59, 10, 70, 30]):
+            with self.subTest(bbox=bbox):
+                south, west, north, east = bbox
+                lng, lat, width, height = geosearch_box(*bbox)
+                # Redis' box test: latitude distance, then longitude distance at the point's latitude
+                for corner_lat, corner_lng in ((south, west), (south, east), (north, west), (north, east)):
+                    self.assertLessEqual(distance_km(corner_lat, lng, lat, lng), height / 2)
+                    self.assertLessEqual(distance_km(corner_lat, corner_lng, corner_lat, lng), width / 2)
+
+
+class GridIndexTests(SimpleTestCase):
+    def test_vehicles_move_between_cells(self):
+        grid = GridIndex(size=0.05)
+        grid.update('a', 12.91, 77.51)
+        grid.update('b', 12.99, 77.59)
+        self.assertEqual(set(grid.keys_in_bbox(12.9, 77.5, 12.94, 77.54)), {'a'})
+        grid.update('a', 12.99, 77.58)  # Same cell as b now
+        self.assertEqual(set(grid.keys_in_bbox(12.9, 77.5, 12.94, 77.54)), set())
+        self.assertEqual(grid.cells, {cell_of(12.99, 77.59, 0.05): {'a', 'b'}})
+        grid.remove('a')
+        grid.remove('b')
+        self.assertEqual((grid.cells, grid.positions), ({}, {}))
+
+    def test_large_box_over_a_sparse_grid(self):
+        grid = GridIndex(size=0.05)
+        grid.update('a', 12.91, 77.51)
+        grid.update('b', 48.85, 2.35)
+        # Far more cells than occupied ones: scans the occupied cells instead
+        self.assertEqual(set(grid.keys_in_bbox(0, 0, 40, 80)), {'a'})
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    LOCATION_STORE={"BACKEND": "myapp.location_store.InMemoryLocationStore"},
+    LOCATION_BROADCAST_TICK=0.05,
+)
+class ViewportSubscriptionTests(TransactionTestCase):
+    BBOX = [12.9, 77.5, 12.95, 77.55]
+
+    def setUp(self):
+        # Start each test from an empty store, not the class-wide one
+        reset_location_store('LOCATION_STORE')
+
+    def ping(self, driver_id, vehicle_type='car', lat=12.92, lng=77.52):
+        return {'id': driver_id, 'vehicle_type': vehicle_type, 'latitude': lat, 'longitude': lng}
+
+    async def connect(self):
+        communicator = WebsocketCommunicator(BikeLocationConsumer.as_asgi(), '/ws/locations/')
+        await communicator.connect()
+        await communicator.receive_json_from()
+        return communicator
+
+    async def test_snapshot_then_vehicle_left(self):
+        await get_location_store().upsert_many([
+            self.ping(1), self.ping(2, 'bus'), self.ping(3, lat=13.5),
+        ])
+        communicator = await self.connect()
+        await communicator.send_json_to({'type': 'subscribe', 'bbox': self.BBOX, 'vehicle_types': ['car']})
+        snapshot = await communicator.receive_json_from()
+        self.assertEqual(snapshot['type'], 'snapshot')
+        self.assertEqual(snapshot['data'], [self.ping(1)])
+
+        await communicator.send_json_to(self.ping(1, lat=13.5))  # Drives out of the viewport
+        frame = await communicator.receive_json_from(timeout=2)
+        self.assertEqual(frame['type'], 'vehicle_left')
+        self.assertEqual(frame['data'], [{'id': 1, 'vehicle_type': 'car'}])
+        self.assertEqual(frame['seq'], snapshot['seqs'][frame['group']] + 1)
+        await communicator.disconnect()
+
+    async def test_invalid_pings_are_rejected_before_the_tick(self):
+        communicator = await self.connect()
+        for ping, message in (
+            (self.ping(1, lat=float('nan')), 'latitude or longitude out of range'),
+            (self.ping(2, lng=float('inf')), 'latitude or longitude out of range'),
+            (self.ping(3, 'truck'), 'Unknown vehicle type: truck'),
+        ):
+            with self.subTest(ping=ping):
+                await communicator.send_json_to(ping)
+                self.assertEqual(await communicator.receive_json_from(), {'type': 'error', 'message': message})
+
+        # The valid ping of the same tick still goes out
+        await communicator.send_json_to(self.ping(4))
+        frame = await communicator.receive_json_from(timeout=2)
+        self.assertEqual((frame['type'], frame['data']), ('batch_location_update', [self.ping(4)]))
+        self.assertEqual(await get_location_store().snapshot(), [self.ping(4)])
+        await communicator.disconnect()
+
+    async def test_invalid_subscriptions_get_an_error(self):
+        communicator = await self.connect()
+        for subscribe, message in (
+            ({'vehicle_types': 5}, 'vehicle_types must be a list of vehicle types'),
+            ({'vehicle_types': ['boat']}, 'Unknown vehicle types: boat'),
+            ({'bbox': [0, 0, 10, 10]}, 'Viewport too large, zoom in to subscribe'),
+        ):
+            with self.subTest(subscribe=subscribe):
+                await communicator.send_json_to({'type': 'subscribe', **subscribe})
+                self.assertEqual(await communicator.receive_json_from(), {'type': 'error', 'message': message})
+        await communicator.disconnect()
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    LOCATION_STORE={"BACKEND": "myapp.location_store.InMemoryLocationStore"},
+    LOCATION_BROADCAST_TICK=0.05,
+    LOCATION_PERSIST=False,
+)
+class TopicSubscriptionTests(TransactionTestCase):
+    def setUp(self):
+        reset_location_store('LOCATION_STORE')
+        topics._route_cache.clear()  # Driver ids are reused across tests
+        self.bus_driver, self.car_driver, self.other_driver = (create_driver(n) for n in (1, 2, 3))
+        bus = create_vehicle(Bus)
+        assign_vehicle(self.bus_driver, bus)
+        assign_vehicle(self.car_driver, create_vehicle(Car))
+        self.route = BusRoute.objects.create(vehicle=bus, name='Route 1', from_location='A', to_location='B')
+
+    def ping(self, driver, vehicle_type, lat=12.92):
+        return {'id': driver.id, 'vehicle_type': vehicle_type, 'latitude': lat, 'longitude': 77.52}
+
+    async def subscribe(self, **subscribe):
+        await get_location_store().upsert_many([self.ping(self.bus_driver, 'bus'), self.ping(self.car_driver, 'car')])
+        communicator = WebsocketCommunicator(BikeLocationConsumer.as_asgi(), '/ws/locations/')
+        await communicator.connect()
+        await communicator.receive_json_from()
+        await communicator.send_json_to({'type': 'subscribe', **subscribe})
+        snapshot = await communicator.receive_json_from()
+        self.assertEqual(snapshot['type'], 'snapshot')
+        return communicator, snapshot
+
+    async def assertFollows(self, communicator, group, ping, others=()):
+        """Pinging `others` and then `ping` delivers one frame, for `group`, with `ping` only."""
+        for other in others:
+            await communicator.send_json_to(other)
+        await communicator.send_json_to(ping)
+        frame = await communicator.receive_json_from(timeout=2)
+        self.assertEqual((frame['group'], frame['data']), (group, [ping]))
+        self.assertTrue(await communicator.receive_nothing(0.2))
+
+    async def test_fleet_topic(self):
+        communicator, snapshot = await self.subscribe(topics=['vehicles.bus'])
+        self.assertEqual(snapshot['data'], [self.ping(self.bus_driver, 'bus')])
+        self.assertEqual(snapshot['seqs'], {'vehicles.bus': 0})
+        await self.assertFollows(communicator, 'vehicles.bus', self.ping(self.bus_driver, 'bus', 12.93),
+                                 others=[self.ping(self.car_driver, 'car', 12.93)])
+        await communicator.disconnect()
+
+    async def test_vehicle_types_alone_follow_the_fleet_topic(self):
+        communicator, snapshot = await self.subscribe(vehicle_types=['car'])
+        self.assertEqual(snapshot['data'], [self.ping(self.car_driver, 'car')])
+        await self.assertFollows(communicator, 'vehicles.car', self.ping(self.car_driver, 'car', 12.93),
+                                 others=[self.ping(self.bus_driver, 'bus', 12.93)])
+        await communicator.disconnect()
+
+    async def test_vehicle_topic(self):
+        group = f'vehicle.car.{self.car_driver.id}'
+        communicator, snapshot = await self.subscribe(topics=[group])
+        self.assertEqual(snapshot['data'], [self.ping(self.car_driver, 'car')])
+        await self.assertFollows(communicator, group, self.ping(self.car_driver, 'car', 12.93),
+                                 others=[self.ping(self.other_driver, 'car')])
+        await communicator.disconnect()
+
+    async def test_route_topic_resolves_the_assigned_driver(self):
+        group = f'route.bus.{self.route.id}'
+        communicator, snapshot = await self.subscribe(topics=[group])
+        self.assertEqual(snapshot['data'], [self.ping(self.bus_driver, 'bus')])
+        await self.assertFollows(communicator, group, self.ping(self.bus_driver, 'bus', 12.93),
+                                 others=[self.ping(self.other_driver, 'bus')])
+        await communicator.disconnect()
+
+    async def test_unsubscribing_goes_back_to_the_whole_fleet(self):
+        communicator, _ = await self.subscribe(topics=[f'vehicle.car.{self.car_driver.id}'])
+        await communicator.send_json_to({'type': 'subscribe'})
+        snapshot = await communicator.receive_json_from()
+        self.assertEqual(snapshot['message'], 'Subscribed to the whole fleet')
+        self.assertEqual(len(snapshot['data']), 2)
+        await self.assertFollows(communicator, GROUP_NAME, self.ping(self.bus_driver, 'bus', 12.93))
+        await communicator.disconnect()
+
+    async def test_invalid_topics_get_an_error(self):
+        communicator, _ = await self.subscribe()
+        for subscribe, message in (
+            ({'topics': ['vehicles.boat']}, 'Unknown topics: vehicles.boat'),
+            ({'topics': ['route.bus.x', 'vehicle.car']}, 'Unknown topics: route.bus.x, vehicle.car'),
+            ({'topics': [5]}, 'Unknown topics: 5'),
+            ({'topics': 'vehicles.bus'}, 'topics must be a list of at most 100 topic names'),
+            ({'topics': ['vehicles.bus'] * 101}, 'topics must be a list of at most 100 topic names'),
+        ):
+            with self.subTest(subscribe=subscribe):
+                await communicator.send_json_to({'type': 'subscribe', **subscribe})
+                self.assertEqual(await communicator.receive_json_from(), {'type': 'error', 'message': message})
+        await communicator.disconnect()
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    LOCATION_STORE={"BACKEND": "myapp.location_store.InMemoryLocationStore"},
+    LOCATION_PERSIST=False,
+)
+class BroadcasterTests(TransactionTestCase):
+    def setUp(self):
+        reset_location_store('LOCATION_STORE')
+
+    def ping(self, driver_id, lat=12.92):
+        return {'id': driver_id, 'vehicle_type': 'car', 'latitude': lat, 'longitude': 77.52}
+
+    async def listen(self):
+        """A channel in the fleet-wide group, and a function returning the frames sent to it so far."""
+        layer = get_channel_layer()
+        channel = await layer.new_channel()
+        await layer.group_add(GROUP_NAME, channel)
+
+        async def frames():
+            received = []
+            while True:
+                try:
+                    event = await asyncio.wait_for(layer.receive(channel), 0.05)
+                except asyncio.TimeoutError:
+                    return received
+                received.append(json.loads(event['encoded']['json']))
+        return frames
+
+    async def test_pings_of_one_tick_become_one_frame(self):
+        broadcaster = LocationBroadcaster()
+        frames = await self.listen()
+        for lat in (12.92, 12.93, 12.94):
+            broadcaster.push(self.ping(1, lat))
+        broadcaster.push(self.ping(2))
+        await broadcaster.flush()
+
+        [frame] = await frames()
+        self.assertEqual(frame['type'], 'batch_location_update')
+        self.assertEqual(frame['data'], [self.ping(1, 12.94), self.ping(2)])
+
+    async def test_failed_store_write_is_retried_next_tick(self):
+        broadcaster = LocationBroadcaster()
+        frames = await self.listen()
+        broadcaster.push(self.ping(1))
+        broadcaster.push(self.ping(2))
+        with mock.patch.object(broadcaster.store, 'upsert_many', side_effect=ConnectionError):
+            with self.assertRaises(ConnectionError):
+                await broadcaster.flush()
+        broadcaster.push(self.ping(2, 12.93))  # Newer than the failed tick's ping
+        await broadcaster.flush()
+
+        [frame] = await frames()
+        self.assertEqual(frame['data'], [self.ping(1), self.ping(2, 12.93)])
+
+    async def test_failed_send_leaves_a_seq_gap(self):
+        broadcaster = LocationBroadcaster()
+        frames = await self.listen()
+        broadcaster.push(self.ping(1))
+        await broadcaster.flush()
+        with mock.patch.object(broadcaster.store, 'sequence_lock', side_effect=LockError('Unable to acquire lock')):
+            broadcaster.push(self.ping(1, 12.93))
+            await broadcaster.flush()
+        broadcaster.push(self.ping(1, 12.94))
+        await broadcaster.flush()
+
+        # Clients see 1 then 3, and resync to get the missed position
+        self.assertEqual([frame['seq'] for frame in await frames()], [1, 3])
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    LOCATION_STORE={"BACKEND": "myapp.location_store.InMemoryLocationStore"},
+    LOCATION_BROADCAST_TICK=0.05,
+    LOCATION_PERSIST=False,
+)
+class SequenceTests(TransactionTestCase):
+    def setUp(self):
+        reset_location_store('LOCATION_STORE')
+
+    def ping(self, driver_id, lat):
+        return {'id': driver_id, 'vehicle_type': 'car', 'latitude': lat, 'longitude': 77.52}
+
+    async def test_frames_count_up_and_a_gap_gets_a_snapshot(self):
+        communicator = WebsocketCommunicator(BikeLocationConsumer.as_asgi(), '/ws/locations/')
+        await communicator.connect()
+        seq = (await communicator.receive_json_from())['seqs'][GROUP_NAME]
+
+        seqs = []
+        for lat in (12.91, 12.92, 12.93, 12.94):
+            await communicator.send_json_to(self.ping(1, lat))
+            frame = await communicator.receive_json_from(timeout=2)
+            self.assertEqual(frame['group'], GROUP_NAME)
+            seqs.append(frame['seq'])
+        self.assertEqual(seqs, list(range(seq + 1, seq + 5)))
+
+        # A lost frame: the store moves on and a seq is used that never reaches this socket
+        await get_location_store().upsert_many([self.ping(2, 12.95)])
+        await get_location_store().next_sequences([GROUP_NAME])
+        await communicator.send_json_to({'type': 'resync'})
+        snapshot = await communicator.receive_json_from()
+        self.assertEqual((snapshot['type'], snapshot['message']), ('snapshot', 'Resynchronised'))
+        self.assertEqual(snapshot['seqs'], {GROUP_NAME: seq + 5})
+        self.assertEqual(snapshot['data'], [self.ping(1, 12.94), self.ping(2, 12.95)])
+
+        await communicator.send_json_to(self.ping(1, 12.96))
+        self.assertEqual((await communicator.receive_json_from(timeout=2))['seq'], seq + 6)
+        await communicator.disconnect()
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class RuntimeDataTests(TransactionTestCase):
+    def setUp(self):
+        self.car_driver, self.bus_driver, self.idle_driver = (create_driver(n) for n in range(3))
+        self.car = create_vehicle(Car, driver=self.car_driver)
+        self.bus = create_vehicle(Bus, driver=self.bus_driver)
+        assign_vehicle(self.car_driver, self.car)
+        assign_vehicle(self.bus_driver, self.bus)
+        CarRuntimeData.objects.create(vehicle=self.car, current_lat=Decimal('1'), current_lng=Decimal('1'))
+
+    def ping(self, driver, vehicle_type, lat=12.97163456, lng=77.5946):
+        return {'id': driver.id, 'vehicle_type': vehicle_type, 'latitude': lat, 'longitude': lng}
+
+    def test_pings_reach_the_assigned_vehicle(self):
+        written = write_runtime_data([
+            self.ping(self.car_driver, 'car'),
+            self.ping(self.bus_driver, 'bus'),
+            self.ping(self.idle_driver, 'car'),  # No vehicle assigned
+            self.ping(self.car_driver, 'bike'),  # Not the type the driver is assigned to
+        ])
+        self.assertEqual(written, 2)
+        car = CarRuntimeData.objects.get(vehicle=self.car)
+        self.assertEqual((car.current_lat, car.current_lng), (Decimal('12.971635'), Decimal('77.594600')))
+        bus = BusRuntimeData.objects.get(vehicle=self.bus)  # Created on the first ping
+        self.assertEqual((bus.current_lat, bus.current_lng), (12.97163456, 77.5946))
+        self.assertFalse(BikeRuntimeData.objects.exists())
+
+    def test_writer_keeps_the_latest_position_per_vehicle(self):
+        writer = RuntimeDataWriter(interval=0)
+        writer.push(self.ping(self.car_driver, 'car', lat=lat) for lat in (12.1, 12.2, 12.3))
+        writer.push([self.ping(self.bus_driver, 'bus')])
+        self.assertEqual(len(writer.pending), 2)
+        self.assertEqual(async_to_sync(writer.flush)(), 2)
+        self.assertEqual(CarRuntimeData.objects.get(vehicle=self.car).current_lat, Decimal('12.3'))
+        self.assertEqual(writer.pending, {})
+        self.assertEqual(async_to_sync(writer.flush)(), 0)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}})
+class QueryCountTests(TestCase):
+    """
+    List and detail endpoints must run a fixed number of queries, however many
+    rows exist. With no cache, conditional GET views add one for their ETag.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.make_rows(0, 3)
+
+    @classmethod
+    def make_rows(cls, start, count):
+        for i in range(start, start + count):
+            driver = create_driver(i)
+            bus, car, bike = (create_vehicle(model, i) for model in (Bus, Car, Bike))
+            route = dict(name=f'Route {i}', from_location='A', to_location='B')
+            bus_route = BusRoute.objects.create(vehicle=bus, **route)
+            BusCheckpoint.objects.create(route=bus_route, address=f'Stop {i}', lat=12.9, lng=77.5)
+            CarRoute.objects.create(vehicle=car, **route)
+            BikeRoute.objects.create(vehicle=bike, **route)
+            create_booking(create_rider(i), driver)
+
+    def assertConstantQueries(self, url, num):
+        with self.assertNumQueries(num):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.make_rows(Driver.objects.count(), 10)
+        with self.assertNumQueries(num):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_list_bus_checkpoints(self):
+        self.assertConstantQueries('/api/bus-checkpoints/', 2)
+
+    def test_list_car_routes(self):
+        self.assertConstantQueries('/api/car-routes/', 2)
+
+    def test_list_bike_routes(self):
+        self.assertConstantQueries('/api/bike-routes/', 2)
+
+    def test_route_and_checkpoint_details(self):
+        for url in (
+            f'/api/car-routes/{CarRoute.objects.first().id}/',
+            f'/api/bike-routes/{BikeRoute.objects.first().id}/',
+            f'/api/bus-checkpoints/{BusCheckpoint.objects.first().id}/',
+        ):
+            with self.subTest(url=url), self.assertNumQueries(2):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_paginated_lists(self):
+        for url in ('/api/driver-details/', '/api/bus-details/', '/api/car-details/',
+                    '/api/bike-details/', '/api/bookings/', '/api/bus-routes/', '/api/fleet/'):
+            with self.subTest(url=url):
+                self.assertConstantQueries(url, 2)
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.bus = create_vehicle(Bus)
+
+    def test_second_read_is_served_from_cache(self):
+        self.client.get('/api/bus-details/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/bus-details/')
+        self.assertEqual(response.json()[0]['license_plate'], 'BUS1')
+
+        stats = self.client.get('/api/cache-stats/').json()['views']['get_bus_details']
+        self.assertEqual((stats['hits'], stats['misses'], stats['hit_rate']), (1, 1, 0.5))
+
+    def test_saving_a_model_invalidates_its_views(self):
+        self.client.get('/api/bus-details/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bus.license_plate = 'BUS2'
+            self.bus.save()
+        self.assertEqual(self.client.get('/api/bus-details/').json()[0]['license_plate'], 'BUS2')
+
+    def test_deleting_a_driver_invalidates_vehicle_lists(self):
+        driver = create_driver()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bus.driver = driver
+            self.bus.save()
+        self.assertEqual(self.client.get('/api/bus-details/').json()[0]['driver'], driver.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            driver.delete()  # Clears Bus.driver with an UPDATE, no post_save
+        self.assertIsNone(self.client.get('/api/bus-details/').json()[0]['driver'])
+
+    def test_other_models_do_not_invalidate(self):
+        self.client.get('/api/bus-details/')
+        with self.captureOnCommitCallbacks(execute=True):
+            create_vehicle(Bike)
+        with self.assertNumQueries(0):
+            self.client.get('/api/bus-details/')
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.bus = create_vehicle(Bus)
+
+    def test_matching_etag_gets_304_without_running_the_view(self):
+        response = self.client.get('/api/bus-details/')
+        self.assertTrue(response.has_header('Last-Modified'))
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/bus-details/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes_on_save_and_delete(self):
+        etags = [self.client.get('/api/bus-details/')['ETag']]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bus.license_plate = 'BUS2'
+            self.bus.save()
+        etags.append(self.client.get('/api/bus-details/')['ETag'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bus.delete()
+        response = self.client.get('/api/bus-details/', HTTP_IF_NONE_MATCH=etags[1])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(set(etags + [response['ETag']])), 3)
+
+    def test_etag_depends_on_query_string(self):
+        etag = self.client.get('/api/fleet/')['ETag']
+        self.assertEqual(self.client.get('/api/fleet/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get('/api/fleet/?type=bus', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_fleet_etag_follows_runtime_writes(self):
+        driver = create_driver()
+        assign_vehicle(driver, self.bus)
+        response = self.client.get('/api/fleet/')
+        self.assertIsNone(response.json()['vehicles'][0]['current_lat'])
+        with self.captureOnCommitCallbacks(execute=True):
+            write_runtime_data([{'id': driver.id, 'vehicle_type': 'bus', 'latitude': 12.9, 'longitude': 77.6}])
+        response = self.client.get('/api/fleet/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['vehicles'][0]['current_lat'], 12.9)
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}})
+    def test_etag_without_cache_follows_table_changes(self):
+        etag = self.client.get('/api/bus-details/')['ETag']
+        self.assertEqual(self.client.get('/api/bus-details/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Bus.objects.filter(pk=self.bus.pk).delete()
+        self.assertEqual(self.client.get('/api/bus-details/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class BusCheckpointListTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.routes = [
+            BusRoute.objects.create(vehicle=create_vehicle(Bus, n), name=f'Route {n}', from_location='A',
+                                    to_location='B')
+            for n in (1, 2)
+        ]
+        # Created out of route order: (route, lat, lng)
+        self.checkpoints = [
+            BusCheckpoint.objects.create(route=self.routes[route], address=f'Stop {i}', lat=lat, lng=lng)
+            for i, (route, lat, lng) in enumerate([
+                (1, 12.91, 77.51), (0, 12.92, 77.52), (1, 13.5, 77.9), (0, 12.93, 77.53),
+            ])
+        ]
+
+    def ids(self, query=''):
+        response = self.client.get('/api/bus-checkpoints/' + query)
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.json()]
+
+    def expected(self, *indexes):
+        return [self.checkpoints[i].id for i in indexes]
+
+    def test_ordered_by_route_then_id(self):
+        self.assertEqual(self.ids(), self.expected(1, 3, 0, 2))
+
+    def test_route_and_bbox_filters(self):
+        self.assertEqual(self.ids(f'?route={self.routes[0].id}'), self.expected(1, 3))
+        self.assertEqual(self.ids('?bbox=12.9,77.5,12.95,77.55'), self.expected(1, 3, 0))
+        self.assertEqual(self.ids(f'?bbox=12.9,77.5,12.95,77.55&route={self.routes[1].id}'), self.expected(0))
+
+    def test_invalid_filters(self):
+        for query in ('?route=first', '?bbox=12.9,77.5', '?bbox=13,77.5,12.9,77.6', '?bbox=a,b,c,d'):
+            with self.subTest(query=query):
+                response = self.client.get('/api/bus-checkpoints/' + query)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+
+    def test_route_lookup_is_indexed(self):
+        # SQLite may use the foreign key's own index, which also keeps rows in id order
+        plan = BusCheckpoint.objects.filter(route=self.routes[0]).order_by('route_id', 'id').explain()
+        self.assertRegex(plan, 'buscheckpoint_route_(idx|id)')
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.buses = [create_vehicle(Bus, n) for n in range(3)]
+        # More rows than a default page
+        patcher = mock.patch.object(pagination, 'DEFAULT_PAGE_SIZE', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def ids(self, response):
+        return [row['id'] for row in response.json()]
+
+    def test_whole_list_without_page_parameters(self):
+        response = self.client.get('/api/bus-details/')
+        self.assertEqual(self.ids(response), [bus.id for bus in self.buses])
+        self.assertNotIn('Link', response)
+
+    def test_pages_when_asked(self):
+        first = self.client.get('/api/bus-details/?page_size=1')
+        self.assertEqual(self.ids(first), [self.buses[0].id])
+        cursor = first['Link'].split('cursor=')[1].split('&')[0].split('>')[0]
+        # A cursor alone pages with the default size
+        last = self.client.get(f'/api/bus-details/?cursor={cursor}')
+        self.assertEqual(self.ids(last), [bus.id for bus in self.buses[1:]])
+        self.assertNotIn('Link', last)
+
+    def test_whole_fleet_without_page_parameters(self):
+        create_vehicle(Car)
+        body = self.client.get('/api/fleet/').json()
+        self.assertEqual(len(body['vehicles']), 4)
+        self.assertIsNone(body['next_cursor'])
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class FleetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        # n, status, booked: ids interleave across the types, so only the cursor's type keeps pages apart
+        self.vehicles = {
+            model: [
+                create_vehicle(model, n, initial_status=status, is_booked=booked)
+                for n, status, booked in rows
+            ]
+            for model, rows in (
+                (Bus, [(1, 'Active', False), (2, 'Maintenance', False), (3, 'Active', True)]),
+                (Car, [(1, 'Active', True), (2, 'Active', False)]),
+                (Bike, [(1, 'Inactive', False), (2, 'Active', False)]),
+            )
+        }
+
+    def keys(self, *vehicles):
+        return sorted((vehicle.vehicle_type, vehicle.id) for vehicle in vehicles)
+
+    def walk(self, query):
+        """Follow next_cursor from the first page; returns every (vehicle_type, id) served, in order."""
+        keys = []
+        url = f'/api/fleet/?{query}'
+        while url:
+            body = self.client.get(url).json()
+            keys += [(vehicle['vehicle_type'], vehicle['id']) for vehicle in body['vehicles']]
+            url = body['next_cursor'] and f"/api/fleet/?{query}&cursor={body['next_cursor']}"
+        return keys
+
+    def test_pages_cross_type_boundaries(self):
+        every = self.keys(*self.vehicles[Bus], *self.vehicles[Car], *self.vehicles[Bike])
+        for size in (1, 2, 3, 7, 100):
+            with self.subTest(page_size=size):
+                self.assertEqual(self.walk(f'page_size={size}'), every)
+
+    def test_filters(self):
+        buses, cars, bikes = self.vehicles[Bus], self.vehicles[Car], self.vehicles[Bike]
+        for query, expected in (
+            ('type=car,bus', [*buses, *cars]),
+            ('type=bike', bikes),
+            ('status=Active', [buses[0], buses[2], *cars, bikes[1]]),
+            ('available=true', [buses[0], buses[1], cars[1], *bikes]),
+            ('available=false', [buses[2], cars[0]]),
+            ('type=bus,bike&status=Active&available=true', [buses[0], bikes[1]]),
+        ):
+            for size in (1, 100):
+                with self.subTest(query=query, page_size=size):
+                    self.assertEqual(self.walk(f'{query}&page_size={size}'), self.keys(*expected))
+
+    def test_runtime_position(self):
+        car = self.vehicles[Car][0]
+        CarRuntimeData.objects.create(vehicle=car, current_lat=Decimal('12.971599'), current_lng=Decimal('77.594566'))
+        vehicle = self.client.get('/api/fleet/?type=car&page_size=1').json()['vehicles'][0]
+        self.assertEqual((vehicle['id'], vehicle['current_lat'], vehicle['current_lng']), (car.id, 12.971599, 77.594566))
+
+    def test_invalid_queries(self):
+        for query in ('type=bus,boat', 'cursor=nope', f'cursor={encode_cursor(["bus"])}'):
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get(f'/api/fleet/?{query}').status_code, 400)
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class ResolveVehiclesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.car_driver, self.bus_driver, self.idle_driver = (create_driver(n) for n in range(3))
+        self.car = create_vehicle(Car, driver=self.car_driver)
+        self.bus = create_vehicle(Bus, driver=self.bus_driver)
+        self.bike = create_vehicle(Bike)
+
+    def resolve(self, query):
+        response = self.client.get('/api/vehicles/resolve/?' + query)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_drivers_and_vehicle_pairs_in_one_query_per_type(self):
+        query = (f'driver_ids={self.car_driver.id},{self.bus_driver.id},{self.idle_driver.id}'
+                 f'&vehicles=bike:{self.bike.id},car:9999')
+        with self.assertNumQueries(3):
+            body = self.resolve(query)
+        self.assertEqual(
+            {driver_id: vehicle['license_plate'] for driver_id, vehicle in body['drivers'].items()},
+            {str(self.car_driver.id): 'CAR1', str(self.bus_driver.id): 'BUS1'},
+        )
+        self.assertEqual(list(body['vehicles']), [f'bike:{self.bike.id}'])
+        self.assertEqual(body['missing'], [f'driver:{self.idle_driver.id}', 'car:9999'])
+
+    def test_vehicle_type_limits_the_driver_lookup(self):
+        with self.assertNumQueries(1):
+            body = self.resolve(f'driver_ids={self.car_driver.id},{self.bus_driver.id}&vehicle_type=car')
+        self.assertEqual(list(body['drivers']), [str(self.car_driver.id)])
+        self.assertEqual(body['missing'], [f'driver:{self.bus_driver.id}'])
+
+    def test_id_cap(self):
+        ids = ','.join(str(i) for i in range(1, 201))
+        self.assertEqual(self.client.get(f'/api/vehicles/resolve/?driver_ids={ids}').status_code, 200)
+        response = self.client.get(f'/api/vehicles/resolve/?driver_ids={ids}&vehicles=car:1')
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_queries(self):
+        for query in ('driver_ids=1,x', 'vehicles=car', 'vehicles=boat:1', 'driver_ids=1&vehicle_type=boat'):
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get('/api/vehicles/resolve/?' + query).status_code, 400)
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class SparseFieldsetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.driver = create_driver()
+        self.bus = create_vehicle(Bus, driver=self.driver)
+
+    def test_values_path_matches_list_serializer(self):
+        for url, key, serializer, instance in (
+            ('/api/bus-details/', None, BusSerializer, self.bus),
+            ('/api/driver-details/', 'drivers', DriverListSerializer, self.driver),
+        ):
+            with self.subTest(url=url):
+                body = self.client.get(url).json()
+                rows = body[key] if key else body
+                expected = json.loads(JSONRenderer().render(serializer(instance).data))
+                self.assertEqual(rows, [expected])
+
+    def test_password_is_not_listed(self):
+        self.assertNotIn('password', self.client.get('/api/driver-details/').json()['drivers'][0])
+
+    def test_fields_subset(self):
+        body = self.client.get('/api/bus-details/?fields=license_plate,driver').json()
+        self.assertEqual(body, [{'license_plate': 'BUS1', 'driver': self.driver.id}])
+        response = self.client.get('/api/driver-details/?fields=id,password')
+        self.assertEqual(response.status_code, 400)
+
+    def test_next_cursor_without_id_field(self):
+        create_vehicle(Bus, 2)
+        first = self.client.get('/api/bus-details/?fields=license_plate&page_size=1')
+        self.assertEqual(first.json(), [{'license_plate': 'BUS1'}])
+        url = first['Link'].split(';')[0].strip('<>')
+        self.assertEqual(self.client.get(url).json(), [{'license_plate': 'BUS2'}])
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class BookingFilterTests(TestCase):
+    def setUp(self):
+        self.driver = create_driver()
+        user = create_rider()
+        for status in ('pending', 'accepted', 'rejected', 'pending'):
+            create_booking(user, self.driver, status=status)
+        self.url = f'/api/bookings/driver-id/?driver_id={self.driver.id}'
+
+    def statuses(self, query):
+        response = self.client.get(self.url + query)
+        self.assertEqual(response.status_code, 200)
+        return sorted(row['status'] for row in response.json())
+
+    def test_status_filter(self):
+        self.assertEqual(self.statuses('&status=pending'), ['pending', 'pending'])
+        self.assertEqual(self.statuses('&status=accepted,rejected'), ['accepted', 'rejected'])
+        self.assertEqual(self.client.get(self.url + '&status=done').status_code, 400)
+
+    def test_created_range(self):
+        BookingRequest.objects.filter(status='rejected').update(
+            created_at=datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc))
+        self.assertEqual(self.statuses('&created_before=2024-01-02'), ['rejected'])
+        self.assertEqual(self.statuses('&created_after=2024-01-01T12:00:00Z'), ['accepted', 'pending', 'pending'])
+        self.assertEqual(self.client.get(self.url + '&created_after=yesterday').status_code, 400)
+
+    def test_driver_status_lookup_is_indexed(self):
+        # Which of the two the planner picks depends on the backend and its statistics
+        plan = BookingRequest.objects.filter(drivers=self.driver, status='pending').order_by('-created_at').explain()
+        self.assertRegex(plan, 'booking_(driver_status|pending_driver)_idx')
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+)
+class BookingAcceptanceTests(TransactionTestCase):
+    """Concurrent acceptances: exactly one wins, the rest are turned away cleanly."""
+
+    THREADS = 8
+
+    def setUp(self):
+        self.user = create_rider()
+        self.bookings = []
+        for i in range(self.THREADS):
+            driver = create_driver(i)
+            assign_vehicle(driver, create_vehicle(Car, i, driver=driver))
+            self.bookings.append(create_booking(self.user, driver))
+
+    def accept_concurrently(self, booking_ids):
+        barrier = threading.Barrier(len(booking_ids))
+        statuses = []
+
+        def accept(booking_id):
+            try:
+                barrier.wait()
+                response = Client().post(f'/api/bookings/{booking_id}/update-status/', {'status': 'accepted'},
+                                         content_type='application/json')
+                statuses.append(response.status_code)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=accept, args=(booking_id,)) for booking_id in booking_ids]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sorted(statuses)
+
+    def test_one_booking_accepted_by_many_requests(self):
+        booking = self.bookings[0]
+        statuses = self.accept_concurrently([booking.id] * self.THREADS)
+        self.assertEqual(statuses, [200] + [409] * (self.THREADS - 1))
+        self.assertTrue(Car.objects.get(driver=booking.drivers).is_booked)
+
+    def test_rider_requests_to_many_drivers(self):
+        statuses = self.accept_concurrently([booking.id for booking in self.bookings])
+        self.assertEqual(statuses, [200] + [400] * (self.THREADS - 1))
+        self.assertEqual(BookingRequest.objects.filter(user=self.user, status='accepted').count(), 1)
+        self.assertEqual(Car.objects.filter(is_booked=True).count(), 1)
+
+    def test_acceptance_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(f'/api/bookings/{self.bookings[0].id}/update-status/',
+                                        {'status': 'accepted'}, content_type='application/json')
+        statements = [query['sql'] for query in queries if query['sql'] not in ('BEGIN', 'COMMIT')]
+        self.assertEqual(len(statements), 3, statements)
+        self.assertEqual(response.json()['message'], 'Booking accepted and car marked as booked (auto-detected)')
+
+    def test_null_vehicle_type_is_auto_detected(self):
+        response = self.client.post(f'/api/bookings/{self.bookings[0].id}/update-status/',
+                                    {'status': 'accepted', 'vehicle_type': None}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['message'], 'Booking accepted and car marked as booked (auto-detected)')
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    LOCATION_STORE={"BACKEND": "myapp.location_store.InMemoryLocationStore"},
+)
+class DispatchTests(TestCase):
+    def setUp(self):
+        self.cars = []
+        for i in range(3):
+            self.cars.append(create_vehicle(Car, i, driver=create_driver(i)))
+        # Live pings 0.5, 1.1 and 2.2 km north of the pickup point
+        async_to_sync(get_location_store().upsert_many)([
+            {'id': car.driver_id, 'vehicle_type': 'car', 'latitude': 12.9 + offset, 'longitude': 77.5}
+            for car, offset in zip(self.cars, (0.0045, 0.01, 0.02))
+        ])
+
+    def test_index_matches_brute_force(self):
+        rng = random.Random(7)
+        entries = [
+            {'id': i, 'vehicle_type': 'bike', 'latitude': 12.5 + rng.random(), 'longitude': 77.2 + rng.random()}
+            for i in range(2000)
+        ]
+        index = DispatchIndex()
+        index.update(entries)
+        # A city-sized radius walks rings; a huge one falls back to scanning occupied cells
+        for radius_km in (8, 200):
+            for _ in range(20):
+                lat, lng = 12.5 + rng.random(), 77.2 + rng.random()
+                expected = sorted(
+                    (distance_km(lat, lng, e['latitude'], e['longitude']), e['id']) for e in entries
+                )
+                expected = [driver_id for distance, driver_id in expected if distance <= radius_km][:10]
+                self.assertEqual([row[1] for row in index.nearest('bike', lat, lng, radius_km, 10)], expected)
+
+    def test_nearest_skips_booked_vehicles(self):
+        Car.objects.filter(pk=self.cars[0].pk).update(is_booked=True)
+        body = self.client.get('/api/dispatch/nearest/?lat=12.9&lng=77.5&vehicle_type=car&k=5&radius_km=2').json()
+        self.assertEqual([row['vehicle_id'] for row in body['vehicles']], [self.cars[1].id])
+        self.assertAlmostEqual(body['vehicles'][0]['distance_km'], 1.11, places=2)
+        self.assertEqual(self.client.get('/api/dispatch/nearest/?lat=north&lng=77.5').status_code, 400)
+
+    def test_booking_without_driver_is_dispatched(self):
+        user = create_rider()
+        response = self.client.post('/api/bookings/create/', {
+            'user': user.id, 'from_address': 'A', 'to_address': 'B', 'from_lat': 12.9, 'from_lng': 77.5,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['drivers'], self.cars[0].driver_id)
+        response = self.client.post('/api/bookings/create/', {
+            'user': user.id, 'from_address': 'A', 'to_address': 'B',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+)
+class BookingPushTests(TransactionTestCase):
+    def setUp(self):
+        self.driver = create_driver()
+        self.user = create_rider()
+        self.pending = create_booking(self.user, self.driver)
+
+    def post(self, url, data):
+        return database_sync_to_async(self.client.post)(url, data, content_type='application/json')
+
+    async def test_driver_is_pushed_new_and_decided_bookings(self):
+        token = generate_tokens_for_user(self.driver, 'driver')['access']
+        communicator = WebsocketCommunicator(BookingConsumer.as_asgi(), f'/ws/bookings/?token={token}')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        snapshot = await communicator.receive_json_from()
+        self.assertEqual([booking['id'] for booking in snapshot['data']], [self.pending.id])
+
+        response = await self.post('/api/bookings/create/', {
+            'user': self.user.id, 'drivers': self.driver.id, 'from_address': 'C', 'to_address': 'D'})
+        event = await communicator.receive_json_from(timeout=2)
+        self.assertEqual((event['event'], event['booking']['id']), ('created', response.json()['booking_id']))
+
+        await self.post(f'/api/bookings/{self.pending.id}/update-status/', {'status': 'rejected'})
+        event = await communicator.receive_json_from(timeout=2)
+        self.assertEqual((event['event'], event['booking']['status']), ('rejected', 'rejected'))
+        await communicator.disconnect()
+
+    async def test_connection_needs_a_driver_token(self):
+        communicator = WebsocketCommunicator(BookingConsumer.as_asgi(), '/ws/bookings/?token=nope')
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+)
+class BookingEventStreamTests(TransactionTestCase):
+    def setUp(self):
+        self.user = create_rider()
+        self.booking = create_booking(self.user, create_driver())
+
+    async def next_event(self, stream):
+        while True:
+            chunk = (await asyncio.wait_for(stream.__anext__(), 2)).decode()
+            if chunk.startswith('event: '):
+                event, data = chunk.split('\n')[:2]
+                return event[len('event: '):], json.loads(data[len('data: '):])
+
+    async def test_rider_sees_acceptance(self):
+        for query in (f'booking_id={self.booking.id}', f'user_id={self.user.id}'):
+            with self.subTest(query=query):
+                await BookingRequest.objects.filter(pk=self.booking.pk).aupdate(status='pending')
+                response = await AsyncClient().get(f'/api/bookings/events/?{query}')
+                self.assertEqual(response['Content-Type'], 'text/event-stream')
+                stream = aiter(response.streaming_content)
+                event, data = await self.next_event(stream)
+                self.assertEqual((event, [booking['status'] for booking in data]), ('snapshot', ['pending']))
+
+                await database_sync_to_async(self.client.post)(
+                    f'/api/bookings/{self.booking.id}/update-status/', {'status': 'accepted'},
+                    content_type='application/json')
+                event, data = await self.next_event(stream)
+                self.assertEqual((event, data['event'], data['booking']['id']), ('booking', 'accepted', self.booking.id))
+                await stream.aclose()
+
+    async def test_needs_one_of_booking_or_user(self):
+        self.assertEqual((await AsyncClient().get('/api/bookings/events/')).status_code, 400)
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+)
+class BookingExpiryTests(TestCase):
+    def setUp(self):
+        self.driver = create_driver()
+        self.old = timezone.now() - datetime.timedelta(hours=1)
+
+    def booking(self, n, status='pending', created_at=None):
+        booking = create_booking(create_rider(n), self.driver, status=status)
+        BookingRequest.objects.filter(pk=booking.pk).update(created_at=created_at or timezone.now())
+        return booking
+
+    def test_stale_pending_bookings_expire_in_batches(self):
+        stale = [self.booking(i, created_at=self.old) for i in range(3)]
+        fresh = self.booking(3)
+        rejected = self.booking(4, status='rejected', created_at=self.old)
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(driver_group(self.driver.id), channel)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(expire_pending_bookings(ttl=600, batch_size=2), (3, 2))
+
+        statuses = dict(BookingRequest.objects.values_list('id', 'status'))
+        self.assertEqual([statuses[booking.id] for booking in stale], ['expired'] * 3)
+        self.assertEqual((statuses[fresh.id], statuses[rejected.id]), ('pending', 'rejected'))
+        events = [async_to_sync(layer.receive)(channel) for _ in stale]
+        self.assertEqual({(event['event'], event['booking']['status']) for event in events}, {('expired', 'expired')})
+        self.assertEqual({event['booking']['id'] for event in events}, {booking.id for booking in stale})
+
+        # Too late to accept, and nothing left for the next sweep
+        response = self.client.post(f'/api/bookings/{stale[0].id}/update-status/', {'status': 'accepted'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(expire_pending_bookings(ttl=600), (0, 0))
+
+    def test_command_reports_each_sweep(self):
+        self.booking(0, created_at=self.old)
+        out = io.StringIO()
+        call_command('expire_bookings', '--once', '--ttl', '600', stdout=out)
+        self.assertRegex(out.getvalue(), r'expired 1 bookings in 1 batches, [\d.]+ ms')
@@ -0,0 +1,123 @@
+"""
+Topic channel groups for live locations.
+
+Besides the fleet-wide group and the viewport cells, every ping is published
+to the topics it belongs to, so clients only receive what they follow:
+
+    vehicles.<type>            every vehicle of one type, e.g. vehicles.bus
+    vehicle.<type>.<id>        one vehicle (id is the driver id sent in pings)
+    route.<type>.<route id>    vehicles assigned to a BusRoute/CarRoute/BikeRoute
+"""
+
+import re
+import time
+
+from channels.db import database_sync_to_async
+
+from .constants import VEHICLE_TYPES
+from .models import BikeRoute, BusRoute, CarRoute, Driver
+
+ROUTE_MODELS = {'bus': BusRoute, 'car': CarRoute, 'bike': BikeRoute}
+
+# Most topics one socket may follow
+MAX_TOPICS = 100
+
+# Seconds a driver -> route ids lookup is reused before hitting the database again
+ROUTE_CACHE_TTL = 60
+ROUTE_CACHE_MAX = 50000
+
+_types = '|'.join(VEHICLE_TYPES)
+TOPIC_RE = re.compile(
+    rf'^(?:vehicles\.(?P<fleet>{_types})'
+    rf'|vehicle\.(?P<vehicle_type>{_types})\.(?P<vehicle_id>\d{{1,18}})'
+    rf'|route\.(?P<route_type>{_types})\.(?P<route_id>\d{{1,18}}))$'
+)
+
+
+def fleet_group(vehicle_type):
+    return f"vehicles.{vehicle_type}"
+
+
+def vehicle_group(vehicle_type, vehicle_id):
+    return f"vehicle.{vehicle_type}.{vehicle_id}"
+
+
+def route_group(vehicle_type, route_id):
+    return f"route.{vehicle_type}.{route_id}"
+
+
+def parse_topic(topic):
+    """Return the regex match for a valid topic name, or None."""
+    if not isinstance(topic, str):
+        return None
+    return TOPIC_RE.match(topic)
+
+
+def topic_groups(entry, route_ids):
+    """Topic groups an entry is published to, given its resolved route ids."""
+    vehicle_type = entry['vehicle_type']
+    if vehicle_type not in VEHICLE_TYPES:
+        return []
+    groups = [fleet_group(vehicle_type), vehicle_group(vehicle_type, entry['id'])]
+    groups.extend(route_group(vehicle_type, route_id) for route_id in route_ids)
+    return groups
+
+
+_route_cache = {}  # (vehicle_type, driver id) -> (route ids, expires_at)
+
+
+def _route_ids_by_key(keys):
+    """Route ids of each (vehicle_type, driver id), one query per table touched."""
+    result = {key: [] for key in keys}
+    requested = set(keys)
+
+    # Driver.vehicle_type / vehicle_id are kept in sync when vehicles are assigned
+    vehicles = {}  # (vehicle_type, vehicle id) -> key
+    assigned = Driver.objects.filter(
+        id__in={driver_id for _, driver_id in keys}, vehicle_id__isnull=False
+    ).values_list('id', 'vehicle_type', 'vehicle_id')
+    for driver_id, vehicle_type, vehicle_id in assigned:
+        if (vehicle_type, driver_id) in requested:
+            vehicles[(vehicle_type, vehicle_id)] = (vehicle_type, driver_id)
+
+    for vehicle_type, model in ROUTE_MODELS.items():
+        vehicle_ids = [vid for vtype, vid in vehicles if vtype == vehicle_type]
+        if not vehicle_ids:
+            continue
+        routes = model.objects.filter(vehicle_id__in=vehicle_ids).values_list('vehicle_id', 'id')
+        for vehicle_id, route_id in routes:
+            result[vehicles[(vehicle_type, vehicle_id)]].append(route_id)
+    return result
+
+
+async def resolve_route_ids(keys):
+    """Return {(vehicle_type, driver id): [route ids]}, cached for ROUTE_CACHE_TTL."""
+    now = time.monotonic()
+    result = {}
+    missing = []
+    for key in keys:
+        cached = _route_cache.get(key)
+        if cached and cached[1] > now:
+            result[key] = cached[0]
+        elif key[0] in ROUTE_MODELS:
+            missing.append(key)
+        else:
+            result[key] = []
+    if missing:
+        if len(_route_cache) > ROUTE_CACHE_MAX:
+            _route_cache.clear()
+        fetched = await database_sync_to_async(_route_ids_by_key)(missing)
+        for key, route_ids in fetched.items():
+            _route_cache[key] = (route_ids, now + ROUTE_CACHE_TTL)
+        result.update(fetched)
+    return result
+
+
+@database_sync_to_async
+def drivers_on_route(vehicle_type, route_id):
+    """Driver ids whose assigned vehicle runs the given route."""
+    vehicle_ids = ROUTE_MODELS[vehicle_type].objects.filter(id=route_id).values('vehicle_id')
+    return list(
+        Driver.objects.filter(vehicle_type=vehicle_type, vehicle_id__in=vehicle_ids)
+        .values_list('id', flat=True)
+    )
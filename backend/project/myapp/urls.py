@@ -86,10 +86,16 @@ urlpatterns = [
     path('bike-routes/delete/<int:pk>/', views.delete_bike_route),
     
     
+    path('fleet/', views.get_fleet, name='get-fleet'),
+    path('vehicles/resolve/', views.resolve_vehicles, name='resolve-vehicles'),
+    path('dispatch/nearest/', views.nearest_vehicles, name='nearest-vehicles'),
+    path('cache-stats/', views.cache_stats, name='cache-stats'),
+
     path('bookings/create/', views.create_booking, name='create_booking'),
     path('otp-entries/', views.get_all_otp_entries, name='get_all_otp_entries'),
     path('bookings/', views.get_booking_requests, name='get-bookings'),
     path('bookings/driver-id/', views.get_bookings_by_driver, name='get-bookings'),
+    path('bookings/events/', views.booking_events, name='booking-events'),
     path('bookings/<int:booking_id>/update-status/', views.update_booking_status, name='update-booking-status'),
     
     # Swagger/OpenAPI endpoints
@@ -3,10 +3,11 @@ from rest_framework_simplejwt.tokens import RefreshToken
 
 # Create your views here.
 import random
-from datetime import timedelta
+from datetime import datetime, time, timedelta
 from twilio.rest import Client
 from django.conf import settings
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django.contrib.auth.hashers import make_password, check_password
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes, authentication_classes
@@ -18,6 +19,7 @@ from .serializers import PhoneSerializer, OTPVerifySerializer,generate_tokens_fo
 from django.contrib.auth.models import User
 
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET
 from .models import Conductor
 from .serializers import ConductorSerializer
 from .models import*
@@ -31,6 +33,7 @@ from .serializers import BusSerializer
 from .serializers import CarSerializer
 from .serializers import BikeSerializer
 from .serializers import BusRouteSerializer
+from .serializers import ConductorListSerializer, DriverListSerializer
 from django.core.exceptions import ObjectDoesNotExist
 from .models import PersonalDetails, GSTDetails, DocumentsUpload, BankDetails
 from .serializers import (
@@ -39,6 +42,25 @@ from .serializers import (
     DocumentsUploadSerializer,
     BankDetailsSerializer,
 )
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter, PolymorphicProxySerializer, extend_schema, inline_serializer
+from rest_framework import serializers
+from .bookings import (
+    BOOKING_FIELDS, BookingAlreadyDecided, RiderHasActiveBooking, booking_group, booking_payload, booking_row,
+    decide_booking, publish_booking_event, rider_group,
+)
+from .cache import cached_response, hit_rates
+from .conditional import conditional_get
+from .dispatch import MAX_RADIUS_KM, MAX_RESULTS, default_radius, nearest_available
+from .fieldsets import FIELDS_PARAMETER, InvalidFields, paginate_fields
+from .geo import MAX_LATITUDE, parse_bbox
+from .sse import channel_events, event_stream_response
+from .pagination import (
+    KEYSET_PARAMETERS, InvalidCursor, KeysetPage, decode_cursor, encode_cursor, page_size, paginate_keyset,
+    wants_page,
+)
+from django.db.models import CharField, F, FloatField, Q, Value
+from django.db.models.functions import Cast
 
 
 def update_driver_vehicle_info(driver_id, vehicle_type, vehicle_id):
@@ -104,11 +126,14 @@ def get_all_otp_entries(request):
             )
             # Note: 'otp' field is intentionally excluded for security
             
-            # Convert QuerySet to list for JSON serialization
-            data = list(otp_entries)
+            # One keyset page at a time if asked for (?cursor=&page_size=), else every row
+            page = paginate_keyset(request, otp_entries)
+            data = page.rows
             
-            return JsonResponse({'otp_entries': data}, safe=False)
+            return page.apply_headers(JsonResponse({'otp_entries': data, 'next_cursor': page.next_cursor}, safe=False))
             
+        except InvalidCursor as e:
+            return JsonResponse({'error': str(e)}, status=400)
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
     
@@ -509,13 +534,24 @@ def login_driver(request):
 # ----------------------------
 # READ all drivers (GET)
 # ----------------------------
+@extend_schema(
+    parameters=KEYSET_PARAMETERS + [FIELDS_PARAMETER],
+    responses=inline_serializer('DriverPage', {
+        'drivers': DriverListSerializer(many=True),
+        'next_cursor': serializers.CharField(allow_null=True),
+    }),
+)
 @api_view(['GET'])
+@conditional_get(Driver)
 def get_driver_details(request):
-    drivers = Driver.objects.all()
-    serializer = DriverSerializer(drivers, many=True)
-    return Response({'drivers': serializer.data}, status=200)
+    try:
+        page = paginate_fields(request, Driver.objects.all(), DriverListSerializer)
+    except (InvalidCursor, InvalidFields) as e:
+        return Response({'error': str(e)}, status=400)
+    return page.apply_headers(Response({'drivers': page.rows, 'next_cursor': page.next_cursor}, status=200))
     
 @api_view(['GET'])
+@conditional_get(Driver)
 def get_driver_details_id(request, driver_id):
     try:
         driver = Driver.objects.get(pk=driver_id)
@@ -595,11 +631,20 @@ def login_conductor(request):
 # ----------------------------
 # READ all conductors (GET)
 # ----------------------------
+@extend_schema(
+    parameters=KEYSET_PARAMETERS + [FIELDS_PARAMETER],
+    responses=inline_serializer('ConductorPage', {
+        'conductors': ConductorListSerializer(many=True),
+        'next_cursor': serializers.CharField(allow_null=True),
+    }),
+)
 @api_view(['GET'])
 def get_conductor_details(request):
-    conductors = Conductor.objects.all()
-    serializer = ConductorSerializer(conductors, many=True)
-    return Response({'conductors': serializer.data}, status=200)
+    try:
+        page = paginate_fields(request, Conductor.objects.all(), ConductorListSerializer)
+    except (InvalidCursor, InvalidFields) as e:
+        return Response({'error': str(e)}, status=400)
+    return page.apply_headers(Response({'conductors': page.rows, 'next_cursor': page.next_cursor}, status=200))
 
 
 @api_view(['GET'])
@@ -669,11 +714,17 @@ def create_bus(request):
 # ----------------------------
 # READ all buses (GET)
 # ----------------------------
+@extend_schema(parameters=KEYSET_PARAMETERS + [FIELDS_PARAMETER], responses=BusSerializer(many=True))
 @api_view(['GET'])
+@conditional_get(Bus)
+@cached_response(Bus)
 def get_bus_details(request):
-    buses = Bus.objects.all()
-    serializer = BusSerializer(buses, many=True)
-    return Response(serializer.data, status=200)
+    try:
+        page = paginate_fields(request, Bus.objects.all(), BusSerializer)
+    except (InvalidCursor, InvalidFields) as e:
+        return Response({'error': str(e)}, status=400)
+    # Next page in the Link header, the body stays a plain list
+    return page.apply_headers(Response(page.rows, status=200))
 
 # ----------------------------
 # UPDATE a bus by ID (PUT)
@@ -717,6 +768,7 @@ def delete_bus(request, bus_id):
         return Response({'error': 'Failed to delete bus', 'details': str(e)}, status=500)
 
 @api_view(['GET'])
+@conditional_get(Bus)
 def get_bus_by_driver_id(request, driver_id):
     try:
         bus = Bus.objects.get(driver__id=driver_id)
@@ -728,11 +780,15 @@ def get_bus_by_driver_id(request, driver_id):
         return Response({'error': f'An unexpected error occurred: {str(e)}'}, status=500)
 
 @api_view(['GET'])
+@conditional_get(BusRoute)
+@cached_response(BusRoute)
 def get_bus_routes(request):
     routes = list(BusRoute.objects.values())
     return Response(routes)
 
 @api_view(['GET'])
+@conditional_get(BusRoute)
+@cached_response(BusRoute)
 def get_bus_route(request, pk):
     try:
         route = BusRoute.objects.get(id=pk)
@@ -821,21 +877,48 @@ def create_bus_checkpoint(request):
     except Exception as e:
         return Response({'error': str(e)}, status=500)
 
+@extend_schema(parameters=[
+    OpenApiParameter('route', OpenApiTypes.INT, description='Only the checkpoints of this bus route.'),
+    OpenApiParameter('bbox', OpenApiTypes.STR, description='Only checkpoints inside south,west,north,east.'),
+])
 @api_view(['GET'])
+@conditional_get(BusCheckpoint)
+@cached_response(BusCheckpoint)
 def list_bus_checkpoints(request):
-    checkpoints = BusCheckpoint.objects.all()
+    # Ordered (route, id) to walk the buscheckpoint_route_idx index
+    checkpoints = BusCheckpoint.objects.order_by('route_id', 'id')
+
+    route = request.GET.get('route')
+    if route is not None:
+        try:
+            checkpoints = checkpoints.filter(route_id=int(route))
+        except ValueError:
+            return Response({'error': 'route must be a bus route id'}, status=400)
+
+    bbox = request.GET.get('bbox')
+    if bbox is not None:
+        try:
+            south, west, north, east = parse_bbox(bbox.split(','))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+        checkpoints = checkpoints.filter(lat__range=(south, north), lng__range=(west, east))
+
+    # route_id is the FK column; cp.route.id would load every route (one query per row)
+    checkpoints = checkpoints.values_list('id', 'address', 'lat', 'lng', 'route_id')
     data = [
         {
-            'id': cp.id,
-            'address': cp.address,
-            'lat': cp.lat,
-            'lng': cp.lng,
-            'route': cp.route.id
-        } for cp in checkpoints
+            'id': cp_id,
+            'address': address,
+            'lat': lat,
+            'lng': lng,
+            'route': route_id
+        } for cp_id, address, lat, lng, route_id in checkpoints
     ]
     return Response(data)
 
 @api_view(['GET'])
+@conditional_get(BusCheckpoint)
+@cached_response(BusCheckpoint)
 def get_bus_checkpoint(request, pk):
     try:
         cp = BusCheckpoint.objects.get(id=pk)
@@ -844,7 +927,7 @@ def get_bus_checkpoint(request, pk):
             'address': cp.address,
             'lat': cp.lat,
             'lng': cp.lng,
-            'route': cp.route.id
+            'route': cp.route_id
         }
         return Response(data)
     except BusCheckpoint.DoesNotExist:
@@ -892,11 +975,17 @@ def create_car(request):
         }, status=201)
     return Response(serializer.errors, status=400)
 
+@extend_schema(parameters=KEYSET_PARAMETERS + [FIELDS_PARAMETER], responses=CarSerializer(many=True))
 @api_view(['GET'])
+@conditional_get(Car)
+@cached_response(Car)
 def get_car_details(request):
-    cars = Car.objects.all()
-    serializer = CarSerializer(cars, many=True)
-    return Response(serializer.data, status=200)
+    try:
+        page = paginate_fields(request, Car.objects.all(), CarSerializer)
+    except (InvalidCursor, InvalidFields) as e:
+        return Response({'error': str(e)}, status=400)
+    # Next page in the Link header, the body stays a plain list
+    return page.apply_headers(Response(page.rows, status=200))
 
 @api_view(['PUT'])
 def update_car(request, car_id):
@@ -930,6 +1019,7 @@ def delete_car(request, car_id):
         return Response({'error': 'Failed to delete car', 'details': str(e)}, status=500)
 
 @api_view(['GET'])
+@conditional_get(Car)
 def get_car_by_driver_id(request, driver_id):
     try:
         car = Car.objects.get(driver__id=driver_id)
@@ -962,19 +1052,23 @@ def create_car_route(request):
         return Response({'error': 'Car not found'}, status=400)
 
 @api_view(['GET'])
+@conditional_get(CarRoute)
+@cached_response(CarRoute)
 def list_car_routes(request):
-    routes = CarRoute.objects.all()
-    data = [{'id': r.id, 'name': r.name, 'vehicle_id': r.vehicle.id} for r in routes]
+    # vehicle_id straight from the FK column, no query per route
+    data = list(CarRoute.objects.values('id', 'name', 'vehicle_id'))
     return Response(data)
 
 @api_view(['GET'])
+@conditional_get(CarRoute)
+@cached_response(CarRoute)
 def get_car_route(request, pk):
     try:
         route = CarRoute.objects.get(id=pk)
         data = {
             'id': route.id,
             'name': route.name,
-            'vehicle_id': route.vehicle.id
+            'vehicle_id': route.vehicle_id
         }
         return Response(data)
     except CarRoute.DoesNotExist:
@@ -1015,11 +1109,17 @@ def create_bike(request):
         }, status=201)
     return Response(serializer.errors, status=400)
 
+@extend_schema(parameters=KEYSET_PARAMETERS + [FIELDS_PARAMETER], responses=BikeSerializer(many=True))
 @api_view(['GET'])
+@conditional_get(Bike)
+@cached_response(Bike)
 def get_bike_details(request):
-    bikes = Bike.objects.all()
-    serializer = BikeSerializer(bikes, many=True)
-    return Response(serializer.data, status=200)
+    try:
+        page = paginate_fields(request, Bike.objects.all(), BikeSerializer)
+    except (InvalidCursor, InvalidFields) as e:
+        return Response({'error': str(e)}, status=400)
+    # Next page in the Link header, the body stays a plain list
+    return page.apply_headers(Response(page.rows, status=200))
 
 @api_view(['PUT'])
 def update_bike(request, bike_id):
@@ -1053,6 +1153,7 @@ def delete_bike(request, bike_id):
         return Response({'error': 'Failed to delete bike', 'details': str(e)}, status=500)
 
 @api_view(['GET'])
+@conditional_get(Bike)
 def get_bike_by_driver_id(request, driver_id):
     try:
         bike = Bike.objects.get(driver__id=driver_id)
@@ -1083,19 +1184,23 @@ def create_bike_route(request):
         return Response({'error': 'Bike not found'}, status=400)
 
 @api_view(['GET'])
+@conditional_get(BikeRoute)
+@cached_response(BikeRoute)
 def list_bike_routes(request):
-    routes = BikeRoute.objects.all()
-    data = [{'id': r.id, 'name': r.name, 'vehicle_id': r.vehicle.id} for r in routes]
+    # vehicle_id straight from the FK column, no query per route
+    data = list(BikeRoute.objects.values('id', 'name', 'vehicle_id'))
     return Response(data)
 
 @api_view(['GET'])
+@conditional_get(BikeRoute)
+@cached_response(BikeRoute)
 def get_bike_route(request, pk):
     try:
         route = BikeRoute.objects.get(id=pk)
         data = {
             'id': route.id,
             'name': route.name,
-            'vehicle_id': route.vehicle.id
+            'vehicle_id': route.vehicle_id
         }
         return Response(data)
     except BikeRoute.DoesNotExist:
@@ -1125,6 +1230,249 @@ def delete_bike_route(request, pk):
         return Response({'error': 'Bike route not found'}, status=404)
 
 
+# ----------------------------
+# Whole fleet in one query (GET)
+# ----------------------------
+FLEET_MODELS = {'bike': Bike, 'bus': Bus, 'car': Car}  # Sorted: pages are ordered (vehicle_type, id)
+FLEET_FIELDS = [
+    'fleet_type', 'id', 'license_plate', 'driver_id', 'is_booked', 'initial_status',
+    'current_status', 'current_lat', 'current_lng', 'last_updated',
+]
+
+
+def fleet_queryset(vehicle_type, model):
+    runtime = model.__name__.lower() + 'runtimedata'  # Reverse one-to-one accessor
+    return model.objects.annotate(
+        fleet_type=Value(vehicle_type, output_field=CharField()),
+        current_status=F(f'{runtime}__current_status'),
+        # CarRuntimeData stores decimals; every part of the UNION must agree on types
+        current_lat=Cast(f'{runtime}__current_lat', FloatField()),
+        current_lng=Cast(f'{runtime}__current_lng', FloatField()),
+        last_updated=F(f'{runtime}__last_updated'),
+    ).values(*FLEET_FIELDS)
+
+
+@extend_schema(
+    parameters=KEYSET_PARAMETERS + [
+        OpenApiParameter('type', OpenApiTypes.STR, description='Comma-separated vehicle types, e.g. bus,car.'),
+        OpenApiParameter('status', OpenApiTypes.STR, description='Vehicle status: Active, Maintenance or Inactive.'),
+        OpenApiParameter('available', OpenApiTypes.BOOL, description='true: only vehicles that are not booked.'),
+    ],
+    responses=inline_serializer('FleetPage', {
+        'vehicles': inline_serializer('FleetVehicle', {
+            'vehicle_type': serializers.CharField(),
+            'id': serializers.IntegerField(),
+            'license_plate': serializers.CharField(),
+            'driver_id': serializers.IntegerField(allow_null=True),
+            'is_booked': serializers.BooleanField(),
+            'status': serializers.CharField(),
+            'current_status': serializers.CharField(allow_null=True),
+            'current_lat': serializers.FloatField(allow_null=True),
+            'current_lng': serializers.FloatField(allow_null=True),
+            'last_updated': serializers.DateTimeField(allow_null=True),
+        }, many=True),
+        'next_cursor': serializers.CharField(allow_null=True),
+    }),
+)
+@api_view(['GET'])
+@conditional_get(Bus, Car, Bike, BusRuntimeData, CarRuntimeData, BikeRuntimeData)
+def get_fleet(request):
+    """Buses, cars and bikes with their latest runtime position, as one UNION ALL query."""
+    types = request.GET.get('type')
+    types = types.split(',') if types else list(FLEET_MODELS)
+    unknown = set(types) - set(FLEET_MODELS)
+    if unknown:
+        return Response({'error': f"Unknown vehicle types: {', '.join(sorted(unknown))}"}, status=400)
+
+    cursor = request.GET.get('cursor')
+    after = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor, 2)
+            after = (str(after[0]), int(after[1]))
+        except (InvalidCursor, TypeError, ValueError):
+            return Response({'error': 'Invalid cursor'}, status=400)
+
+    parts = []
+    for vehicle_type in sorted(types):
+        if after and vehicle_type < after[0]:
+            continue  # Whole type already served
+        queryset = fleet_queryset(vehicle_type, FLEET_MODELS[vehicle_type])
+        if after and vehicle_type == after[0]:
+            queryset = queryset.filter(id__gt=after[1])
+        if request.GET.get('status'):
+            queryset = queryset.filter(initial_status=request.GET['status'])
+        if request.GET.get('available') in ('true', '1'):
+            queryset = queryset.filter(is_booked=False)
+        elif request.GET.get('available') in ('false', '0'):
+            queryset = queryset.filter(is_booked=True)
+        parts.append(queryset)
+
+    size = page_size(request) if wants_page(request) else None
+    rows = []
+    if parts:
+        fleet = parts[0].union(*parts[1:], all=True) if len(parts) > 1 else parts[0]
+        fleet = fleet.order_by('fleet_type', 'id')
+        rows = list(fleet[:size + 1] if size else fleet)
+    next_cursor = None
+    if size and len(rows) > size:
+        rows = rows[:size]
+        next_cursor = encode_cursor([rows[-1]['fleet_type'], rows[-1]['id']])
+
+    vehicles = [
+        {
+            'vehicle_type': row['fleet_type'],
+            'id': row['id'],
+            'license_plate': row['license_plate'],
+            'driver_id': row['driver_id'],
+            'is_booked': row['is_booked'],
+            'status': row['initial_status'],
+            'current_status': row['current_status'],
+            'current_lat': row['current_lat'],
+            'current_lng': row['current_lng'],
+            'last_updated': row['last_updated'],
+        }
+        for row in rows
+    ]
+    page = KeysetPage(request, rows, next_cursor)
+    return page.apply_headers(Response({'vehicles': vehicles, 'next_cursor': next_cursor}))
+
+
+@api_view(['GET'])
+def cache_stats(request):
+    """Hit/miss counters of the cached read endpoints."""
+    return Response({'views': hit_rates()})
+
+
+# ----------------------------
+# Resolve many vehicles at once (GET)
+# ----------------------------
+VEHICLE_SERIALIZERS = {'bus': BusSerializer, 'car': CarSerializer, 'bike': BikeSerializer}
+MAX_RESOLVE = 200
+
+
+def parse_id_list(value):
+    return [int(item) for item in value.split(',') if item.strip()] if value else []
+
+
+def resolved_vehicle():
+    """Schema of a resolved vehicle: a Bus, Car or Bike, told apart by vehicle_type."""
+    return PolymorphicProxySerializer(
+        component_name='ResolvedVehicle',
+        serializers=VEHICLE_SERIALIZERS,
+        resource_type_field_name='vehicle_type',
+    )
+
+
+@extend_schema(
+    parameters=[
+        OpenApiParameter('driver_ids', OpenApiTypes.STR, description='Comma-separated driver ids (the ids sent in live pings).'),
+        OpenApiParameter('vehicle_type', OpenApiTypes.STR, description='Limit driver_ids lookups to bus, car or bike.'),
+        OpenApiParameter('vehicles', OpenApiTypes.STR, description='Comma-separated type:vehicle id pairs, e.g. car:3,bus:5.'),
+    ],
+    responses=inline_serializer('ResolvedVehicles', {
+        'drivers': serializers.DictField(child=resolved_vehicle(), help_text='Keyed by driver id.'),
+        'vehicles': serializers.DictField(child=resolved_vehicle(), help_text='Keyed by type:vehicle id.'),
+        'missing': serializers.ListField(child=serializers.CharField(), help_text='e.g. driver:4 or car:3.'),
+    }),
+)
+@api_view(['GET'])
+@conditional_get(Bus, Car, Bike)
+def resolve_vehicles(request):
+    """
+    Details of many vehicles in one request, at most one query per vehicle type.
+    Returns {"drivers": {driver id: vehicle}, "vehicles": {"type:id": vehicle}, "missing": [...]}.
+    """
+    try:
+        driver_ids = parse_id_list(request.GET.get('driver_ids'))
+        pairs = []
+        for item in filter(None, request.GET.get('vehicles', '').split(',')):
+            vehicle_type, _, vehicle_id = item.partition(':')
+            pairs.append((vehicle_type, int(vehicle_id)))
+    except ValueError:
+        return Response({'error': 'ids must be integers, vehicles must look like car:3'}, status=400)
+
+    if len(driver_ids) + len(pairs) > MAX_RESOLVE:
+        return Response({'error': f'At most {MAX_RESOLVE} ids per request'}, status=400)
+    driver_types = [request.GET['vehicle_type']] if request.GET.get('vehicle_type') else list(VEHICLE_SERIALIZERS)
+    unknown = (set(driver_types) | {vehicle_type for vehicle_type, _ in pairs}) - set(VEHICLE_SERIALIZERS)
+    if unknown:
+        return Response({'error': f"Unknown vehicle types: {', '.join(sorted(unknown))}"}, status=400)
+
+    by_driver = {}
+    by_vehicle = {}
+    for vehicle_type, serializer_class in VEHICLE_SERIALIZERS.items():
+        model = serializer_class.Meta.model
+        vehicle_ids = {vehicle_id for t, vehicle_id in pairs if t == vehicle_type}
+        wanted_drivers = set(driver_ids) if vehicle_type in driver_types else set()
+        if not vehicle_ids and not wanted_drivers:
+            continue
+        # One query per type covers both lookups
+        vehicles = model.objects.filter(Q(id__in=vehicle_ids) | Q(driver_id__in=wanted_drivers))
+        for vehicle, data in zip(vehicles, serializer_class(vehicles, many=True).data):
+            if vehicle.id in vehicle_ids:
+                by_vehicle[f'{vehicle_type}:{vehicle.id}'] = data
+            if vehicle.driver_id in wanted_drivers:
+                by_driver[str(vehicle.driver_id)] = data
+
+    missing = [f'driver:{driver_id}' for driver_id in driver_ids if str(driver_id) not in by_driver]
+    missing += [f'{t}:{vehicle_id}' for t, vehicle_id in pairs if f'{t}:{vehicle_id}' not in by_vehicle]
+    return Response({'drivers': by_driver, 'vehicles': by_vehicle, 'missing': missing})
+
+
+# ----------------------------
+# Nearest available vehicles (GET)
+# ----------------------------
+def parse_pickup(params, lat_key='lat', lng_key='lng'):
+    """(lat, lng, vehicle types or None, radius km) from query or body params. Raises ValueError."""
+    try:
+        lat, lng = float(params.get(lat_key)), float(params.get(lng_key))
+    except (TypeError, ValueError):
+        raise ValueError(f"{lat_key} and {lng_key} must be numbers")
+    if abs(lat) > MAX_LATITUDE or abs(lng) > 180:
+        raise ValueError(f"{lat_key} or {lng_key} out of range")
+    vehicle_type = params.get('vehicle_type')
+    if vehicle_type and vehicle_type not in VEHICLE_SERIALIZERS:
+        raise ValueError(f"Unknown vehicle type: {vehicle_type}")
+    try:
+        radius_km = float(params.get('radius_km') or default_radius())
+    except (TypeError, ValueError):
+        raise ValueError("radius_km must be a number")
+    if not 0 < radius_km <= MAX_RADIUS_KM:
+        raise ValueError(f"radius_km must be between 0 and {MAX_RADIUS_KM}")
+    return lat, lng, [vehicle_type] if vehicle_type else None, radius_km
+
+
+@extend_schema(
+    parameters=[
+        OpenApiParameter('lat', OpenApiTypes.DOUBLE, required=True),
+        OpenApiParameter('lng', OpenApiTypes.DOUBLE, required=True),
+        OpenApiParameter('vehicle_type', OpenApiTypes.STR, description='bus, car or bike. Defaults to any.'),
+        OpenApiParameter('radius_km', OpenApiTypes.DOUBLE, description=f'At most {MAX_RADIUS_KM}.'),
+        OpenApiParameter('k', OpenApiTypes.INT, description=f'Vehicles to return, default 5, at most {MAX_RESULTS}.'),
+    ],
+    responses=inline_serializer('NearestVehicles', {
+        'vehicles': inline_serializer('NearestVehicle', {
+            'driver_id': serializers.IntegerField(),
+            'vehicle_type': serializers.CharField(),
+            'vehicle_id': serializers.IntegerField(),
+            'latitude': serializers.FloatField(),
+            'longitude': serializers.FloatField(),
+            'distance_km': serializers.FloatField(),
+        }, many=True),
+    }),
+)
+@api_view(['GET'])
+def nearest_vehicles(request):
+    """Live, unbooked vehicles nearest to a point, nearest first (see myapp/dispatch.py)."""
+    try:
+        lat, lng, vehicle_types, radius_km = parse_pickup(request.GET)
+        k = max(1, min(int(request.GET.get('k', 5)), MAX_RESULTS))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+    return Response({'vehicles': nearest_available(lat, lng, vehicle_types, k, radius_km)})
+
+
 
 from .models import BookingRequest
 from .serializers import BookingRequestSerializer
@@ -1139,16 +1487,32 @@ def create_booking(request):
         if 'driver' in data and 'drivers' not in data:
             data['drivers'] = data.pop('driver')
 
+        # No driver chosen: send the request to the nearest available one
+        dispatched = None
+        if not data.get('drivers'):
+            try:
+                lat, lng, vehicle_types, radius_km = parse_pickup(data, 'from_lat', 'from_lng')
+            except ValueError as e:
+                return Response({'error': f"Give a driver, or a pickup point to dispatch to: {e}"}, status=400)
+            nearest = nearest_available(lat, lng, vehicle_types, 1, radius_km)
+            if not nearest:
+                return Response({'error': 'No available vehicle nearby'}, status=404)
+            dispatched = nearest[0]
+            data['drivers'] = dispatched['driver_id']
+
         serializer = BookingRequestSerializer(data=data)
         
         if serializer.is_valid():
             booking = serializer.save()
+            # Reaches the driver's app over ws/bookings/ (BookingConsumer)
+            publish_booking_event('created', booking_row(booking))
             return Response({
                 'message': 'Booking created successfully',
                 'booking_id': booking.id,
-                'drivers': booking.drivers.id,
+                'drivers': booking.drivers_id,
                 'status': booking.status,
-                'created_at': booking.created_at
+                'created_at': booking.created_at,
+                'dispatched': dispatched,
             }, status=201)
         return Response(serializer.errors, status=400)
             
@@ -1156,85 +1520,150 @@ def create_booking(request):
         return Response({'error': str(e)}, status=500)
     
     
+BOOKING_FILTER_PARAMETERS = [
+    OpenApiParameter('status', OpenApiTypes.STR, description='Comma-separated statuses, e.g. `pending,accepted`.'),
+    OpenApiParameter('created_after', OpenApiTypes.DATETIME,
+                     description='Only bookings created at or after this time (ISO 8601 date or datetime).'),
+    OpenApiParameter('created_before', OpenApiTypes.DATETIME,
+                     description='Only bookings created before this time (ISO 8601 date or datetime).'),
+]
+
+BOOKING_ROW = inline_serializer('BookingRequestRow', {
+    'id': serializers.IntegerField(),
+    'user_id': serializers.IntegerField(),
+    'drivers_id': serializers.IntegerField(),
+    'from_address': serializers.CharField(),
+    'to_address': serializers.CharField(),
+    'status': serializers.CharField(),
+    'created_at': serializers.DateTimeField(),
+}, many=True)
+
+
+def parse_moment(value):
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid date or datetime: {value}")
+        moment = datetime.combine(day, time())
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def filter_bookings(request, bookings):
+    """Apply ?status= and ?created_after= / ?created_before=. Raises ValueError for bad values."""
+    statuses = request.GET.get('status')
+    if statuses:
+        statuses = [status.strip() for status in statuses.split(',') if status.strip()]
+        valid = dict(BookingRequest.STATUS_CHOICES)
+        unknown = [status for status in statuses if status not in valid]
+        if unknown:
+            raise ValueError(f"Unknown status: {', '.join(unknown)}")
+        bookings = bookings.filter(status__in=statuses)
+    created_after = request.GET.get('created_after')
+    if created_after:
+        bookings = bookings.filter(created_at__gte=parse_moment(created_after))
+    created_before = request.GET.get('created_before')
+    if created_before:
+        bookings = bookings.filter(created_at__lt=parse_moment(created_before))
+    return bookings
+
+
+@extend_schema(parameters=KEYSET_PARAMETERS + BOOKING_FILTER_PARAMETERS, responses=BOOKING_ROW)
 @api_view(['GET'])
+@conditional_get(BookingRequest)
 def get_booking_requests(request):
-    bookings = BookingRequest.objects.all().values()
-    return Response(list(bookings))
-    
+    try:
+        bookings = filter_bookings(request, BookingRequest.objects.all())
+        # Newest first, keyed on (created_at, id) so equal timestamps never repeat or skip rows
+        page = paginate_keyset(request, bookings.values(), ordering=('-created_at', '-id'))
+    except ValueError as e:  # Includes InvalidCursor
+        return Response({'error': str(e)}, status=400)
+    return page.apply_headers(Response(page.rows))
+
+
+@extend_schema(
+    parameters=[OpenApiParameter('driver_id', OpenApiTypes.INT, required=True)]
+    + KEYSET_PARAMETERS + BOOKING_FILTER_PARAMETERS,
+    responses=BOOKING_ROW,
+)
 @api_view(['GET'])
+@conditional_get(BookingRequest)
 def get_bookings_by_driver(request):
     driver_id = request.GET.get('driver_id')
     if not driver_id:
         return Response({'error': 'driver_id is required as a query parameter'}, status=400)
 
-    bookings = BookingRequest.objects.filter(drivers_id=driver_id).values()
-    return Response(list(bookings))
+    try:
+        bookings = filter_bookings(request, BookingRequest.objects.filter(drivers_id=int(driver_id)))
+        # booking_driver_status_idx / booking_pending_driver_idx cover this
+        page = paginate_keyset(request, bookings.values(), ordering=('-created_at', '-id'))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+    return page.apply_headers(Response(page.rows))
+
+@require_GET
+async def booking_events(request):
+    """
+    Server-Sent Events with the status of one booking (?booking_id=) or of a
+    rider's bookings (?user_id=). Starts with a "snapshot" event holding the
+    booking, or the rider's pending and accepted bookings, then sends a
+    "booking" event ({"event", "booking"}) for every change. Async: served
+    by daphne without a thread per connection.
+    """
+    try:
+        booking_id = int(request.GET['booking_id']) if request.GET.get('booking_id') else None
+        user_id = int(request.GET['user_id']) if request.GET.get('user_id') else None
+    except ValueError:
+        return JsonResponse({'error': 'booking_id and user_id must be integers'}, status=400)
+    if (booking_id is None) == (user_id is None):
+        return JsonResponse({'error': 'Give exactly one of booking_id or user_id'}, status=400)
+
+    if booking_id is not None:
+        groups = [booking_group(booking_id)]
+        bookings = BookingRequest.objects.filter(pk=booking_id)
+    else:
+        groups = [rider_group(user_id)]
+        bookings = BookingRequest.objects.filter(user_id=user_id, status__in=['pending', 'accepted'])
+
+    async def snapshot():
+        rows = bookings.order_by('-created_at', '-id').values(*BOOKING_FIELDS)
+        return [('snapshot', [booking_payload(row) async for row in rows])]
+
+    def to_event(message):
+        return 'booking', {'event': message['event'], 'booking': message['booking']}
+
+    return event_stream_response(channel_events(groups, snapshot, to_event))
+
 
 @api_view(['POST'])
 def update_booking_status(request, booking_id):
+    status = request.data.get('status')
+    # The driver app sends null when it has no stored vehicle type
+    vehicle_type = str(request.data.get('vehicle_type') or '').lower()
+
+    if status not in ['accepted', 'rejected']:
+        return Response({'error': 'Invalid status. Choose accepted or rejected'}, status=400)
+
     try:
-        status = request.data.get('status')
-        vehicle_type = request.data.get('vehicle_type', '').lower()
-        
-        if status not in ['accepted', 'rejected']:
-            return Response({'error': 'Invalid status. Choose accepted or rejected'}, status=400)
-        
-        booking = BookingRequest.objects.get(id=booking_id)
-        
-        # If trying to accept, check if user already has an accepted booking
-        if status == 'accepted':
-            # Check if this user already has an accepted booking with another driver
-            existing_accepted = BookingRequest.objects.filter(
-                user=booking.user,
-                status='accepted'
-            ).exclude(id=booking_id).first() #or use .exist
-            
-            if existing_accepted:
-                return Response({
-                    'error': 'This user already has an active ride with another driver.',
-                    # 'existing_booking_id': existing_accepted.id,
-                    # 'existing_driver_id': existing_accepted.driver.id
-                }, status=400)
-        
-        booking.status = status
-        booking.save()
-        
-        if status == 'accepted':
-            driver = booking.drivers
-            from .models import Bus, Car, Bike
-            
-            vehicle_model = None
-            if vehicle_type == 'bus':
-                vehicle_model = Bus
-            elif vehicle_type == 'car':
-                vehicle_model = Car
-            elif vehicle_type == 'bike':
-                vehicle_model = Bike
-            
-            if vehicle_model:
-                vehicle = vehicle_model.objects.filter(driver=driver).first()
-                if vehicle:
-                    vehicle.is_booked = True
-                    vehicle.save()
-                    return Response({'message': f'Booking accepted and {vehicle_type} marked as booked'}, status=200)
-                else:
-                    return Response({'error': f'No {vehicle_type} found for this driver'}, status=404)
-            else:
-                found = False
-                for model, name in [(Bus, 'bus'), (Car, 'car'), (Bike, 'bike')]:
-                    vehicle = model.objects.filter(driver=driver).first()
-                    if vehicle:
-                        vehicle.is_booked = True
-                        vehicle.save()
-                        found = True
-                        return Response({'message': f'Booking accepted and {name} marked as booked (auto-detected)'}, status=200)
-                
-                if not found:
-                    return Response({'message': 'Booking accepted but no vehicle found for driver'}, status=200)
-        
-        return Response({'message': 'Booking rejected'}, status=200)
-        
+        booked = decide_booking(booking_id, status, vehicle_type or None)
     except BookingRequest.DoesNotExist:
         return Response({'error': 'Booking not found'}, status=404)
+    except BookingAlreadyDecided as e:
+        # Another driver (or an earlier tap) got there first
+        return Response({'error': str(e)}, status=409)
+    except RiderHasActiveBooking as e:
+        return Response({'error': str(e)}, status=400)
     except Exception as e:
-        return Response({'error': str(e)}, status=500)
\ No newline at end of file
+        return Response({'error': str(e)}, status=500)
+
+    if status == 'rejected':
+        return Response({'message': 'Booking rejected'}, status=200)
+    if booked and vehicle_type:
+        return Response({'message': f'Booking accepted and {booked} marked as booked'}, status=200)
+    if booked:
+        return Response({'message': f'Booking accepted and {booked} marked as booked (auto-detected)'}, status=200)
+    if vehicle_type:
+        return Response({'error': f'No {vehicle_type} found for this driver'}, status=404)
+    return Response({'message': 'Booking accepted but no vehicle found for driver'}, status=200)
\ No newline at end of file
@@ -0,0 +1,126 @@
+"""
+Wire formats for the live location socket.
+
+Clients pick a format with the WebSocket subprotocol header at connect time.
+Without one (or with an unknown one) the socket speaks the original JSON.
+
+"rydon.msgpack.v1" sends MessagePack binary frames with one-letter keys and
+locations packed as arrays of integers:
+
+    frame:    {"t": type, "g": group, "s": seq, "ss": seqs, "m": message, "d": rows}
+    location: [vehicle type code, id, latitude * 1e6, longitude * 1e6, address?]
+    vehicle:  [vehicle type code, id]            (vehicle_offline / vehicle_left)
+
+Vehicle type codes index constants.VEHICLE_TYPES (0 = bus, 1 = car, 2 = bike).
+Drivers may send pings in the same location row layout.
+
+Broadcast frames are encoded once per format by the broadcaster (encode_all)
+and carried pre-encoded in the channel layer event, so consumers forward the
+payload for their format instead of serialising it again for every socket.
+"""
+
+import json
+
+import msgpack
+
+from .constants import VEHICLE_TYPE_CODES, VEHICLE_TYPES
+
+MICRODEGREES = 1_000_000
+
+_frame_keys = {"type": "t", "group": "g", "seq": "s", "seqs": "ss", "message": "m", "data": "d"}
+
+
+class JsonFormat:
+    name = "json"
+    subprotocol = None
+    send_kwarg = "text_data"
+
+    def serialize(self, message):
+        return json.dumps(message)
+
+    def encode(self, message):
+        """Return the kwargs for AsyncWebsocketConsumer.send()."""
+        return {self.send_kwarg: self.serialize(message)}
+
+    def decode(self, text_data=None, bytes_data=None):
+        if text_data is None:
+            raise ValueError("Binary frames need the msgpack subprotocol")
+        return json.loads(text_data)
+
+
+class MsgpackFormat(JsonFormat):
+    name = "msgpack"
+    subprotocol = "rydon.msgpack.v1"
+    send_kwarg = "bytes_data"
+
+    def serialize(self, message):
+        frame = {_frame_keys.get(key, key): value for key, value in message.items() if key != "data"}
+        if "data" in message:
+            frame["d"] = [pack_row(entry) for entry in message["data"]]
+        return msgpack.packb(frame)
+
+    def decode(self, text_data=None, bytes_data=None):
+        if bytes_data is None:
+            # Control messages (subscribe, resync) may still be sent as JSON text
+            return json.loads(text_data)
+        try:
+            value = msgpack.unpackb(bytes_data)
+        except (msgpack.ExtraData, msgpack.FormatError, msgpack.StackError, ValueError) as e:
+            raise ValueError(f"Invalid msgpack frame ({type(e).__name__})")
+        return unpack_row(value) if isinstance(value, list) else value
+
+
+def pack_row(entry):
+    vehicle_type = entry["vehicle_type"]
+    row = [VEHICLE_TYPE_CODES.get(vehicle_type, vehicle_type), entry["id"]]
+    if "latitude" in entry:
+        row += [round(entry["latitude"] * MICRODEGREES), round(entry["longitude"] * MICRODEGREES)]
+        if entry.get("address") is not None:
+            row.append(entry["address"])
+    return row
+
+
+def unpack_row(row):
+    if len(row) < 4:
+        raise ValueError("Location rows are [vehicle type, id, lat e6, lng e6, address?]")
+    vehicle_type = row[0]
+    if isinstance(vehicle_type, int):
+        if not 0 <= vehicle_type < len(VEHICLE_TYPES):
+            raise ValueError(f"Unknown vehicle type code {vehicle_type}")
+        vehicle_type = VEHICLE_TYPES[vehicle_type]
+    elif not isinstance(vehicle_type, str):
+        raise ValueError("Vehicle type must be a code or a name")
+    try:
+        entry = {
+            "id": int(row[1]),
+            "vehicle_type": vehicle_type,
+            "latitude": float(row[2]) / MICRODEGREES,
+            "longitude": float(row[3]) / MICRODEGREES,
+        }
+    except (TypeError, ValueError):
+        # Raised as ValueError so the consumer answers with an error frame
+        raise ValueError("Location row id, latitude and longitude must be numbers")
+    if len(row) > 4:
+        # Broadcast as is to JSON clients too, so only text will do
+        if row[4] is not None and not isinstance(row[4], str):
+            raise ValueError("Location row address must be a string")
+        entry["address"] = row[4]
+    return entry
+
+
+DEFAULT_FORMAT = JsonFormat()
+FORMATS = [MsgpackFormat()]
+
+
+def negotiate(subprotocols):
+    """First format the client offered that we support, else plain JSON."""
+    for subprotocol in subprotocols:
+        for wire_format in FORMATS:
+            if wire_format.subprotocol == subprotocol:
+                return wire_format
+    return DEFAULT_FORMAT
+
+
+def encode_all(message):
+    """Serialise a frame once per format: {format name: text or bytes}."""
+    return {wire_format.name: wire_format.serialize(message) for wire_format in [DEFAULT_FORMAT, *FORMATS]}
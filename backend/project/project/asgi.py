@@ -9,11 +9,16 @@ sys.path.append(str(BASE_DIR))
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
 
 from django.core.asgi import get_asgi_application
+
+# Sets Django up, so it must run before anything that imports models (the consumers)
+django_asgi_app = get_asgi_application()
+
 from channels.routing import ProtocolTypeRouter, URLRouter
 from myapp.routing import websocket_urlpatterns  # Direct import from myapp
 
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    # Plain HTTP, including the async Server-Sent Events views (myapp/sse.py)
+    "http": django_asgi_app,
     "websocket": URLRouter(
         websocket_urlpatterns
     ),
@@ -91,6 +91,65 @@ CHANNEL_LAYERS = {
         },
     },
 }
+
+# Response cache for read-mostly endpoints (see myapp/cache.py); tests override
+# it with local memory
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": f"redis://{REDIS_HOST}:{REDIS_PORT}/{config('REDIS_CACHE_DB', default=1, cast=int)}",
+        "KEY_PREFIX": "rydon",
+    },
+}
+
+# Live vehicle locations shared by every daphne worker (see myapp/location_store.py)
+LOCATION_STORE = {
+    "BACKEND": "myapp.location_store.RedisLocationStore",
+    "CONFIG": {
+        "host": REDIS_HOST,
+        "port": REDIS_PORT,
+        "ttl": config('LOCATION_TTL', default=300, cast=int),  # seconds since last ping
+        "max_entries": config('LOCATION_MAX_VEHICLES', default=10000, cast=int),
+    },
+}
+
+# Pings are coalesced and broadcast once per tick (seconds), see myapp/broadcaster.py
+LOCATION_BROADCAST_TICK = config('LOCATION_BROADCAST_TICK', default=0.5, cast=float)
+
+# Latest positions are written to the *RuntimeData tables this often (seconds), see myapp/persistence.py
+LOCATION_PERSIST_INTERVAL = config('LOCATION_PERSIST_INTERVAL', default=5, cast=float)
+
+# Ping history (LocationPing) is inserted in batches of this many rows, or at
+# least this often (seconds), see myapp/location_history.py
+LOCATION_HISTORY_BATCH_SIZE = config('LOCATION_HISTORY_BATCH_SIZE', default=500, cast=int)
+LOCATION_HISTORY_INTERVAL = config('LOCATION_HISTORY_INTERVAL', default=1.0, cast=float)
+
+# Off: pings are broadcast but never written to the *RuntimeData tables or
+# LocationPing. For load tests, whose simulated drivers reuse real driver ids
+LOCATION_PERSIST = config('LOCATION_PERSIST', default=True, cast=bool)
+
+# Viewport subscriptions: grid cell size in degrees (~5.5 km) and the most
+# cells one socket may subscribe to, see myapp/geo.py
+LOCATION_GRID_CELL_DEG = 0.05
+LOCATION_GRID_MAX_CELLS = 400
+
+# Nearest-driver dispatch: default search radius (km), index cell size in degrees
+# (~550 m) and how often (seconds) a worker re-reads the shared location store
+# into its index, see myapp/dispatch.py
+DISPATCH_RADIUS_KM = config('DISPATCH_RADIUS_KM', default=5, cast=float)
+DISPATCH_CELL_DEG = 0.005
+DISPATCH_RESYNC_INTERVAL = config('DISPATCH_RESYNC_INTERVAL', default=2.0, cast=float)
+
+# Bookings still pending this many seconds after creation expire; the
+# expire_bookings command sweeps every BOOKING_EXPIRY_INTERVAL seconds, this
+# many rows per UPDATE, see myapp/bookings.py
+BOOKING_PENDING_TTL = config('BOOKING_PENDING_TTL', default=600, cast=float)
+BOOKING_EXPIRY_INTERVAL = config('BOOKING_EXPIRY_INTERVAL', default=30, cast=float)
+BOOKING_EXPIRY_BATCH_SIZE = config('BOOKING_EXPIRY_BATCH_SIZE', default=500, cast=int)
+
+# Comment line sent on idle Server-Sent Events streams (seconds), see myapp/sse.py
+SSE_KEEPALIVE_INTERVAL = config('SSE_KEEPALIVE_INTERVAL', default=15, cast=float)
+
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:19006",  # React Native development server
     "http://192.168.29.6",     # Your current Django backend IP
@@ -123,6 +182,9 @@ else:
         "default": {
             "ENGINE": "django.db.backends.sqlite3",
             "NAME": BASE_DIR / "db.sqlite3",
+            # A file rather than shared-cache memory, so concurrent writers in the
+            # tests wait for SQLite's lock instead of failing with "table is locked"
+            "TEST": {"NAME": BASE_DIR / "test_db.sqlite3"},
         }
     }
 
@@ -175,6 +237,10 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
 
+# Keyset pagination of the list endpoints (?cursor=&page_size=), see myapp/pagination.py
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 500
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=1),
      'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
@@ -183,6 +249,8 @@ SIMPLE_JWT = {
 }
 
 CORS_ALLOW_ALL_ORIGINS = True
+# Browsers only let the frontend read the next-page Link header if it is exposed
+CORS_EXPOSE_HEADERS = ['Link']
 
 TWILIO_ACCOUNT_SID = config("TWILIO_ACCOUNT_SID", default="dummy")
 TWILIO_AUTH_TOKEN = config("TWILIO_AUTH_TOKEN", default="dummy")
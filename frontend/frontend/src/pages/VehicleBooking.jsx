@@ -17,6 +17,9 @@ import { GoogleMap, Marker, InfoWindow, Data } from "@react-google-maps/api";
 import { useNavigate, useLocation } from "react-router-dom";
 import axios from "axios";
 
+// Half-size, in degrees, of the area around the rider to receive live vehicles for
+const VIEWPORT_RADIUS_DEG = 0.2;
+
 const VehicleBooking = () => {
   const navigate = useNavigate();
   const location = useLocation();
@@ -154,15 +157,13 @@ const VehicleBooking = () => {
     }
   }, []);
 
-  // Fetch vehicle details from API
-  const fetchVehicleDetails = async (vehicleId) => {
+  // Fetch details for many drivers' vehicles in one request
+  const fetchVehicleDetails = async (driverIds) => {
     try {
-      const endpoint = selectedService === 'car'
-        ? `http://localhost:8000/api/car/driver/${vehicleId}/`
-        : `http://localhost:8000/api/bike/driver/${vehicleId}/`;
-
-      const response = await axios.get(endpoint);
-      return response.data;
+      const response = await axios.get('http://localhost:8000/api/vehicles/resolve/', {
+        params: { vehicle_type: selectedService, driver_ids: driverIds.join(',') }
+      });
+      return response.data.drivers;
     } catch (error) {
       console.error('Error fetching vehicle details:', error);
       return null;
@@ -176,12 +177,25 @@ const VehicleBooking = () => {
     const WS_URL = 'ws://localhost:8000/ws/bike/';
     const ws = new WebSocket(WS_URL);
 
+    // Local fleet picture: the server sends one snapshot, then only deltas
+    const fleet = new Map();
+    // Last sequence number seen per channel group the socket is subscribed to
+    let lastSeqs = {};
+    // Vehicle details per driver id, fetched once per vehicle instead of on every frame
+    const detailsByDriver = new Map();
+
     ws.onopen = () => {
       setConnectionStatus('connected');
+      // Only receive vehicles around the rider, not the whole country
       ws.send(JSON.stringify({
         type: 'subscribe',
-        vehicle_type: selectedService,
-        update_interval: 2000
+        bbox: [
+          userLocation.lat - VIEWPORT_RADIUS_DEG,
+          userLocation.lng - VIEWPORT_RADIUS_DEG,
+          userLocation.lat + VIEWPORT_RADIUS_DEG,
+          userLocation.lng + VIEWPORT_RADIUS_DEG
+        ],
+        vehicle_types: [selectedService]
       }));
     };
 
@@ -190,58 +204,88 @@ const VehicleBooking = () => {
         const data = JSON.parse(event.data);
         console.log("WebSocket data:", data)
 
-        if (data.type === 'batch_location_update' && Array.isArray(data.data)) {
-          // First filter by selected service type
-          const serviceVehicles = data.data.filter(item => item.vehicle_type === selectedService);
-          console.log("Filtered vehicles:", serviceVehicles, "selectedService:", selectedService);
-          setLiveVehicles(serviceVehicles);
-
-          const vehiclesWithDetails = await Promise.all(
-            serviceVehicles.map(async (vehicle) => {
-              const details = await fetchVehicleDetails(vehicle.id);
-              console.log("Vehicle details for id", vehicle.id, ":", details);
-              const distance = calculateDistance(
-                userLocation.lat,
-                userLocation.lng,
-                vehicle.latitude,
-                vehicle.longitude
-              );
-
-              return {
-                user_id,
-                ...vehicle,
-                ...(details || {}),
-                toCity,
-                fromCity,
-                position: { lat: vehicle.latitude, lng: vehicle.longitude },
-                vehicleSubType: selectedService === 'car' ? (details?.car_type || '') : (details?.bike_type || ''),
-                distanceFromUser: distance,
-                isLive: true
-              };
-            })
+        if (!Array.isArray(data.data)) return;
+
+        if (data.type === 'connection_established' || data.type === 'snapshot') {
+          fleet.clear();
+          lastSeqs = data.seqs || {};
+        } else if (['batch_location_update', 'vehicle_offline', 'vehicle_left'].includes(data.type)) {
+          // Frames from a group we already left are stale
+          if (!(data.group in lastSeqs)) return;
+          // Already covered by the snapshot (or a duplicate): never move lastSeqs backwards
+          if (data.seq <= lastSeqs[data.group]) return;
+          // A skipped sequence number means we missed a delta; ask for a fresh snapshot
+          if (data.seq > lastSeqs[data.group] + 1) {
+            ws.send(JSON.stringify({ type: 'resync' }));
+          }
+          lastSeqs[data.group] = data.seq;
+        } else {
+          return;
+        }
+        if (data.type === 'vehicle_offline' || data.type === 'vehicle_left') {
+          data.data.forEach(item => fleet.delete(`${item.vehicle_type}:${item.id}`));
+        } else {
+          data.data.forEach(item => fleet.set(`${item.vehicle_type}:${item.id}`, item));
+        }
+
+        // First filter by selected service type
+        const serviceVehicles = Array.from(fleet.values()).filter(item => item.vehicle_type === selectedService);
+        console.log("Filtered vehicles:", serviceVehicles, "selectedService:", selectedService);
+        setLiveVehicles(serviceVehicles);
+
+        const unknownIds = serviceVehicles
+          .map(vehicle => vehicle.id)
+          .filter(id => !detailsByDriver.has(id));
+        if (unknownIds.length > 0) {
+          const fetched = await fetchVehicleDetails(unknownIds);
+          if (fetched) {
+            // Remember misses too, so drivers without a vehicle are not asked for again
+            unknownIds.forEach(id => detailsByDriver.set(id, fetched[id] || null));
+          }
+        }
+
+        const vehiclesWithDetails = serviceVehicles.map((vehicle) => {
+          const details = detailsByDriver.get(vehicle.id);
+          const distance = calculateDistance(
+            userLocation.lat,
+            userLocation.lng,
+            vehicle.latitude,
+            vehicle.longitude
           );
 
-          console.log("vehiclesWithDetails:", vehiclesWithDetails);
+          return {
+            user_id,
+            ...vehicle,
+            ...(details || {}),
+            toCity,
+            fromCity,
+            position: { lat: vehicle.latitude, lng: vehicle.longitude },
+            vehicleSubType: selectedService === 'car' ? (details?.car_type || '') : (details?.bike_type || ''),
+            distanceFromUser: distance,
+            isLive: true
+          };
+        });
 
-          // Filter by the vehicle type passed from RideNowUI (if specified)
-          const filteredByType = vehicleType
-            ? vehiclesWithDetails.filter(v => {
-              // vehicle_type from API contains the sub-type (SUV, Sedan, Sport, etc.)
-              const vType = (v.vehicle_type || '').toLowerCase();
-              return vType === vehicleType.toLowerCase();
-            })
-            : vehiclesWithDetails;
+        console.log("vehiclesWithDetails:", vehiclesWithDetails);
 
-          console.log("filteredByType:", filteredByType, "vehicleType filter:", vehicleType);
+        // Filter by the vehicle type passed from RideNowUI (if specified)
+        const filteredByType = vehicleType
+          ? vehiclesWithDetails.filter(v => {
+            // vehicle_type from API contains the sub-type (SUV, Sedan, Sport, etc.)
+            const vType = (v.vehicle_type || '').toLowerCase();
+            return vType === vehicleType.toLowerCase();
+          })
+          : vehiclesWithDetails;
 
-          // Sort by distance
-          const sortedVehicles = [...filteredByType].sort((a, b) =>
-            a.distanceFromUser - b.distanceFromUser
-          );
-          console.log("Final vehicles:", sortedVehicles);
-          setVehicles(sortedVehicles);
-          setLoading(false);
-        }
+        console.log("filteredByType:", filteredByType, "vehicleType filter:", vehicleType);
+
+        // Sort by distance
+        const sortedVehicles = [...filteredByType].sort((a, b) =>
+          a.distanceFromUser - b.distanceFromUser
+        );
+        console.log("Final vehicles:", sortedVehicles);
+        setVehicles(sortedVehicles);
+        setLoading(false);
       } catch (error) {
         console.error('Error processing WebSocket message:', error);
       }